@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import logging
+import warnings
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Set, Union
+
+import mattermostautodriver
+
+from mmpy_bot.rate_limit import RateLimitedAsyncClient, RequestPriority, prioritized
+from mmpy_bot.wrappers import Message
+
+if TYPE_CHECKING:
+    from mmpy_bot.driver import Driver
+
+log = logging.getLogger("mmpy.async_driver")
+
+
+class AsyncDriver:
+    """Asyncio-native counterpart of the convenience functions of the Driver.
+
+    Requests are sent through a single pooled async HTTP client, so awaiting them from
+    an async listener doesn't block the event loop that also reads the websocket. The
+    client is created on first use and reuses the login of the wrapped Driver.
+
+    Arguments:
+    - driver: Driver, the (logged in) driver to send requests on behalf of.
+    """
+
+    def __init__(self, driver: Driver):
+        self.driver = driver
+        self._api: Optional[mattermostautodriver.AsyncDriver] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Keeps references to the tasks that close old clients
+        self._closing: Set[asyncio.Future] = set()
+
+    @property
+    def api(self) -> mattermostautodriver.AsyncDriver:
+        """The async mattermostautodriver of the running event loop, with the same
+        endpoints as the blocking Driver (e.g. `await api.posts.get_post(...)`)."""
+        loop = asyncio.get_running_loop()
+        # The pooled connections are bound to the loop that opened them.
+        if self._api is None or self._loop is not loop:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", DeprecationWarning)
+                api = mattermostautodriver.AsyncDriver(
+                    self.driver.options, client_cls=RateLimitedAsyncClient
+                )
+            api.client.rate_limiter = self.driver.rate_limiter
+            api.client.token = self.driver.client.token
+            api.client.cookies = self.driver.client.cookies
+            api.client.userid = self.driver.user_id
+            api.client.username = self.driver.username
+            if self._api is not None:
+                self._close_stale(self._api, self._loop)
+            self._api, self._loop = api, loop
+        return self._api
+
+    def _close_stale(self, api: mattermostautodriver.AsyncDriver, loop):
+        """Closes the client of an event loop that isn't used anymore."""
+        if loop is not None and loop.is_running():
+            # The old loop runs on another thread, so close the client there.
+            asyncio.run_coroutine_threadsafe(self._close_client(api), loop)
+        else:
+            task = asyncio.ensure_future(self._close_client(api))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close_client(api: mattermostautodriver.AsyncDriver):
+        try:
+            await api.client.close()
+        except Exception:
+            # E.g. the connections belong to an event loop that was closed already.
+            log.debug("Couldn't close the HTTP client cleanly.", exc_info=True)
+
+    async def close(self):
+        """Closes the pooled HTTP client."""
+        if self._api is not None:
+            api, self._api, self._loop = self._api, None, None
+            await self._close_client(api)
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """Blocking version of close, which can be called from any thread."""
+        loop = self._loop
+        if self._api is None or loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if loop.is_closed():
+            self._api, self._loop = None, None
+        elif running is loop:
+            # We can't block the loop that the client belongs to.
+            task = loop.create_task(self.close())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        elif loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self.close(), loop)
+            try:
+                future.result(timeout)
+            except concurrent.futures.TimeoutError:
+                log.warning("Timed out closing the HTTP client.")
+        else:
+            loop.run_until_complete(self.close())
+
+    async def create_post(
+        self,
+        channel_id: str,
+        message: str,
+        file_paths: Optional[Sequence[str]] = None,
+        root_id: str = "",
+        props: Optional[Dict] = None,
+        ephemeral_user_id: Optional[str] = None,
+    ):
+        """Async version of Driver.create_post."""
+        file_paths = file_paths or []
+        props = props or {}
+
+        file_ids = (
+            await self.upload_files(file_paths, channel_id)
+            if len(file_paths) > 0
+            else []
+        )
+
+        post = dict(
+            channel_id=channel_id,
+            message=message,
+            file_ids=file_ids,
+            root_id=root_id,
+            props=props,
+        )
+
+        if ephemeral_user_id:
+            return await self.api.posts.create_post_ephemeral(
+                {
+                    "user_id": ephemeral_user_id,
+                    "post": post,
+                }
+            )
+
+        return await self.api.posts.create_post(post)
+
+    async def get_post_thread(self, post_id: str):
+        """Async version of Driver.get_post_thread."""
+        thread_info = await self.api.posts.get_post_thread(post_id)
+
+        id_stamps = (
+            (id, int(post["create_at"])) for id, post in thread_info["posts"].items()
+        )
+        sorted_stamps = sorted(id_stamps, key=lambda x: x[-1])
+        thread_info["order"] = [id for id, stamp in sorted_stamps]
+        return thread_info
+
+    async def get_user_info(self, user_id: str):
+        """Async version of Driver.get_user_info."""
+        metadata = self.driver.metadata
+        user = metadata.users.get(user_id)
+        if user is None:
+            user = await self.api.users.get_user(user_id)
+            metadata.users.set(user_id, user)
+        return user
+
+    async def get_channel(self, channel_id: str):
+        """Async version of Driver.get_channel."""
+        channel = self.driver.metadata.channels.get(channel_id)
+        if channel is None:
+            channel = await self.api.channels.get_channel(channel_id)
+            self.driver.metadata.add_channel(channel)
+        return channel
+
+    async def get_channel_by_name(self, team_id: str, channel_name: str):
+        """Async version of Driver.get_channel_by_name."""
+        channel_id = self.driver.metadata.channel_ids.get((team_id, channel_name))
+        if channel_id is not None:
+            channel = await self.get_channel(channel_id)
+            if channel["name"] == channel_name:
+                return channel
+
+        channel = await self.api.channels.get_channel_by_name(team_id, channel_name)
+        self.driver.metadata.add_channel(channel)
+        return channel
+
+    async def get_team_member(self, team_id: str, user_id: str):
+        """Async version of Driver.get_team_member."""
+        metadata = self.driver.metadata
+        member = metadata.team_members.get((team_id, user_id))
+        if member is None:
+            member = await self.api.teams.get_team_member(team_id, user_id)
+            metadata.team_members.set((team_id, user_id), member)
+        return member
+
+    @prioritized(RequestPriority.HIGH)
+    async def react_to(self, message: Message, emoji_name: str):
+        """Async version of Driver.react_to."""
+        return await self.api.reactions.save_reaction(
+            {
+                "user_id": self.driver.user_id,
+                "post_id": message.id,
+                "emoji_name": emoji_name,
+            },
+        )
+
+    @prioritized(RequestPriority.HIGH)
+    async def reply_to(
+        self,
+        message: Message,
+        response: str,
+        file_paths: Optional[Sequence[str]] = None,
+        props: Optional[Dict] = None,
+        ephemeral: bool = False,
+        direct: bool = False,
+    ):
+        """Async version of Driver.reply_to."""
+        file_paths = file_paths or []
+        props = props or {}
+
+        if direct and not message.is_direct_message:
+            return await self.direct_message(
+                receiver_id=message.user_id,
+                message=response,
+                file_paths=file_paths,
+                props=props,
+                ephemeral_user_id=message.user_id if ephemeral else None,
+            )
+
+        return await self.create_post(
+            channel_id=message.channel_id,
+            message=response,
+            root_id=message.reply_id,
+            file_paths=file_paths,
+            props=props,
+            ephemeral_user_id=message.user_id if ephemeral else None,
+        )
+
+    @prioritized(RequestPriority.HIGH)
+    async def direct_message(
+        self,
+        receiver_id: str,
+        message: str,
+        file_paths: Optional[Sequence[str]] = None,
+        root_id: str = "",
+        props: Optional[Dict] = None,
+        ephemeral_user_id: Optional[str] = None,
+    ):
+        """Async version of Driver.direct_message."""
+        return await self.create_post(
+            channel_id=await self.get_direct_channel_id(receiver_id),
+            message=message,
+            root_id=root_id,
+            file_paths=file_paths,
+            props=props or {},
+            ephemeral_user_id=ephemeral_user_id,
+        )
+
+    async def get_direct_channel_id(self, user_id: str) -> str:
+        """Async version of Driver.get_direct_channel_id, sharing the same cache."""
+        channel_id = self.driver.dm_channels.get(user_id)
+        if channel_id is None:
+            channel = await self.api.channels.create_direct_channel(
+                [self.driver.user_id, user_id]
+            )
+            channel_id = channel["id"]
+            self.driver.dm_channels.set(user_id, channel_id)
+        return channel_id
+
+    async def upload_files(
+        self, file_paths: Sequence[Union[str, Path]], channel_id: str
+    ) -> List[str]:
+        """Async version of Driver.upload_files."""
+        # Reading the files from disk blocks as well, so do that on another thread.
+        contents = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [Path(path).read_bytes() for path in file_paths]
+        )
+        file_list = [
+            ("files", (Path(path).name, content))
+            for path, content in zip(file_paths, contents)
+        ]
+
+        result = await self.api.files.upload_file(
+            files=file_list, data={"channel_id": channel_id}
+        )
+        return [info["id"] for info in result["file_infos"]]
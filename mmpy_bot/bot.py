@@ -1,10 +1,12 @@
 import asyncio
 import logging
 import sys
-from typing import List, Optional, Union
+import time
+from typing import Dict, List, Optional, Union
 
 from mmpy_bot.driver import Driver
 from mmpy_bot.event_handler import EventHandler
+from mmpy_bot.job_store import SQLiteJobStore
 from mmpy_bot.plugins import (
     ExamplePlugin,
     HelpPlugin,
@@ -12,7 +14,9 @@ from mmpy_bot.plugins import (
     PluginManager,
     WebHookExample,
 )
+from mmpy_bot.scheduler import default_scheduler
 from mmpy_bot.settings import Settings
+from mmpy_bot.webhook_cluster import WebHookCluster
 from mmpy_bot.webhook_server import WebHookServer
 
 log = logging.getLogger("mmpy.bot")
@@ -51,7 +55,25 @@ class Bot:
                 "basepath": self.settings.MATTERMOST_API_PATH,
                 "keepalive": True,
                 "connect_kw_args": {"ping_interval": None},
-            }
+            },
+            num_threads=self.settings.THREADPOOL_MIN_WORKERS,
+            max_threads=self.settings.THREADPOOL_MAX_WORKERS,
+            threadpool_queue_size=self.settings.THREADPOOL_QUEUE_SIZE,
+            threadpool_target_wait=self.settings.THREADPOOL_TARGET_WAIT,
+            threadpool_idle_timeout=self.settings.THREADPOOL_IDLE_TIMEOUT,
+            threadpool_priority_aging=self.settings.THREADPOOL_PRIORITY_AGING,
+            replace_stuck_threads=self.settings.REPLACE_STUCK_WORKERS,
+            num_processes=self.settings.LISTENER_PROCESSES,
+            overload_policy=self.settings.OVERLOAD_POLICY,
+            offload_blocking_calls=self.settings.OFFLOAD_BLOCKING_DRIVER_CALLS,
+            dm_channel_cache_size=self.settings.DM_CHANNEL_CACHE_SIZE,
+            dm_channel_cache_ttl=self.settings.DM_CHANNEL_CACHE_TTL,
+            dm_channel_cache_file=self.settings.DM_CHANNEL_CACHE_FILE,
+            metadata_cache_size=self.settings.METADATA_CACHE_SIZE,
+            metadata_cache_ttl=self.settings.METADATA_CACHE_TTL,
+            rate_limit=self.settings.RATE_LIMIT_PER_SECOND,
+            rate_limit_burst=self.settings.RATE_LIMIT_BURST,
+            rate_limit_retries=self.settings.RATE_LIMIT_MAX_RETRIES,
         )
         self.driver.login()
         self.plugin_manager.initialize(self.driver, self.settings)
@@ -59,9 +81,12 @@ class Bot:
             self.driver, settings=self.settings, plugin_manager=self.plugin_manager
         )
         self.webhook_server = None
+        self.job_store = None
 
         if self.settings.WEBHOOK_HOST_ENABLED:
             self._initialize_webhook_server()
+        if self.settings.JOB_STORE_FILE:
+            self._initialize_job_store()
 
         self.running = False
 
@@ -98,10 +123,40 @@ class Bot:
             )
             logging.getLogger("").addHandler(self.console)
 
+    def _initialize_job_store(self):
+        # Persistent jobs may call methods of the driver and of any plugin.
+        default_scheduler.register_target("driver", self.driver)
+        for plugin in self.plugin_manager.plugins:
+            default_scheduler.register_target(plugin.__class__.__name__, plugin)
+        self.job_store = SQLiteJobStore(self.settings.JOB_STORE_FILE)
+        default_scheduler.load_jobs(
+            self.job_store, misfire_policy=self.settings.JOB_MISFIRE_POLICY
+        )
+
     def _initialize_webhook_server(self):
-        self.webhook_server = WebHookServer(
-            url=self.settings.WEBHOOK_HOST_URL, port=self.settings.WEBHOOK_HOST_PORT
+        kwargs = dict(
+            url=self.settings.WEBHOOK_HOST_URL,
+            port=self.settings.WEBHOOK_HOST_PORT,
+            response_timeout=self.settings.WEBHOOK_RESPONSE_TIMEOUT,
+            timeout_status=self.settings.WEBHOOK_TIMEOUT_STATUS,
+            batch_max_events=self.settings.WEBHOOK_BATCH_MAX_EVENTS,
+            socket_path=self.settings.WEBHOOK_UNIX_SOCKET,
         )
+        if self.settings.WEBHOOK_PROCESSES > 0:
+            self.webhook_server = WebHookCluster(
+                num_processes=self.settings.WEBHOOK_PROCESSES, **kwargs
+            )
+        else:
+            self.webhook_server = WebHookServer(**kwargs)
+        for path in self.settings.WEBHOOK_ROUTES:
+            self.webhook_server.add_route(path)
+        # Apply the response deadlines that listeners specified for their webhooks
+        for matcher, functions in self.plugin_manager.webhook_listeners.items():
+            for function in functions:
+                if (function.response_timeout, function.timeout_status) != (None, None):
+                    self.webhook_server.set_response_deadline(
+                        matcher, function.response_timeout, function.timeout_status
+                    )
         self.driver.register_webhook_server(self.webhook_server)
         # Schedule the queue loop to the current event loop so that it starts together
         # with self.init_websocket.
@@ -117,10 +172,14 @@ class Bot:
             self.driver.threadpool.start()
             # Start a thread to run potential scheduled jobs
             self.driver.threadpool.start_scheduler_thread(
-                self.settings.SCHEDULER_PERIOD
+                self.settings.SCHEDULER_PERIOD,
+                max_workers=self.settings.SCHEDULER_WORKERS,
+                max_processes=self.settings.SCHEDULER_PROCESSES,
             )
-            # Start the webhook server on a separate thread if necessary
-            if self.settings.WEBHOOK_HOST_ENABLED:
+            # Start the webhook server on a separate thread (or processes) if necessary
+            if isinstance(self.webhook_server, WebHookCluster):
+                self.webhook_server.start()
+            elif self.settings.WEBHOOK_HOST_ENABLED:
                 self.driver.threadpool.start_webhook_server_thread(self.webhook_server)
 
             # Trigger "start" methods on every plugin
@@ -137,19 +196,62 @@ class Bot:
             # receive a KeyboardInterrupt, shut down the bot.
             self.stop()
 
-    def stop(self):
+    def stop(self, timeout: Optional[float] = None) -> Dict[str, int]:
+        """Stops accepting websocket and webhook events, waits at most timeout seconds
+        (SHUTDOWN_TIMEOUT by default) for the work that is queued or in progress, then
+        cancels what's left and shuts down the bot.
+
+        Returns how much work was abandoned: listener calls on the event loop and in
+        listener processes, tasks queued or running on the threadpool, and scheduled
+        jobs.
+        """
         if not self.running:
-            return
+            return {}
+
+        if timeout is None:
+            timeout = self.settings.SHUTDOWN_TIMEOUT
+        deadline = time.monotonic() + timeout
 
-        log.info("Stopping bot.")
+        def remaining() -> float:
+            return max(deadline - time.monotonic(), 0)
+
+        log.info(f"Stopping bot, waiting up to {timeout}s for running work.")
+
+        # Turn away new events, then let the work that's already there finish.
+        if isinstance(self.webhook_server, (WebHookServer, WebHookCluster)):
+            self.webhook_server.draining = True
+        abandoned = {"listeners": self.event_handler.stop(remaining())}
+        abandoned.update(self.driver.threadpool.stop(remaining()))
+        abandoned["process_listeners"] = self.driver.process_executor.stop(remaining())
+        if any(abandoned.values()):
+            log.warning(
+                "Abandoned unfinished work on shutdown: "
+                + ", ".join(f"{key}={value}" for key, value in abandoned.items()),
+                extra={"event": "shutdown_abandoned", **abandoned},
+            )
+
+        # Detach the job store first, so plugins that clear their jobs in on_stop
+        # don't delete the persisted ones.
+        if self.job_store is not None:
+            default_scheduler.store = None
+            self.job_store.close()
 
         # Shutdown the running plugins
         self.plugin_manager.stop()
 
-        # Stop the threadpool
-        self.driver.threadpool.stop()
+        if isinstance(self.webhook_server, WebHookCluster) and (
+            self.webhook_server.running
+        ):
+            self.webhook_server.stop()
+
+        # Close the pooled connections of the async driver
+        self.driver.async_driver.shutdown(max(remaining(), 1))
+
+        # Keep cached data around for the next run
+        self.driver.save_caches()
 
         # Stops the main driver loop
         self.driver.disconnect()
 
         self.running = False
+        return abandoned
@@ -0,0 +1,228 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple, Union
+
+from mmpy_bot.utils import json_loads
+
+log = logging.getLogger("mmpy.cache")
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe mapping with a bounded size and optional time-to-live.
+
+    Once the cache is full, the least recently used entry is evicted. Entries older
+    than the TTL are treated as missing. Since the expiry times are wall-clock based,
+    the contents can be saved and loaded again after a restart.
+
+    Arguments:
+    - max_size: int, maximum number of entries, 0 means unbounded.
+    - ttl: float, number of seconds after which an entry expires, 0 means never.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (value, expiry timestamp or None)
+        self._entries: OrderedDict[Hashable, Tuple[Any, Optional[float]]] = (
+            OrderedDict()
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value, expires_at = self._entries.get(key, (_MISSING, None))
+            if value is not _MISSING and expires_at is not None:
+                if expires_at <= time.time():
+                    del self._entries[key]
+                    value = _MISSING
+
+            if value is _MISSING:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Stores a value, optionally with a different TTL than the default one."""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            while self.max_size and len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def update(self, items: Union[Dict, Iterable[Tuple[Hashable, Any]]]):
+        for key, value in dict(items).items():
+            self.set(key, value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value, _ = self._entries.pop(key, (default, None))
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[1] is None or entry[1] > time.time())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of entries, hits and misses of this cache."""
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+    def save(self, path: Union[str, Path], owner: Optional[str] = None):
+        """Writes the entries that haven't expired yet to the given JSON file. Keys are
+        stored as strings.
+
+        Arguments:
+        - path: str or Path, the file to write.
+        - owner: str, optional identity the entries belong to, e.g. the bot user id.
+            The file is only loaded again for the same owner.
+        """
+        now = time.time()
+        with self._lock:
+            entries = [
+                [key, value, expires_at]
+                for key, (value, expires_at) in self._entries.items()
+                if expires_at is None or expires_at > now
+            ]
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        data = entries if owner is None else {"owner": owner, "entries": entries}
+        tmp_path.write_text(json.dumps(data))
+        tmp_path.replace(path)
+
+    def load(self, path: Union[str, Path], owner: Optional[str] = None):
+        """Adds the entries saved to the given JSON file, if it exists and was saved
+        for the same owner."""
+        path = Path(path)
+        if not path.exists():
+            return
+        try:
+            data = json.loads(path.read_text())
+        except ValueError:
+            log.warning(f"Ignoring invalid cache file {path}.")
+            return
+        if isinstance(data, dict):
+            saved_owner, entries = data.get("owner"), data.get("entries", [])
+        else:
+            saved_owner, entries = None, data
+        if saved_owner != owner:
+            log.info(f"Ignoring cache file {path}, it was saved for {saved_owner}.")
+            return
+
+        now = time.time()
+        with self._lock:
+            for key, value, expires_at in entries:
+                if expires_at is None or expires_at > now:
+                    self._entries[key] = (value, expires_at)
+                    self._entries.move_to_end(key)
+            while self.max_size and len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class MetadataCache:
+    """Caches users, channels and team memberships fetched from the Mattermost API.
+
+    Entries expire after the TTL, but are also invalidated as soon as a websocket event
+    reports that they changed, see handle_event.
+
+    Arguments:
+    - max_size: int, maximum number of entries per kind of metadata.
+    - ttl: float, number of seconds after which an entry expires, 0 means never.
+    """
+
+    # Websocket events that invalidate cached metadata
+    EVENTS = {
+        "user_updated",
+        "channel_updated",
+        "channel_converted",
+        "channel_deleted",
+        "added_to_team",
+        "leave_team",
+        "memberrole_updated",
+    }
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300):
+        # user id -> user
+        self.users = LRUCache(max_size=max_size, ttl=ttl)
+        # channel id -> channel
+        self.channels = LRUCache(max_size=max_size, ttl=ttl)
+        # (team id, channel name) -> channel id
+        self.channel_ids = LRUCache(max_size=max_size, ttl=ttl)
+        # (team id, user id) -> team member
+        self.team_members = LRUCache(max_size=max_size, ttl=ttl)
+
+    def add_channel(self, channel: Dict):
+        self.channels.set(channel["id"], channel)
+        self.channel_ids.set(
+            (channel.get("team_id", ""), channel["name"]), channel["id"]
+        )
+
+    def invalidate_user(self, user_id: str):
+        self.users.pop(user_id)
+
+    def invalidate_channel(self, channel_id: str):
+        channel = self.channels.pop(channel_id)
+        if channel is not None:
+            self.channel_ids.pop((channel.get("team_id", ""), channel["name"]))
+
+    def invalidate_team_member(self, team_id: str, user_id: str):
+        self.team_members.pop((team_id, user_id))
+
+    def handle_event(self, event: Dict):
+        """Invalidates the entries that a decoded websocket event reports a change
+        of."""
+        event_type = event.get("event")
+        data = event.get("data", {})
+        broadcast = event.get("broadcast", {})
+
+        if event_type == "user_updated":
+            self.invalidate_user(data.get("user", {}).get("id"))
+        elif event_type in ("channel_updated", "channel_converted", "channel_deleted"):
+            channel = data.get("channel")
+            if isinstance(channel, str):
+                # Like posts, channels are sent as nested JSON strings
+                channel = json_loads(channel)
+            channel_id = (
+                (channel or {}).get("id")
+                or data.get("channel_id")
+                or broadcast.get("channel_id")
+            )
+            self.invalidate_channel(channel_id)
+        elif event_type in ("added_to_team", "leave_team"):
+            self.invalidate_team_member(
+                data.get("team_id") or broadcast.get("team_id"),
+                data.get("user_id") or broadcast.get("user_id"),
+            )
+        elif event_type == "memberrole_updated":
+            member = data.get("member")
+            if isinstance(member, str):
+                member = json_loads(member)
+            member = member or {}
+            self.invalidate_team_member(member.get("team_id"), member.get("user_id"))
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Returns the size, hits and misses of each kind of metadata."""
+        return {
+            "users": self.users.stats(),
+            "channels": self.channels.stats(),
+            "channel_ids": self.channel_ids.stats(),
+            "team_members": self.team_members.stats(),
+        }
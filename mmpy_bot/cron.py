@@ -0,0 +1,190 @@
+import bisect
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+# Names that may be used instead of numbers in the month and day of week fields
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun"]
+MONTHS += ["jul", "aug", "sep", "oct", "nov", "dec"]
+WEEKDAYS = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+# How far ahead to look for the next matching time before giving up, e.g. for
+# "0 0 30 2 *"
+MAX_YEARS = 8
+
+
+def _parse_value(value: str, names: Optional[List[str]], offset: int) -> int:
+    if names is not None and value.lower() in names:
+        return names.index(value.lower()) + offset
+    if not value.isdigit():
+        raise ValueError(f"Invalid value {value!r}")
+    return int(value)
+
+
+def _parse_field(
+    field: str, low: int, high: int, names: Optional[List[str]] = None, offset: int = 0
+) -> Tuple[Tuple[int, ...], bool]:
+    """Returns the sorted values that a cron field matches, and whether it is a
+    wildcard."""
+    values = set()
+    for part in field.split(","):
+        range_, _, step = part.partition("/")
+        if range_ == "*":
+            start, end = low, high
+        elif "-" in range_:
+            first, last = range_.split("-", 1)
+            start = _parse_value(first, names, offset)
+            end = _parse_value(last, names, offset)
+        else:
+            start = end = _parse_value(range_, names, offset)
+            if step:
+                end = high
+        if not (low <= start <= high and low <= end <= high) or start > end:
+            raise ValueError(f"{part!r} is out of range {low}-{high}")
+        if step and (not step.isdigit() or int(step) == 0):
+            raise ValueError(f"Invalid step in {part!r}")
+        values.update(range(start, end + 1, int(step or 1)))
+    return tuple(sorted(values)), field.startswith("*")
+
+
+class CronExpression:
+    """A compiled cron expression, which calculates the times it matches.
+
+    The expression has the five usual fields: minute, hour, day of month, month and
+    day of week. Fields can hold numbers, names (jan-dec, sun-sat), lists (1,15),
+    ranges (mon-fri), steps (*/5, 8-18/2) and the wildcard *. The aliases @yearly,
+    @monthly, @weekly, @daily and @hourly are supported as well. Like cron, a time
+    matches if either the day of month or the day of week matches when both fields
+    are restricted.
+
+    Arguments:
+    - expression: str, e.g. "30 9 * * mon-fri".
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = ALIASES.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(
+                f"Cron expression {expression!r} should have 5 fields, not {len(fields)}"
+            )
+        try:
+            self.minutes, _ = _parse_field(fields[0], 0, 59)
+            self.hours, _ = _parse_field(fields[1], 0, 23)
+            days, any_day = _parse_field(fields[2], 1, 31)
+            months, _ = _parse_field(fields[3], 1, 12, MONTHS, offset=1)
+            weekdays, any_weekday = _parse_field(fields[4], 0, 7, WEEKDAYS)
+        except ValueError as e:
+            raise ValueError(f"Invalid cron expression {expression!r}: {e}") from None
+
+        self.days = frozenset(days)
+        self.months = frozenset(months)
+        # Cron counts from Sunday (0 or 7), datetime.weekday from Monday.
+        self.weekdays = frozenset((weekday - 1) % 7 for weekday in weekdays)
+        self._any_day = any_day
+        self._any_weekday = any_weekday
+
+        if self.next_after(datetime(2000, 1, 1)) is None:
+            raise ValueError(f"Cron expression {expression!r} never matches")
+
+    def __repr__(self):
+        return f"CronExpression({self.expression!r})"
+
+    def matches_day(self, day: date) -> bool:
+        if day.month not in self.months:
+            return False
+        in_month = day.day in self.days
+        in_week = day.weekday() in self.weekdays
+        if self._any_day:
+            return in_week
+        if self._any_weekday:
+            return in_month
+        return in_month or in_week
+
+    def next_after(self, moment: datetime) -> Optional[datetime]:
+        """Returns the first matching time after moment, or None if there is none
+        within the next years."""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = moment.date()
+        hour, minute = moment.hour, moment.minute
+        last_day = day + timedelta(days=366 * MAX_YEARS)
+
+        while day <= last_day:
+            if day.month not in self.months:
+                # Jump to the first day of the next month.
+                day = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+                hour = minute = 0
+                continue
+            if self.matches_day(day):
+                i = bisect.bisect_left(self.hours, hour)
+                if i < len(self.hours):
+                    if self.hours[i] != hour:
+                        minute = 0
+                    j = bisect.bisect_left(self.minutes, minute)
+                    if j < len(self.minutes):
+                        return moment.replace(
+                            year=day.year,
+                            month=day.month,
+                            day=day.day,
+                            hour=self.hours[i],
+                            minute=self.minutes[j],
+                        )
+                    if i + 1 < len(self.hours):
+                        return moment.replace(
+                            year=day.year,
+                            month=day.month,
+                            day=day.day,
+                            hour=self.hours[i + 1],
+                            minute=self.minutes[0],
+                        )
+            day += timedelta(days=1)
+            hour = minute = 0
+        return None
+
+
+class CronSchedule:
+    """The times at which any of several cron expressions match, except on the given
+    dates, e.g. holidays.
+
+    Arguments:
+    - expressions: Sequence[str], the cron expressions.
+    - exclude: Iterable[date], days on which nothing matches.
+    """
+
+    def __init__(self, expressions: Sequence[str], exclude: Iterable[date] = ()):
+        if not expressions:
+            raise ValueError("At least one cron expression is required")
+        self.expressions = [CronExpression(expression) for expression in expressions]
+        self.exclude = frozenset(exclude)
+
+    def next_after(self, moment: datetime) -> Optional[datetime]:
+        while True:
+            times = [expression.next_after(moment) for expression in self.expressions]
+            times = [time for time in times if time is not None]
+            if not times:
+                return None
+            moment = min(times)
+            if moment.date() not in self.exclude:
+                return moment
+            # Skip the rest of the excluded day at once.
+            moment = datetime.combine(moment.date(), datetime.max.time())
+
+    def count_between(self, start: datetime, end: datetime, limit: int = 1000) -> int:
+        """Returns how many times match from start up to end, but at most limit."""
+        count = 0
+        moment: Optional[datetime] = start - timedelta(minutes=1)
+        while count < limit:
+            moment = self.next_after(moment)  # type: ignore
+            if moment is None or moment > end:
+                break
+            count += 1
+        return count
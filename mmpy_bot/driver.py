@@ -1,3 +1,6 @@
+import asyncio
+import functools
+import logging
 import queue
 import warnings
 from pathlib import Path
@@ -5,38 +8,192 @@ from typing import Dict, List, Optional, Sequence, Union
 
 import mattermostautodriver
 from aiohttp.client import ClientSession
-
+from aiohttp.connector import UnixConnector
+
+from mmpy_bot.async_driver import AsyncDriver
+from mmpy_bot.cache import LRUCache, MetadataCache
+from mmpy_bot.limiter import OverloadPolicy
+from mmpy_bot.process_executor import ProcessExecutor
+from mmpy_bot.rate_limit import (
+    RateLimitedClient,
+    RateLimiter,
+    RequestPriority,
+    prioritized,
+)
 from mmpy_bot.threadpool import ThreadPool
+from mmpy_bot.webhook_cluster import WebHookCluster
 from mmpy_bot.webhook_server import WebHookServer
 from mmpy_bot.wrappers import Message, WebHookEvent
 
+log = logging.getLogger("mmpy.driver")
+
+
+def _blocking_request(function):
+    """Marks a Driver method that blocks on HTTP requests.
+
+    When such a method is called from a coroutine running on the event loop, it stalls
+    every other coroutine, including the websocket reader. Depending on
+    Driver.offload_blocking_calls, the call is either moved to the default executor (and
+    an awaitable future is returned instead of the result), or a warning is logged that
+    points to the async alternative.
+    """
+    name = function.__name__
+
+    def log_exception(future: asyncio.Future):
+        # Callers often don't await the future, so don't let errors get lost.
+        if not future.cancelled() and (exception := future.exception()) is not None:
+            log.error(
+                f"Offloaded call Driver.{name} failed",
+                exc_info=(type(exception), exception, exception.__traceback__),
+            )
+
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not on an event loop, so blocking is fine.
+            return function(self, *args, **kwargs)
+
+        if self.offload_blocking_calls:
+            future = loop.run_in_executor(
+                None, functools.partial(function, self, *args, **kwargs)
+            )
+            future.add_done_callback(log_exception)
+            return future
+        if name not in self._blocking_warned:
+            self._blocking_warned.add(name)
+            log.warning(
+                f"Blocking call Driver.{name} was made on the event loop, which holds "
+                f"up all other events. Use `await driver.a{name}(...)` instead."
+            )
+        return function(self, *args, **kwargs)
+
+    return wrapper
+
 
 class Driver(mattermostautodriver.Driver):
     user_id: str = ""
     username: str = ""
 
-    def __init__(self, *args, num_threads=10, **kwargs):
+    def __init__(
+        self,
+        *args,
+        num_threads=10,
+        max_threads=0,
+        threadpool_queue_size=0,
+        threadpool_target_wait=0.1,
+        threadpool_idle_timeout=60.0,
+        threadpool_priority_aging=10.0,
+        replace_stuck_threads=True,
+        num_processes=0,
+        overload_policy=OverloadPolicy.BLOCK,
+        offload_blocking_calls=False,
+        dm_channel_cache_size=10000,
+        dm_channel_cache_ttl=0,
+        dm_channel_cache_file=None,
+        metadata_cache_size=10000,
+        metadata_cache_ttl=300,
+        rate_limit=0,
+        rate_limit_burst=100,
+        rate_limit_retries=5,
+        **kwargs,
+    ):
         """Wrapper around the mattermostautodriver Driver with some convenience
         functions and attributes.
 
         Arguments:
         - num_threads: int, number of threads to use for the default worker threadpool.
+        - max_threads: int, number of threads the threadpool may grow to while tasks
+            wait longer than threadpool_target_wait seconds. Defaults to num_threads.
+        - threadpool_queue_size: int, maximum number of tasks waiting for a worker
+            thread, 0 means unlimited.
+        - threadpool_target_wait: float, see max_threads.
+        - threadpool_idle_timeout: float, seconds after which idle threads above
+            num_threads stop.
+        - threadpool_priority_aging: float, how many seconds of waiting make up for
+            one level of TaskPriority in the threadpool queue.
+        - replace_stuck_threads: bool, whether to replace threads that are stuck on a
+            task past its timeout.
+        - num_processes: int, number of processes to run listeners with the "process"
+            executor on, 0 means one per CPU. They are started when first needed.
+        - overload_policy: OverloadPolicy, what to do when the threadpool queue is full.
+        - offload_blocking_calls: bool, whether blocking calls like reply_to that are
+            made on the event loop should run on a worker thread instead. They then
+            return an awaitable future rather than the result.
+        - dm_channel_cache_size: int, how many direct channel ids to remember.
+        - dm_channel_cache_ttl: float, seconds after which a cached direct channel id
+            expires, 0 means never.
+        - dm_channel_cache_file: str, optional JSON file to keep the cached direct
+            channel ids in across restarts, see save_caches().
+        - metadata_cache_size: int, how many users, channels and team members to cache.
+        - metadata_cache_ttl: float, seconds after which cached metadata expires, 0
+            means never. Changes reported over the websocket invalidate entries sooner.
+        - rate_limit: float, maximum number of API requests per second, shared by all
+            threads and coroutines. 0 (the default) disables the pacing.
+        - rate_limit_burst: int, number of requests that may be sent at once.
+        - rate_limit_retries: int, how often to retry a request rejected with 429.
         """
+        kwargs.setdefault("client_cls", RateLimitedClient)
         super().__init__(*args, **kwargs)
-        self.threadpool = ThreadPool(num_workers=num_threads)
+        # Paces the requests of both this driver and the async driver
+        self.rate_limiter = RateLimiter(
+            rate=rate_limit, burst=rate_limit_burst, max_retries=rate_limit_retries
+        )
+        self.client.rate_limiter = self.rate_limiter
+        self.threadpool = ThreadPool(
+            num_workers=num_threads,
+            max_queue_size=threadpool_queue_size,
+            overload_policy=overload_policy,
+            max_workers=max_threads,
+            target_queue_wait=threadpool_target_wait,
+            idle_timeout=threadpool_idle_timeout,
+            priority_aging=threadpool_priority_aging,
+            replace_stuck_workers=replace_stuck_threads,
+        )
+        self.process_executor = ProcessExecutor(self, num_processes=num_processes)
         # Queue to communicate with the WebHookServer
         self.response_queue: Optional[queue.Queue] = None
         self.webhook_url = None
+        self.webhook_socket_path: Optional[str] = None
+        # Async versions of the convenience functions, e.g. await driver.areply_to()
+        self.async_driver = AsyncDriver(self)
+        self.offload_blocking_calls = offload_blocking_calls
+        self._blocking_warned = set()
+        # Maps user ids to the id of the direct channel between them and the bot
+        self.dm_channels = LRUCache(
+            max_size=dm_channel_cache_size, ttl=dm_channel_cache_ttl
+        )
+        # Loaded on login, since the cached channels only belong to this bot user
+        self.dm_channel_cache_file = dm_channel_cache_file
+        # Users, channels and team members, shared with the async driver functions
+        self.metadata = MetadataCache(
+            max_size=metadata_cache_size, ttl=metadata_cache_ttl
+        )
 
     def login(self, *args, **kwargs):
         super().login(*args, **kwargs)
         self.user_id = self.client._userid
         self.username = self.client._username
+        self.load_caches()
+
+    def load_caches(self):
+        """Loads the direct channel ids persisted for the current bot user, if a cache
+        file was configured."""
+        if self.dm_channel_cache_file and self.user_id:
+            self.dm_channels.load(self.dm_channel_cache_file, owner=self.user_id)
 
-    def register_webhook_server(self, server: WebHookServer):
+    def save_caches(self):
+        """Persists the cached direct channel ids, if a cache file was configured."""
+        if self.dm_channel_cache_file and self.user_id:
+            self.dm_channels.save(self.dm_channel_cache_file, owner=self.user_id)
+
+    def register_webhook_server(self, server: Union[WebHookServer, WebHookCluster]):
         self.response_queue = server.response_queue
         self.webhook_url = f"{server.url}:{server.port}/hooks"
+        self.webhook_socket_path = server.socket_path
 
+    @_blocking_request
     def create_post(
         self,
         channel_id: str,
@@ -83,6 +240,7 @@ class Driver(mattermostautodriver.Driver):
         )
         return self.get_post_thread(post_id)
 
+    @_blocking_request
     def get_post_thread(self, post_id: str):
         """Wrapper around driver.posts.get_post_thread, which for some reason returns
         duplicate and wrongly ordered entries in the ordered list."""
@@ -97,10 +255,50 @@ class Driver(mattermostautodriver.Driver):
         thread_info["order"] = [id for id, stamp in sorted_stamps]
         return thread_info
 
+    @_blocking_request
     def get_user_info(self, user_id: str):
         """Returns a dictionary of user info."""
-        return self.users.get_user(user_id)
-
+        user = self.metadata.users.get(user_id)
+        if user is None:
+            user = self.users.get_user(user_id)
+            self.metadata.users.set(user_id, user)
+        return user
+
+    @_blocking_request
+    def get_channel(self, channel_id: str):
+        """Returns a dictionary of channel info."""
+        channel = self.metadata.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels.get_channel(channel_id)
+            self.metadata.add_channel(channel)
+        return channel
+
+    @_blocking_request
+    def get_channel_by_name(self, team_id: str, channel_name: str):
+        """Returns a dictionary of channel info of the channel with the given name."""
+        channel_id = self.metadata.channel_ids.get((team_id, channel_name))
+        if channel_id is not None:
+            channel = self.get_channel(channel_id)
+            # The channel may have been renamed since.
+            if channel["name"] == channel_name:
+                return channel
+
+        channel = self.channels.get_channel_by_name(team_id, channel_name)
+        self.metadata.add_channel(channel)
+        return channel
+
+    @_blocking_request
+    def get_team_member(self, team_id: str, user_id: str):
+        """Returns the membership of the given user in the given team, including their
+        roles."""
+        member = self.metadata.team_members.get((team_id, user_id))
+        if member is None:
+            member = self.teams.get_team_member(team_id, user_id)
+            self.metadata.team_members.set((team_id, user_id), member)
+        return member
+
+    @_blocking_request
+    @prioritized(RequestPriority.HIGH)
     def react_to(self, message: Message, emoji_name: str):
         """Adds an emoji reaction to the given message."""
         return self.reactions.save_reaction(
@@ -111,6 +309,8 @@ class Driver(mattermostautodriver.Driver):
             },
         )
 
+    @_blocking_request
+    @prioritized(RequestPriority.HIGH)
     def reply_to(
         self,
         message: Message,
@@ -154,6 +354,8 @@ class Driver(mattermostautodriver.Driver):
 
         return self.create_post(**reply_args)
 
+    @_blocking_request
+    @prioritized(RequestPriority.HIGH)
     def direct_message(
         self,
         receiver_id: str,
@@ -163,15 +365,10 @@ class Driver(mattermostautodriver.Driver):
         props: Optional[Dict] = None,
         ephemeral_user_id: Optional[str] = None,
     ):
-        # Private/direct messages are sent to a special channel that
-        # includes the bot and the recipient
-        direct_id = self.channels.create_direct_channel([self.user_id, receiver_id])[
-            "id"
-        ]
         props = props or {}
 
         return self.create_post(
-            channel_id=direct_id,
+            channel_id=self.get_direct_channel_id(receiver_id),
             message=message,
             root_id=root_id,
             file_paths=file_paths,
@@ -179,6 +376,86 @@ class Driver(mattermostautodriver.Driver):
             ephemeral_user_id=ephemeral_user_id,
         )
 
+    @_blocking_request
+    def get_direct_channel_id(self, user_id: str) -> str:
+        """Returns the id of the direct channel between the bot and the given user.
+
+        Private/direct messages are sent to a special channel that includes the bot and
+        the recipient. Its id never changes, so it is cached after the first lookup.
+        """
+        channel_id = self.dm_channels.get(user_id)
+        if channel_id is None:
+            channel = self.channels.create_direct_channel([self.user_id, user_id])
+            channel_id = channel["id"]
+            self.dm_channels.set(user_id, channel_id)
+        return channel_id
+
+    def prewarm_direct_channels(self, user_ids: Optional[Sequence[str]] = None):
+        """Fills the direct channel cache in bulk.
+
+        All direct channels the bot is already a member of are fetched with a single
+        request. If user_ids are given, direct channels with any of those users that
+        don't exist yet are created as well.
+        """
+        for channel in self.channels.get_channels_for_user(self.user_id):
+            if channel.get("type") != "D":
+                continue
+            # Direct channel names consist of both user ids: "<user_id>__<user_id>"
+            members = channel["name"].split("__")
+            other = [member for member in members if member != self.user_id]
+            self.dm_channels.set(other[0] if other else self.user_id, channel["id"])
+
+        for user_id in user_ids or []:
+            self.get_direct_channel_id(user_id)
+
+    async def acreate_post(self, *args, **kwargs):
+        """Async version of create_post that doesn't block the event loop."""
+        return await self.async_driver.create_post(*args, **kwargs)
+
+    async def aget_post_thread(self, post_id: str):
+        """Async version of get_post_thread that doesn't block the event loop."""
+        return await self.async_driver.get_post_thread(post_id)
+
+    async def aget_user_info(self, user_id: str):
+        """Async version of get_user_info that doesn't block the event loop."""
+        return await self.async_driver.get_user_info(user_id)
+
+    async def aget_channel(self, channel_id: str):
+        """Async version of get_channel that doesn't block the event loop."""
+        return await self.async_driver.get_channel(channel_id)
+
+    async def aget_channel_by_name(self, team_id: str, channel_name: str):
+        """Async version of get_channel_by_name that doesn't block the event loop."""
+        return await self.async_driver.get_channel_by_name(team_id, channel_name)
+
+    async def aget_team_member(self, team_id: str, user_id: str):
+        """Async version of get_team_member that doesn't block the event loop."""
+        return await self.async_driver.get_team_member(team_id, user_id)
+
+    async def areact_to(self, message: Message, emoji_name: str):
+        """Async version of react_to that doesn't block the event loop."""
+        return await self.async_driver.react_to(message, emoji_name)
+
+    async def areply_to(self, message: Message, response: str, *args, **kwargs):
+        """Async version of reply_to that doesn't block the event loop."""
+        return await self.async_driver.reply_to(message, response, *args, **kwargs)
+
+    async def adirect_message(self, receiver_id: str, message: str, *args, **kwargs):
+        """Async version of direct_message that doesn't block the event loop."""
+        return await self.async_driver.direct_message(
+            receiver_id, message, *args, **kwargs
+        )
+
+    async def aget_direct_channel_id(self, user_id: str) -> str:
+        """Async version of get_direct_channel_id that doesn't block the event loop."""
+        return await self.async_driver.get_direct_channel_id(user_id)
+
+    async def aupload_files(
+        self, file_paths: Sequence[Union[str, Path]], channel_id: str
+    ) -> List[str]:
+        """Async version of upload_files that doesn't block the event loop."""
+        return await self.async_driver.upload_files(file_paths, channel_id)
+
     def respond_to_web(self, event: WebHookEvent, response):
         """Send a web response to the given WebHookEvent."""
         self.response_queue.put((event.request_id, response))
@@ -189,12 +466,18 @@ class Driver(mattermostautodriver.Driver):
         if not self.webhook_url:
             raise ValueError("The Driver is not aware of any running webhook server!")
 
-        async with ClientSession() as session:
+        connector = (
+            UnixConnector(path=self.webhook_socket_path)
+            if self.webhook_socket_path
+            else None
+        )
+        async with ClientSession(connector=connector) as session:
             return await session.post(
                 f"{self.webhook_url}/{webhook_id}",
                 json=data,
             )
 
+    @_blocking_request
     def upload_files(
         self, file_paths: Sequence[Union[str, Path]], channel_id: str
     ) -> List[str]:
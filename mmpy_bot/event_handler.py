@@ -1,17 +1,26 @@
 import asyncio
-import json
 import logging
-import queue
 import re
+from typing import Any, Dict, Optional, Set
 
+from mmpy_bot.cache import MetadataCache
 from mmpy_bot.driver import Driver
+from mmpy_bot.function import Function
+from mmpy_bot.limiter import ConcurrencyLimiter, OverloadPolicy
 from mmpy_bot.plugins import PluginManager
 from mmpy_bot.settings import Settings
+from mmpy_bot.utils import AsyncQueue, json_loads
 from mmpy_bot.webhook_server import NoResponse
-from mmpy_bot.wrappers import Message, WebHookEvent
+from mmpy_bot.wrappers import EventWrapper, Message, WebHookEvent
 
 log = logging.getLogger("mmpy.event_handler")
 
+# Websocket events that are decoded and handled, all others are discarded.
+HANDLED_EVENTS = {"posted", *MetadataCache.EVENTS}
+# Matches the type of a raw websocket event without decoding it. Mattermost serializes
+# the event type first; if it doesn't, the event is decoded as a whole instead.
+_EVENT_TYPE = re.compile(r'^\s*\{\s*"event"\s*:\s*"([^"\\]*)"')
+
 
 class EventHandler:
     def __init__(
@@ -30,6 +39,18 @@ class EventHandler:
 
         self._name_matcher = re.compile(rf"^@?{self.driver.username}[:,]?\s?")
 
+        self.limiter = ConcurrencyLimiter(
+            max_concurrent=settings.MAX_CONCURRENT_LISTENERS,
+            max_per_key=settings.MAX_CONCURRENT_LISTENERS_PER_PLUGIN,
+            max_pending=settings.MAX_PENDING_LISTENERS,
+            policy=settings.OVERLOAD_POLICY,
+        )
+        # Keep references to running listener tasks so they aren't garbage collected
+        self._tasks: Set[asyncio.Task] = set()
+        self._replies: Set[asyncio.Task] = set()
+        # Cleared once the bot shuts down, after which new events are ignored
+        self.accepting = True
+
     def start(self):
         # This is blocking, will loop forever
         self.driver.init_websocket(self._handle_event)
@@ -41,69 +62,197 @@ class EventHandler:
             in (name.lower() for name in self.settings.IGNORE_USERS)
         ) or (self.ignore_own_messages and message.sender_name == self.driver.username)
 
-    async def _check_queue_loop(self, webhook_queue: queue.Queue):
+    async def _check_queue_loop(self, webhook_queue: AsyncQueue):
         log.info("EventHandlerWebHook queue listener started.")
         while True:
-            try:
-                event = webhook_queue.get_nowait()
-                await self._handle_webhook(event)
-            except queue.Empty:
-                await asyncio.sleep(0.5)
+            # Woken up by the webhook server thread as soon as an event arrives
+            event = await webhook_queue.get_async()
+            await self._handle_webhook(event)
 
     async def _handle_event(self, data):
-        post = json.loads(data)
+        if not self.accepting:
+            return
+        # Most websocket traffic consists of events we don't handle (typing, status
+        # changes, ...), so look at the event type before decoding anything else.
+        if match := _EVENT_TYPE.match(data):
+            if match.group(1) not in HANDLED_EVENTS:
+                return
+
+        post = json_loads(data)
         event_action = post.get("event")
         if event_action == "posted":
-            await self._handle_post(post)
+            await self._handle_post(post, raw=data)
+        elif event_action in MetadataCache.EVENTS:
+            # Drop cached users/channels that just changed
+            self.driver.metadata.handle_event(post)
 
-    async def _handle_post(self, post):
-        # For some reason these are JSON strings, so need to parse them first
-        for item in ["post", "mentions"]:
-            if post.get("data", {}).get(item):
-                post["data"][item] = json.loads(post["data"][item])
+    async def _handle_post(self, post, raw=None):
+        # For some reason the post is a JSON string, so we need to parse it first. Other
+        # nested JSON strings like the mentions are decoded by Message when needed.
+        if isinstance(post.get("data", {}).get("post"), str):
+            post["data"]["post"] = json_loads(post["data"]["post"])
 
         # If the post starts with a mention of this bot, strip off that part.
         post["data"]["post"]["message"] = self._name_matcher.sub(
             "", post["data"]["post"]["message"]
         )
-        message = Message(post)
+        # Keep only the raw event around while the message waits to be handled, the
+        # full body is decoded again if a listener needs it.
+        message = Message(post, raw_body=raw)
         if self._should_ignore(message):
             return
 
         # Find all the listeners that match this message, and have their plugins handle
         # the rest.
-        tasks = [
-            asyncio.create_task(
-                function.plugin.call_function(
-                    function,
-                    message,
-                    groups=[group for group in match.groups() if group != ""],
-                )
-            )
-            for matcher, functions in self.plugin_manager.message_listeners.items()
-            if (match := matcher.search(message.text))
-            for function in functions
-        ]
-
-        # Execute the callbacks in parallel
-        asyncio.gather(*tasks)
+        for match, functions in self.plugin_manager.match_message_listeners(message):
+            groups = [group for group in match.groups() if group != ""]
+            for function in functions:
+                await self._dispatch(function, message, groups=groups)
 
     async def _handle_webhook(self, event: WebHookEvent):
         # Find all the listeners that match this webhook id, and have their plugins
         # handle the rest.
+        functions = self.plugin_manager.match_webhook_listeners(event.webhook_id)
 
-        tasks = [
-            # Create an asyncio task to handle this callback
-            asyncio.create_task(function.plugin.call_function(function, event))
-            for matcher, functions in self.plugin_manager.webhook_listeners.items()
-            if matcher.search(event.webhook_id)
-            for function in functions
-        ]
-
-        # If this webhook doesn't correspond to any listeners, signal the WebHookServer
-        # to not wait for any response
-        if len(tasks) == 0:
+        # If this webhook doesn't correspond to any listeners, or the bot is shutting
+        # down, signal the WebHookServer to not wait for any response
+        if len(functions) == 0 or not self.accepting:
             self.driver.respond_to_web(event, NoResponse)
-        # If it does, execute the callbacks in parallel
-        else:
-            asyncio.gather(*tasks)
+            return
+
+        for function in functions:
+            await self._dispatch(function, event)
+
+    async def _dispatch(self, function: Function, event: EventWrapper, **kwargs):
+        """Schedules a call of the given listener, subject to the concurrency limits.
+
+        With the "block" overload policy this waits until the call can be queued, which
+        stops the websocket reader from processing further events in the meantime.
+        """
+        # Create the coroutine right away so the plugin receives the call in order of
+        # arrival, even if it has to wait for a free slot.
+        call = function.plugin.call_function(function, event, **kwargs)
+        ticket = await self.limiter.acquire(function.plugin)
+        task = asyncio.create_task(self._run_listener(ticket, call, function, event))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_listener(self, ticket, call, function: Function, event):
+        if not await ticket:
+            call.close()
+            self._reject(event)
+            return
+
+        try:
+            accepted = await call
+        except Exception:
+            log.exception(f"Unhandled exception in listener {function.name}")
+            accepted = True
+        finally:
+            self.limiter.release(function.plugin)
+
+        if accepted is False:
+            self._reject(event)
+
+    def _reject(self, event: EventWrapper):
+        """Handles an event that was dropped because the bot is overloaded."""
+        if isinstance(event, WebHookEvent):
+            # Don't let the web request wait for a response that will never come.
+            if not event.responded:
+                self.driver.respond_to_web(event, NoResponse)
+        elif self.limiter.policy is OverloadPolicy.BUSY:
+            reply = asyncio.create_task(
+                self.driver.areply_to(event, self.settings.OVERLOAD_BUSY_MESSAGE)
+            )
+            self._replies.add(reply)
+            reply.add_done_callback(self._reply_done)
+
+    def _reply_done(self, reply: asyncio.Task):
+        self._replies.discard(reply)
+        if not reply.cancelled() and (exception := reply.exception()) is not None:
+            log.error(
+                "Failed to send the busy reply",
+                exc_info=(type(exception), exception, exception.__traceback__),
+            )
+
+    async def drain(self, timeout: Optional[float] = None) -> int:
+        """Stops accepting events, and waits at most timeout seconds for the listener
+        calls that are running or waiting for a slot. The calls that are still left
+        after that are cancelled, and their number is returned."""
+        self.accepting = False
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        # Don't wait for ourselves, in case a listener asked the bot to stop.
+        current = asyncio.current_task()
+        pending: Set[asyncio.Task] = set()
+        while True:
+            # Events that were being handled may still dispatch further calls.
+            tasks = {
+                task for task in self._tasks if task is not current and not task.done()
+            }
+            if not tasks:
+                break
+            remaining = None if deadline is None else max(deadline - loop.time(), 0)
+            _, pending = await asyncio.wait(tasks, timeout=remaining)
+            if pending:
+                break
+
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pending:
+            log.warning(f"Cancelled {len(pending)} listener calls.")
+        return len(pending)
+
+    def stop(self, timeout: Optional[float] = None) -> int:
+        """Blocking version of drain, which can be called from any thread."""
+        self.accepting = False
+        tasks = [task for task in self._tasks if not task.done()]
+        if not tasks:
+            return 0
+        loop = tasks[0].get_loop()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if loop.is_closed():
+            return len(tasks)
+        if running is loop:
+            # We can't block the loop that runs the listeners, so don't wait for them.
+            current = asyncio.current_task()
+            tasks = [task for task in tasks if task is not current]
+            for task in tasks:
+                task.cancel()
+            return len(tasks)
+        if loop.is_running():
+            # E.g. the websocket is still being read on the main thread.
+            return asyncio.run_coroutine_threadsafe(self.drain(timeout), loop).result()
+        return loop.run_until_complete(self.drain(timeout))
+
+    def get_load_metrics(self) -> Dict[str, Any]:
+        """Returns queue depths and drop counts of the listener limiter and the
+        threadpool, to help size the concurrency limits."""
+        threadpool = self.driver.threadpool
+        return {
+            "listeners": self.limiter.stats(),
+            "threadpool": {
+                "workers": threadpool.get_num_workers(),
+                "busy_workers": threadpool.get_busy_workers(),
+                "queued": threadpool.get_queued_tasks(),
+                "queue_wait": threadpool.get_queue_wait(),
+                "completed": threadpool.get_completed_tasks(),
+                "stuck_workers": threadpool.get_stuck_workers(),
+                "timed_out": threadpool.get_timed_out_tasks(),
+                "failed": threadpool.get_failed_tasks(),
+                "dropped": threadpool.get_dropped_tasks(),
+            },
+            "process_executor": {
+                "stuck_calls": self.driver.process_executor.get_stuck_calls(),
+            },
+            "lanes": {
+                "dropped": sum(
+                    plugin.lanes.dropped for plugin in self.plugin_manager.plugins
+                ),
+            },
+        }
@@ -6,10 +6,12 @@ import logging
 import re
 import shlex
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING, Callable, Optional, Sequence, Union
+from typing import TYPE_CHECKING, Callable, Hashable, Optional, Sequence, Tuple, Union
 
 import click
 
+from mmpy_bot.process_executor import Executor
+from mmpy_bot.threadpool import TaskPriority
 from mmpy_bot.utils import completed_future
 from mmpy_bot.webhook_server import NoResponse
 from mmpy_bot.wrappers import Message, WebHookEvent
@@ -67,17 +69,38 @@ class Function(ABC):
         # To be set in the child class or from the parent plugin
         self.plugin: Optional[Plugin] = None
         self.name: Optional[str] = None
+        # Name of the plugin attribute this function is found at, and its index among
+        # the siblings there
+        self.attribute: Optional[Tuple[str, int]] = None
+        # Overrides the executor of the plugin for synchronous functions
+        self.executor: Optional[Executor] = None
+        # Overrides the threadpool priority of the plugin for synchronous functions
+        self.priority: Optional[TaskPriority] = None
+        # Overrides Settings.LISTENER_TIMEOUT
+        self.timeout: Optional[float] = None
         self.docstring = self.function.__doc__ or ""
 
         @abstractmethod
         def __call__(self, *args):
             pass
 
+    def lane_key(self, event) -> Optional[Hashable]:
+        """Returns the key of the ordered lane this event should be processed in, or
+        None if calls of this function don't need to be ordered."""
+        return None
+
 
 class MessageFunction(Function):
     """Wrapper around a Plugin class method that should respond to certain Mattermost
     messages."""
 
+    # Message attribute that identifies the lane for each ordered_by option
+    ORDERED_BY = {
+        "channel": "channel_id",
+        "thread": "reply_id",
+        "user": "user_id",
+    }
+
     def __init__(
         self,
         *args,
@@ -86,14 +109,33 @@ class MessageFunction(Function):
         silence_fail_msg: bool = False,
         allowed_users: Optional[Sequence[str]] = None,
         allowed_channels: Optional[Sequence[str]] = None,
+        ordered_by: Optional[str] = None,
+        executor: Optional[str] = None,
+        timeout: Optional[float] = None,
+        priority: Optional[Union[TaskPriority, str]] = None,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
 
+        if ordered_by is not None and ordered_by not in self.ORDERED_BY:
+            raise ValueError(
+                f"ordered_by should be one of {list(self.ORDERED_BY)}, not {ordered_by!r}."
+            )
+
         self.is_click_function = isinstance(self.function, click.Command)
         self.direct_only = direct_only
         self.needs_mention = needs_mention
         self.silence_fail_msg = silence_fail_msg
+        self.ordered_by = ordered_by
+        self.executor = None if executor is None else Executor(executor)
+        self.timeout = timeout
+        self.priority = None if priority is None else TaskPriority(priority)
+
+        if self.is_coroutine and self.executor is Executor.PROCESS:
+            raise ValueError(
+                "Coroutines already run on the event loop and can't use the process"
+                " executor."
+            )
 
         if allowed_users is None:
             self.allowed_users = []
@@ -133,6 +175,21 @@ class MessageFunction(Function):
                 f" arguments {argspec}."
             )
 
+    def lane_key(self, message: Message) -> Optional[Hashable]:
+        if self.ordered_by is None:
+            return None
+        return (self.ordered_by, getattr(message, self.ORDERED_BY[self.ordered_by]))
+
+    def listens_in(self, is_direct: bool, is_mentioned: bool) -> bool:
+        """Whether this function responds to messages in the given context, based on
+        its direct_only and needs_mention requirements.
+
+        Direct messages always count as mentioning the bot.
+        """
+        if self.direct_only and not is_direct:
+            return False
+        return not self.needs_mention or is_direct or is_mentioned
+
     def __call__(self, message: Message, *args):
         # We need to return this so that if this MessageFunction was called with `await`,
         # asyncio doesn't crash.
@@ -192,10 +249,36 @@ def listen_to(
     allowed_users=None,
     allowed_channels=None,
     silence_fail_msg=False,
+    ordered_by=None,
+    executor=None,
+    timeout=None,
+    priority=None,
     **metadata,
 ):
     """Wrap the given function in a MessageFunction class so we can register some
-    properties."""
+    properties.
+
+    With ordered_by set to "channel", "thread" or "user", messages from the same
+    channel, thread or user are processed one at a time in order of arrival, while
+    other messages are still handled concurrently.
+
+    With executor set to "process", the function runs on a pool of processes instead
+    of the threadpool, which suits CPU-bound work. This overrides the executor of the
+    plugin, see Plugin.executor.
+
+    With timeout set, coroutines are cancelled after that many seconds. Synchronous
+    functions can't be interrupted, but their CancellationToken (see
+    mmpy_bot.timeouts.current_token) is cancelled and their worker thread is counted
+    as stuck and replaced. Calls in listener processes can't be interrupted either:
+    they are cancelled if they didn't start yet, otherwise the timeout is only logged
+    and the call is counted as stuck until it returns. Defaults to
+    Settings.LISTENER_TIMEOUT, 0 disables it.
+
+    With priority set to "background" or "bulk" (see TaskPriority), calls of a
+    synchronous function wait on the threadpool until interactive ones have started,
+    so e.g. a listener that logs every message doesn't hold up commands. This overrides
+    the priority of the plugin, see Plugin.priority.
+    """
     if allowed_users is None:
         allowed_users = []
 
@@ -226,6 +309,10 @@ def listen_to(
             allowed_users=allowed_users,
             allowed_channels=allowed_channels,
             silence_fail_msg=silence_fail_msg,
+            ordered_by=ordered_by,
+            executor=executor,
+            timeout=timeout,
+            priority=priority,
             **metadata,
         )
 
@@ -240,9 +327,14 @@ class WebHookFunction(Function):
     def __init__(
         self,
         *args,
+        response_timeout: Optional[float] = None,
+        timeout_status: Optional[int] = None,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
+        # Overrides of the WebHookServer's response deadline for matching webhooks
+        self.response_timeout = response_timeout
+        self.timeout_status = timeout_status
 
         if isinstance(self.function, click.Command):
             raise TypeError(
@@ -282,15 +374,26 @@ class WebHookFunction(Function):
 
 def listen_webhook(
     regexp: str,
+    response_timeout: Optional[float] = None,
+    timeout_status: Optional[int] = None,
     **metadata,
 ):
-    """Wrap the given function in a WebHookFunction class with the specified regexp."""
+    """Wrap the given function in a WebHookFunction class with the specified regexp.
+
+    Arguments:
+    - response_timeout: float, seconds to wait for a web response to matching
+        webhooks before the server gives up, overrides WEBHOOK_RESPONSE_TIMEOUT.
+    - timeout_status: int, HTTP status to send when that deadline passes, overrides
+        WEBHOOK_TIMEOUT_STATUS.
+    """
 
     def wrapped_func(func):
         pattern = re.compile(regexp)
         new_func = WebHookFunction(
             func,
             matcher=pattern,
+            response_timeout=response_timeout,
+            timeout_status=timeout_status,
             **metadata,
         )
 
@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
+
+
+class MisfirePolicy(str, Enum):
+    """What to do with persisted jobs that should have run while the bot was down."""
+
+    # Run the job once right away, then continue with its regular schedule.
+    RUN_ONCE = "run_once"
+    # Run the job once for every run that was missed.
+    RUN_ALL = "run_all"
+    # Don't run the missed runs. One-time jobs are dropped.
+    SKIP = "skip"
+
+
+@dataclass
+class StoredJob:
+    """A job as it is kept in a JobStore.
+
+    Arguments:
+    - id: str, unique id of the job.
+    - job_class: str, "module:qualname" of the schedule.Job subclass.
+    - function: str, reference to the function that the job calls, see
+        Scheduler.register_target.
+    - arguments: bytes, the pickled positional and keyword arguments of the function.
+    - spec: bytes, the pickled attributes that describe when the job runs.
+    - next_run: float, timestamp of the next run.
+    - last_run: float, timestamp of the last run, if any.
+    - misfire_policy: str, overrides the MisfirePolicy of the scheduler.
+    """
+
+    id: str
+    job_class: str
+    function: str
+    arguments: bytes
+    spec: bytes
+    next_run: Optional[float] = None
+    last_run: Optional[float] = None
+    misfire_policy: Optional[str] = None
+
+
+class JobStore:
+    """Keeps the persistent jobs of a Scheduler across restarts. Subclass this to store
+    them elsewhere than in SQLiteJobStore."""
+
+    def add(self, job: StoredJob):
+        """Adds a job, or replaces the job with the same id."""
+        raise NotImplementedError
+
+    def update_runs(self, runs: Iterable[Tuple[str, Optional[float], Optional[float]]]):
+        """Updates the (id, next_run, last_run) of jobs that ran or were rescheduled."""
+        raise NotImplementedError
+
+    def remove(self, job_ids: Iterable[str]):
+        raise NotImplementedError
+
+    def load(self) -> List[StoredJob]:
+        """Returns all stored jobs."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteJobStore(JobStore):
+    """Keeps the jobs in a local SQLite database, which is updated with every change.
+
+    Arguments:
+    - path: str, the database file, created if it doesn't exist.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            str(path), check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                job_class TEXT NOT NULL,
+                function TEXT NOT NULL,
+                arguments BLOB NOT NULL,
+                spec BLOB NOT NULL,
+                next_run REAL,
+                last_run REAL,
+                misfire_policy TEXT
+            )""")
+
+    def add(self, job: StoredJob):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job.id,
+                    job.job_class,
+                    job.function,
+                    job.arguments,
+                    job.spec,
+                    job.next_run,
+                    job.last_run,
+                    job.misfire_policy,
+                ),
+            )
+
+    def update_runs(self, runs: Iterable[Tuple[str, Optional[float], Optional[float]]]):
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE jobs SET next_run = ?, last_run = ? WHERE id = ?",
+                [(next_run, last_run, job_id) for job_id, next_run, last_run in runs],
+            )
+
+    def remove(self, job_ids: Iterable[str]):
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids]
+            )
+
+    def load(self) -> List[StoredJob]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, job_class, function, arguments, spec, next_run, last_run, "
+                "misfire_policy FROM jobs"
+            ).fetchall()
+        return [StoredJob(*row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from collections import deque
+from queue import Full
+from typing import TYPE_CHECKING, Any, Awaitable, Deque, Dict, Hashable, Tuple
+
+from mmpy_bot.limiter import OverloadPolicy
+from mmpy_bot.threadpool import TaskFuture, TaskPriority
+
+if TYPE_CHECKING:
+    from mmpy_bot.threadpool import ThreadPool
+
+log = logging.getLogger("mmpy.lanes")
+
+
+class _LaneDrain:
+    """Threadpool task that runs every queued job of a single lane in order."""
+
+    def __init__(self, lanes: OrderedLanes, key: Hashable, threadpool: ThreadPool):
+        self.lanes = lanes
+        self.key = key
+        self.threadpool = threadpool
+
+    def __call__(self):
+        while (job := self.lanes._next_job(self.key)) is not None:
+            # Taking a job off a full lane makes room for coroutines in submit_async.
+            self.threadpool.notify_room()
+            function, args, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+            del future
+
+    def dropped(self):
+        """Called by the threadpool if this task is discarded due to overload."""
+        self.lanes._drop_lane(self.key)
+
+
+class OrderedLanes:
+    """Runs jobs that share a key one after another, in the order in which they were
+    submitted, while jobs with different keys still run concurrently.
+
+    Lanes only exist while they have work, so there is no global lock around the
+    execution of the jobs themselves. Each threadpool lane holds as many waiting jobs
+    as the queue of the threadpool, after which its overload policy applies.
+    """
+
+    def __init__(self):
+        # Coroutine lanes, only accessed from the event loop: key -> last job's future
+        self._tails: Dict[Hashable, asyncio.Future] = {}
+        # Threadpool lanes: key -> queue of jobs waiting behind the running one
+        self._lock = threading.Lock()
+        self._queues: Dict[Hashable, Deque[Tuple[Any, Tuple, TaskFuture]]] = {}
+        # Notified whenever a job leaves a lane
+        self._room = threading.Condition(self._lock)
+        self.dropped = 0
+
+    async def run(self, key: Hashable, awaitable: Awaitable):
+        """Awaits the given awaitable once every earlier job in this lane finished."""
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        # Claim our position in the lane before yielding to the event loop.
+        self._tails[key] = done
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            return await awaitable
+        finally:
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+    def submit(
+        self,
+        key: Hashable,
+        threadpool: ThreadPool,
+        function,
+        *args,
+        priority: TaskPriority = TaskPriority.INTERACTIVE,
+        block: bool = True,
+    ) -> TaskFuture:
+        """Queues function(*args) to run on the threadpool once every earlier job in
+        this lane finished, and returns the future of its result. A lane that has no
+        work yet is queued on the threadpool with the given priority.
+
+        The future is cancelled if the lane could not be scheduled because the
+        threadpool is overloaded, or if the lane is full and the overload policy of
+        the threadpool drops it. Like ThreadPool.add_task, this raises queue.Full
+        instead of waiting for room if block is False.
+        """
+        future = TaskFuture(function)
+        job = (function, args, future)
+        limit = threadpool.max_queue_size
+        policy = threadpool.overload_policy
+        dropped = None
+        with self._lock:
+            queue = self._queues.get(key)
+            while policy is OverloadPolicy.BLOCK and queue and len(queue) >= limit > 0:
+                if not block:
+                    raise Full
+                self._room.wait()
+                queue = self._queues.get(key)
+
+            if queue is None:
+                self._queues[key] = deque([job])
+                if not block and policy is OverloadPolicy.BLOCK:
+                    # Nobody joined the lane yet while we hold the lock, so it can
+                    # just be removed again if the threadpool is full.
+                    drain = _LaneDrain(self, key, threadpool)
+                    try:
+                        threadpool.add_task(drain, priority=priority, block=False)
+                    except Full:
+                        del self._queues[key]
+                        raise
+                    return future
+            elif not limit or len(queue) < limit:
+                # The lane is already being drained by a worker.
+                queue.append(job)
+                return future
+            else:
+                # The lane is full, drop a job like the threadpool would.
+                self.dropped += 1
+                if policy is OverloadPolicy.DROP_OLDEST:
+                    dropped = queue.popleft()
+                    queue.append(job)
+                else:
+                    dropped = job
+
+        if dropped is not None:
+            self._discard(key, dropped)
+            return future
+        drain = _LaneDrain(self, key, threadpool)
+        if threadpool.add_task(drain, priority=priority).cancelled():
+            self._drop_lane(key)
+        return future
+
+    def _discard(self, key: Hashable, job: Tuple[Any, Tuple, TaskFuture]):
+        function, _, future = job
+        future.cancel()
+        # Give tasks that track their own state a chance to clean up.
+        if hasattr(function, "dropped"):
+            function.dropped()
+        if self.dropped % 100 == 1:
+            log.warning(
+                f"Ordered lane {key} is full, dropped {self.dropped} jobs so far."
+            )
+
+    def _next_job(self, key: Hashable):
+        with self._lock:
+            queue = self._queues[key]
+            self._room.notify_all()
+            if not queue:
+                del self._queues[key]
+                return None
+            return queue.popleft()
+
+    def _drop_lane(self, key: Hashable):
+        with self._lock:
+            dropped = self._queues.pop(key, ())
+            self._room.notify_all()
+        for _, _, future in dropped:
+            future.cancel()
+        if dropped:
+            log.warning(f"Dropped {len(dropped)} queued jobs of ordered lane {key}.")
+
+    def __len__(self):
+        """Number of lanes that currently have work."""
+        return len(self._tails) + len(self._queues)
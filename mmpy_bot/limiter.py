@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from collections import defaultdict, deque
+from enum import Enum
+from typing import Any, Deque, Dict, Hashable, Tuple
+
+log = logging.getLogger("mmpy.limiter")
+
+
+class OverloadPolicy(str, Enum):
+    """What to do with new work once the configured concurrency limits are reached and
+    the queue of pending work is full."""
+
+    # Wait until there is room again. For websocket events this blocks the reader, so
+    # the backpressure propagates to the server.
+    BLOCK = "block"
+    # Drop the oldest pending item to make room for the new one.
+    DROP_OLDEST = "drop_oldest"
+    # Drop the new item.
+    DROP_NEWEST = "drop_newest"
+    # Drop the new item and let the sender know that the bot is busy.
+    BUSY = "busy"
+
+
+class ConcurrencyLimiter:
+    """Limits how many listener calls can run at the same time, both globally and per
+    key (e.g. per plugin).
+
+    Calls that can't start right away wait in a bounded FIFO queue of pending calls.
+    Once that queue is full, the OverloadPolicy decides what happens.
+
+    Arguments:
+    - max_concurrent: int, maximum number of concurrent calls, 0 means unlimited.
+    - max_per_key: int, maximum number of concurrent calls per key, 0 means unlimited.
+    - max_pending: int, maximum number of calls waiting for a free slot.
+    - policy: OverloadPolicy, what to do when the pending queue is full.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 0,
+        max_per_key: int = 0,
+        max_pending: int = 0,
+        policy: OverloadPolicy = OverloadPolicy.BLOCK,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_per_key = max_per_key
+        self.max_pending = max_pending
+        self.policy = OverloadPolicy(policy)
+
+        self._running = 0
+        self._running_per_key: Dict[Hashable, int] = defaultdict(int)
+        self._waiters: Deque[Tuple[Hashable, asyncio.Future]] = deque()
+        self._space_available = asyncio.Event()
+        self.admitted = 0
+        self.dropped = 0
+
+    def _has_slot(self, key: Hashable) -> bool:
+        if self.max_concurrent and self._running >= self.max_concurrent:
+            return False
+        if self.max_per_key and self._running_per_key[key] >= self.max_per_key:
+            return False
+        return True
+
+    def _take_slot(self, key: Hashable):
+        self._running += 1
+        self._running_per_key[key] += 1
+        self.admitted += 1
+
+    def _drop(self, future: asyncio.Future):
+        self.dropped += 1
+        if self.dropped % 100 == 1:
+            log.warning(
+                f"Overloaded, dropped {self.dropped} listener calls so far "
+                f"(policy: {self.policy.value})."
+            )
+        future.set_result(False)
+
+    async def acquire(self, key: Hashable) -> asyncio.Future:
+        """Requests a slot for the given key.
+
+        Returns a future that resolves to True once the slot is acquired, or False if
+        the call was dropped. With the BLOCK policy, this coroutine itself waits until
+        there is room in the pending queue.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            future = loop.create_future()
+            if self._has_slot(key):
+                self._take_slot(key)
+                future.set_result(True)
+                return future
+
+            if len(self._waiters) < self.max_pending:
+                self._waiters.append((key, future))
+                return future
+
+            if self.policy is OverloadPolicy.BLOCK:
+                self._space_available.clear()
+                await self._space_available.wait()
+                continue
+
+            if self.policy is OverloadPolicy.DROP_OLDEST and self._waiters:
+                _, oldest = self._waiters.popleft()
+                self._drop(oldest)
+                self._waiters.append((key, future))
+                return future
+
+            self._drop(future)
+            return future
+
+    def release(self, key: Hashable):
+        """Releases a slot acquired for the given key and hands free slots to pending
+        calls, in order of arrival."""
+        self._running -= 1
+        self._running_per_key[key] -= 1
+        if not self._running_per_key[key]:
+            del self._running_per_key[key]
+
+        for waiter in list(self._waiters):
+            waiter_key, future = waiter
+            if self.max_concurrent and self._running >= self.max_concurrent:
+                break
+            if future.done():
+                # Cancelled while waiting
+                self._waiters.remove(waiter)
+            elif self._has_slot(waiter_key):
+                self._waiters.remove(waiter)
+                self._take_slot(waiter_key)
+                future.set_result(True)
+
+        if len(self._waiters) < self.max_pending or not self._waiters:
+            self._space_available.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the current load of the limiter."""
+        return {
+            "running": self._running,
+            "pending": len(self._waiters),
+            "admitted": self.admitted,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,304 @@
+import logging
+import re
+from collections import deque
+from typing import (
+    Callable,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+try:
+    from re import _constants as sre_constants  # type: ignore
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:  # Python < 3.11
+    import sre_constants  # type: ignore
+    import sre_parse  # type: ignore
+
+log = logging.getLogger("mmpy.listener_index")
+
+T = TypeVar("T")
+
+# An alternative of a pattern: (anchored at the start of the string, required literal)
+Alternative = Tuple[bool, str]
+
+
+def _literal_runs(items) -> Tuple[bool, List[str]]:
+    """Walk a parsed regex sequence and return whether it is anchored at the start of
+    the string, together with every run of consecutive literal characters that any
+    match is guaranteed to contain."""
+    runs: List[str] = []
+    current: List[str] = []
+
+    def flush():
+        if current:
+            runs.append("".join(current))
+            current.clear()
+
+    def walk(sequence):
+        for op, av in sequence:
+            if op is sre_constants.LITERAL:
+                current.append(chr(av))
+            elif op is sre_constants.AT:
+                # Zero-width assertions don't consume characters, so they don't
+                # interrupt a literal run.
+                continue
+            elif op is sre_constants.SUBPATTERN and not av[1] and not av[2]:
+                # Groups without scoped flags are matched inline.
+                walk(av[-1])
+            else:
+                flush()
+
+    walk(items)
+    flush()
+
+    anchored = False
+    if items and items[0][0] is sre_constants.AT:
+        anchored = items[0][1] in (
+            sre_constants.AT_BEGINNING,
+            sre_constants.AT_BEGINNING_STRING,
+        )
+    # The prefix only counts as anchored if the literal directly follows the anchor.
+    if anchored and not (len(items) > 1 and items[1][0] is sre_constants.LITERAL):
+        anchored = False
+    return anchored, runs
+
+
+def required_literals(pattern: re.Pattern) -> Optional[List[Alternative]]:
+    """Return a list of (anchored, literal) alternatives, one of which must be present
+    in any string the pattern matches, or None if no such literals can be derived.
+
+    An anchored alternative means the literal has to be a prefix of the string.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+
+    items = list(parsed)
+    if len(items) == 1 and items[0][0] is sre_constants.BRANCH:
+        branches = items[0][1][1]
+    else:
+        branches = [items]
+
+    alternatives: List[Alternative] = []
+    for branch in branches:
+        anchored, runs = _literal_runs(list(branch))
+        if not runs:
+            return None
+        # With MULTILINE, ^ also matches after every newline.
+        anchored = anchored and not pattern.flags & re.MULTILINE
+        if anchored:
+            alternatives.append((True, runs[0]))
+        else:
+            alternatives.append((False, max(runs, key=len)))
+    return alternatives
+
+
+def literal_pattern(pattern: re.Pattern) -> Optional[str]:
+    """Return the string the pattern consists of if it is a plain literal, optionally
+    anchored with ^ and $, or None otherwise."""
+    if pattern.flags & re.IGNORECASE:
+        return None
+    try:
+        items = list(sre_parse.parse(pattern.pattern, pattern.flags))
+    except Exception:
+        return None
+
+    if items and items[0] in (
+        (sre_constants.AT, sre_constants.AT_BEGINNING),
+        (sre_constants.AT, sre_constants.AT_BEGINNING_STRING),
+    ):
+        items = items[1:]
+    if items and items[-1] in (
+        (sre_constants.AT, sre_constants.AT_END),
+        (sre_constants.AT, sre_constants.AT_END_STRING),
+    ):
+        items = items[:-1]
+    if not items or any(op is not sre_constants.LITERAL for op, _ in items):
+        return None
+    return "".join(chr(av) for _, av in items)
+
+
+class _PrefixTrie:
+    """Maps string prefixes to the ids of the patterns they belong to."""
+
+    def __init__(self):
+        self._root: Dict = {}
+
+    def add(self, prefix: str, pattern_id: int):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(None, set()).add(pattern_id)
+
+    def collect(self, text: str, out: Set[int]):
+        node = self._root
+        if None in node:
+            out.update(node[None])
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                return
+            if None in node:
+                out.update(node[None])
+
+
+class _AhoCorasick:
+    """Aho-Corasick automaton that finds which of a set of literals occur in a text in
+    a single pass."""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Set[int]] = [set()]
+
+    def add(self, literal: str, pattern_id: int):
+        state = 0
+        for char in literal:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._out[state].add(pattern_id)
+
+    def build(self):
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._out[next_state] |= self._out[self._fail[next_state]]
+
+    def collect(self, text: str, out: Set[int]):
+        if len(self._goto) == 1:
+            return
+        goto, fail, outputs = self._goto, self._fail, self._out
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                out.update(outputs[state])
+
+
+class _LiteralFilter:
+    """Prefix trie plus substring automaton for one case-folding mode."""
+
+    def __init__(self):
+        self.prefixes = _PrefixTrie()
+        self.substrings = _AhoCorasick()
+
+    def add(self, alternatives: List[Alternative], pattern_id: int):
+        for anchored, literal in alternatives:
+            if anchored:
+                self.prefixes.add(literal, pattern_id)
+            else:
+                self.substrings.add(literal, pattern_id)
+
+    def collect(self, text: str, out: Set[int]):
+        self.prefixes.collect(text, out)
+        self.substrings.collect(text, out)
+
+
+class ListenerIndex(Generic[T]):
+    """Prefilter that only runs the regexes of listeners that can possibly match.
+
+    Every pattern is analyzed once when the index is built. If all of its matches are
+    guaranteed to contain one of a set of literal strings (e.g. ``^help`` or
+    ``sleep ([0-9]+)``), it is indexed under those literals. At dispatch time, a single
+    pass over the text determines which literals are present, and only the
+    corresponding patterns plus any patterns without usable literals are searched.
+
+    The results are identical to searching every pattern in registration order.
+    """
+
+    def __init__(self, listeners: Dict[re.Pattern, List[T]]):
+        self._entries: List[Tuple[re.Pattern, List[T]]] = list(listeners.items())
+        self._always: Set[int] = set()
+        # Patterns with IGNORECASE are indexed by their lowercased literals. Case
+        # folding is only exact for ASCII, so for other texts they are always searched.
+        self._folded_ids: Set[int] = set()
+        self._exact = _LiteralFilter()
+        self._folded = _LiteralFilter()
+
+        for pattern_id, (matcher, _) in enumerate(self._entries):
+            alternatives = required_literals(matcher)
+            if alternatives is None:
+                self._always.add(pattern_id)
+            elif matcher.flags & re.IGNORECASE:
+                if not all(literal.isascii() for _, literal in alternatives):
+                    self._always.add(pattern_id)
+                    continue
+                self._folded_ids.add(pattern_id)
+                self._folded.add(
+                    [(anchored, literal.lower()) for anchored, literal in alternatives],
+                    pattern_id,
+                )
+            else:
+                self._exact.add(alternatives, pattern_id)
+
+        self._exact.substrings.build()
+        self._folded.substrings.build()
+        log.debug(
+            f"Indexed {len(self._entries)} listener patterns, "
+            f"{len(self._always)} of which are always searched."
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def candidates(self, text: str) -> List[int]:
+        """Returns the ids of the patterns that may match the given text, in
+        registration order."""
+        candidates = set(self._always)
+        self._exact.collect(text, candidates)
+        if self._folded_ids:
+            if text.isascii():
+                self._folded.collect(text.lower(), candidates)
+            else:
+                candidates |= self._folded_ids
+        return sorted(candidates)
+
+    def entries(self) -> Iterator[Tuple[int, re.Pattern, List[T]]]:
+        """Yields (pattern_id, pattern, listeners) for every indexed pattern."""
+        for pattern_id, (matcher, listeners) in enumerate(self._entries):
+            yield pattern_id, matcher, listeners
+
+    def search(
+        self,
+        text: str,
+        select: Optional[Callable[[int, List[T]], Optional[List[T]]]] = None,
+    ) -> Iterator[Tuple[re.Match, List[T]]]:
+        """Yields (match, listeners) for every pattern that matches the given text, in
+        the order in which the patterns were registered.
+
+        Arguments:
+        - select: optional callable that receives (pattern_id, listeners) and returns
+            the listeners that are eligible. Patterns without eligible listeners are
+            skipped without being searched.
+        """
+        for pattern_id in self.candidates(text):
+            matcher, listeners = self._entries[pattern_id]
+            if select is not None:
+                listeners = select(pattern_id, listeners)
+                if not listeners:
+                    continue
+            if match := matcher.search(text):
+                yield match, listeners
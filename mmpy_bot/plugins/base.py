@@ -1,17 +1,26 @@
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures
 import logging
 import re
 from abc import ABC
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Sequence, Union
+from functools import partial
+from itertools import product
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 from mmpy_bot.driver import Driver
 from mmpy_bot.function import Function, MessageFunction, WebHookFunction
+from mmpy_bot.lanes import OrderedLanes
+from mmpy_bot.listener_index import ListenerIndex, literal_pattern
+from mmpy_bot.process_executor import Executor
 from mmpy_bot.settings import Settings
+from mmpy_bot.threadpool import TaskPriority, TimedTask
+from mmpy_bot.timeouts import log_timeout
 from mmpy_bot.utils import split_docstring
-from mmpy_bot.wrappers import EventWrapper
+from mmpy_bot.wrappers import EventWrapper, Message
 
 log = logging.getLogger("mmpy.plugin_base")
 
@@ -23,13 +32,25 @@ class Plugin(ABC):
     It will be called by the EventHandler whenever one of its listeners is triggered,
     but execution of the corresponding function is handled by the plugin itself. This
     way, you can implement multithreading or multiprocessing as desired.
+
+    Synchronous listeners run on the threadpool of the driver. Set executor to
+    Executor.PROCESS ("process") to run them on a pool of processes instead, which
+    listen_to can override per function.
+
+    Their calls are queued on the threadpool with the given priority. Set it to
+    TaskPriority.BACKGROUND or BULK for plugins that do a lot of work nobody waits for,
+    so they don't hold up the listeners of other plugins.
     """
 
+    executor: Executor = Executor.THREAD
+    priority: TaskPriority = TaskPriority.INTERACTIVE
+
     def __init__(self):
         self.driver: Optional[Driver] = None
         self.plugin_manager: Optional[PluginManager] = None
         self.settings: Optional[Settings] = None
         self.docstring = self.__doc__ if self.__doc__ != Plugin.__doc__ else None
+        self.lanes = OrderedLanes()
 
     def initialize(
         self,
@@ -41,6 +62,19 @@ class Plugin(ABC):
         self.plugin_manager = plugin_manager
         self.settings = settings
 
+    def __getstate__(self):
+        # Copies of the plugin in listener processes get a DriverProxy instead.
+        state = self.__dict__.copy()
+        for name in ("driver", "plugin_manager", "lanes"):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.driver = None
+        self.plugin_manager = None
+        self.lanes = OrderedLanes()
+
     def on_start(self):
         """Will be called after initialization.
 
@@ -62,13 +96,90 @@ class Plugin(ABC):
         function: Function,
         event: EventWrapper,
         groups: Optional[Sequence[str]] = [],
-    ):
+    ) -> bool:
+        """Calls the given listener function with the event and any matched groups,
+        and waits until it finished. Exceptions of the listener are raised here, also
+        if it ran on the threadpool or in a listener process.
+
+        Returns False if the call was dropped because the threadpool is overloaded.
+        """
+        # Listeners with ordered_by set run one at a time per channel/thread/user.
+        lane_key = function.lane_key(event)
+        timeout = self._listener_timeout(function)
+
         if function.is_coroutine:
-            await function(event, *groups)  # type: ignore
+            call = function(event, *groups)  # type: ignore
+            if timeout:
+                call = self._with_timeout(call, function, timeout)
+        elif Executor(function.executor or self.executor) is Executor.PROCESS:
+            # Running processes can't be cancelled, see ProcessExecutor.run.
+            call = self.driver.process_executor.run(
+                function, event, *groups, timeout=timeout
+            )
+        else:
+            # By default, we use the global threadpool of the driver.
+            task = function
+            if timeout:
+                task = TimedTask(
+                    function,
+                    timeout,
+                    name=function.name,
+                    plugin=self.__class__.__name__,
+                )
+            priority = TaskPriority(
+                self.priority if function.priority is None else function.priority
+            )
+            threadpool = self.driver.threadpool
+            if lane_key is None:
+                submit = partial(
+                    threadpool.add_task, task, event, *groups, priority=priority
+                )
+            else:
+                submit = partial(
+                    self.lanes.submit,
+                    lane_key,
+                    threadpool,
+                    task,
+                    event,
+                    *groups,
+                    priority=priority,
+                )
+            # A full queue only holds up this call, not the event loop.
+            future = await threadpool.submit_async(submit)
+            return await self._await_task(future)
+
+        if lane_key is None:
+            await call
         else:
-            # By default, we use the global threadpool of the driver, but we could use
-            # a plugin-specific thread or process pool if we wanted.
-            self.driver.threadpool.add_task(function, event, *groups)
+            await self.lanes.run(lane_key, call)
+        return True
+
+    @staticmethod
+    async def _await_task(future: concurrent.futures.Future) -> bool:
+        """Waits for a threadpool task and raises its exception, if any. Returns False
+        if the task was dropped before it ran."""
+        waiter = asyncio.wrap_future(future)
+        try:
+            await asyncio.wait([waiter])
+        except asyncio.CancelledError:
+            # Takes the task off the queue if it didn't start yet.
+            waiter.cancel()
+            raise
+        if waiter.cancelled():
+            return False
+        waiter.result()
+        return True
+
+    def _listener_timeout(self, function: Function) -> float:
+        if function.timeout is not None:
+            return function.timeout
+        return getattr(self.settings, "LISTENER_TIMEOUT", 0)
+
+    async def _with_timeout(self, awaitable, function: Function, timeout: float):
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            log_timeout(function.name, timeout, "async", plugin=self.__class__.__name__)
 
 
 @dataclass
@@ -145,6 +256,7 @@ class PluginManager:
         self,
         plugins: Sequence[Plugin],
     ):
+        self.driver: Optional[Driver] = None
         self.settings: Optional[Settings] = None
         self.plugins = plugins
 
@@ -154,23 +266,41 @@ class PluginManager:
         self.webhook_listeners: Dict[re.Pattern, List[WebHookFunction]] = defaultdict(
             list
         )
+        self.message_index: Optional[ListenerIndex[MessageFunction]] = None
+        # Webhook ids that equal a literal listener pattern, mapped to every listener
+        # that matches them. Other ids fall back to searching each pattern.
+        self._webhook_routes: Dict[str, List[WebHookFunction]] = {}
+        # Eligible listeners per pattern id, keyed by (is_direct, is_mentioned)
+        self._eligible_listeners: Dict[
+            Tuple[bool, bool], Dict[int, List[MessageFunction]]
+        ] = {}
+        # Listeners that silently ignore other channels/users, bucketed by the
+        # channel/user names they accept.
+        self._channel_buckets: Dict[str, Set[MessageFunction]] = defaultdict(set)
+        self._user_buckets: Dict[str, Set[MessageFunction]] = defaultdict(set)
+        self._channel_restricted: Set[MessageFunction] = set()
+        self._user_restricted: Set[MessageFunction] = set()
 
     def initialize(self, driver: Driver, settings: Settings):
+        self.driver = driver
+        self.settings = settings
+
         for plugin in self.plugins:
             plugin.initialize(driver, self, settings)
 
             # Register listeners for any listener functions in the plugin
-            for attribute in dir(plugin):
-                attribute = getattr(plugin, attribute)
+            for name in dir(plugin):
+                attribute = getattr(plugin, name)
                 if not isinstance(attribute, Function):
                     continue
 
                 # Register this function and any potential siblings
-                for function in [attribute] + attribute.siblings:
+                for index, function in enumerate([attribute] + attribute.siblings):
                     # Plugin message/webhook handlers can be decorated multiple times
                     # resulting in multiple siblings that do not have .plugin defined
                     # or where the relationship with the parent plugin is incorrect
                     function.plugin = plugin
+                    function.attribute = (name, index)
                     if isinstance(function, MessageFunction):
                         self.message_listeners[function.matcher].append(function)
                     elif isinstance(function, WebHookFunction):
@@ -181,6 +311,118 @@ class PluginManager:
                             f" type {type(function)}."
                         )
 
+        # Build the dispatch index once all listeners are known.
+        self.message_index = ListenerIndex(self.message_listeners)
+        self._index_listener_predicates()
+        self._index_webhook_listeners()
+
+    def _index_webhook_listeners(self):
+        """Builds the routing table for webhook ids that are plain literals."""
+        self._webhook_routes.clear()
+        for matcher in self.webhook_listeners:
+            literal = literal_pattern(matcher)
+            if literal is not None and literal not in self._webhook_routes:
+                self._webhook_routes[literal] = self._search_webhook_listeners(literal)
+
+    def _search_webhook_listeners(self, webhook_id: str) -> List[WebHookFunction]:
+        return [
+            function
+            for matcher, functions in self.webhook_listeners.items()
+            if matcher.search(webhook_id)
+            for function in functions
+        ]
+
+    def match_webhook_listeners(self, webhook_id: str) -> List[WebHookFunction]:
+        """Returns the listeners of every webhook pattern that matches the given id, in
+        registration order."""
+        functions = self._webhook_routes.get(webhook_id)
+        if functions is None:
+            functions = self._search_webhook_listeners(webhook_id)
+        return functions
+
+    def _index_listener_predicates(self):
+        """Pre-computes which message listeners are eligible in which context, so that
+        listeners that would ignore a message anyway are skipped before their pattern
+        is searched or any task is created.
+
+        Listeners restricted with allowed_users/allowed_channels are only skipped if
+        they use silence_fail_msg, since the others have to reply that permission was
+        denied.
+        """
+        for index in (
+            self._eligible_listeners,
+            self._channel_buckets,
+            self._user_buckets,
+            self._channel_restricted,
+            self._user_restricted,
+        ):
+            index.clear()
+        for key in product((False, True), repeat=2):
+            self._eligible_listeners[key] = {}
+
+        for pattern_id, _, functions in self.message_index.entries():
+            for is_direct, is_mentioned in self._eligible_listeners:
+                eligible = [
+                    function
+                    for function in functions
+                    if function.listens_in(is_direct, is_mentioned)
+                ]
+                if eligible:
+                    self._eligible_listeners[(is_direct, is_mentioned)][
+                        pattern_id
+                    ] = eligible
+
+            for function in functions:
+                if not function.silence_fail_msg:
+                    continue
+                if function.allowed_channels:
+                    self._channel_restricted.add(function)
+                    for channel in function.allowed_channels:
+                        self._channel_buckets[channel].add(function)
+                if function.allowed_users:
+                    self._user_restricted.add(function)
+                    for user in function.allowed_users:
+                        self._user_buckets[user].add(function)
+
+    def match_message_listeners(
+        self, message: Message
+    ) -> Iterator[Tuple[re.Match, List[MessageFunction]]]:
+        """Yields (match, functions) for every registered message pattern that matches
+        the given message, in registration order.
+
+        Only functions that are eligible for this message (see
+        _index_listener_predicates) are returned, and patterns without any eligible
+        functions are not searched at all.
+        """
+        if self.message_index is None:
+            # Not initialized yet, fall back to searching every pattern.
+            for matcher, functions in self.message_listeners.items():
+                if match := matcher.search(message.text):
+                    yield match, functions
+            return
+
+        is_direct = message.is_direct_message
+        is_mentioned = is_direct or self.driver.user_id in message.mentions
+        eligible = self._eligible_listeners[(is_direct, is_mentioned)]
+
+        excluded: Set[MessageFunction] = set()
+        if self._channel_restricted:
+            excluded |= self._channel_restricted - self._channel_buckets.get(
+                message.channel_name, set()
+            )
+        if self._user_restricted:
+            excluded |= self._user_restricted - self._user_buckets.get(
+                message.sender_name, set()
+            )
+
+        def select(pattern_id, functions):
+            functions = eligible.get(pattern_id)
+            if functions and excluded:
+                functions = [f for f in functions if f not in excluded]
+            return functions
+
+        yield from self.message_index.search(message.text, select)
+
     def start(self):
         """Trigger on_start() on every registered plugin."""
         for plugin in self.plugins:
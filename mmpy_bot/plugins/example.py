@@ -20,18 +20,18 @@ class ExamplePlugin(Plugin):
     )
     async def users_access(self, message: Message):
         """Showcases a function with restricted access."""
-        self.driver.reply_to(message, "Access allowed!")
+        await self.driver.areply_to(message, "Access allowed!")
 
     @listen_to("^offtopic_channel$", allowed_channels=["off-topic"], category="admin")
     async def channels_access(self, message: Message):
         """Showcases a function which can only be used in specific channels."""
-        self.driver.reply_to(message, "Access allowed!")
+        await self.driver.areply_to(message, "Access allowed!")
 
     @listen_to("^busy|jobs$", re.IGNORECASE, needs_mention=True, category="admin")
     async def busy_reply(self, message: Message):
         """Show the number of busy worker threads."""
         busy = self.driver.threadpool.get_busy_workers()
-        self.driver.reply_to(
+        await self.driver.areply_to(
             message,
             f"Number of busy worker threads: {busy}",
         )
@@ -56,7 +56,9 @@ class ExamplePlugin(Plugin):
     @listen_to("^hello_channel$", needs_mention=True)
     async def hello_channel(self, message: Message):
         """Responds with a channel post rather than a reply."""
-        self.driver.create_post(channel_id=message.channel_id, message="hello channel!")
+        await self.driver.acreate_post(
+            channel_id=message.channel_id, message="hello channel!"
+        )
 
     # Needs admin permissions
     @listen_to("^hello_ephemeral$", needs_mention=True)
@@ -64,23 +66,23 @@ class ExamplePlugin(Plugin):
         """Tries to reply with an ephemeral message, if the bot has system admin
         permissions."""
         try:
-            self.driver.reply_to(message, "hello sender!", ephemeral=True)
+            await self.driver.areply_to(message, "hello sender!", ephemeral=True)
         except mattermostautodriver.exceptions.NotEnoughPermissions:
-            self.driver.reply_to(
+            await self.driver.areply_to(
                 message, "I do not have permission to create ephemeral posts!"
             )
 
     @listen_to("^hello_react$", re.IGNORECASE, needs_mention=True)
     async def hello_react(self, message: Message):
         """Responds by giving a thumbs up reaction."""
-        self.driver.react_to(message, "+1")
+        await self.driver.areact_to(message, "+1")
 
     @listen_to("^hello_file$", re.IGNORECASE, needs_mention=True)
     async def hello_file(self, message: Message):
         """Responds by uploading a text file."""
         file = Path("/tmp/hello.txt")
         file.write_text("Hello from this file!")
-        self.driver.reply_to(message, "Here you go", file_paths=[file])
+        await self.driver.areply_to(message, "Here you go", file_paths=[file])
 
     @listen_to("^!hello_webhook$", re.IGNORECASE, category="webhook")
     async def hello_webhook(self, message: Message):
@@ -106,19 +108,19 @@ class ExamplePlugin(Plugin):
     @listen_to("^!info$")
     async def info(self, message: Message):
         """Responds with the user info of the requesting user."""
-        user_email = self.driver.get_user_info(message.user_id)["email"]
+        user_email = (await self.driver.aget_user_info(message.user_id))["email"]
         reply = (
             f"TEAM-ID: {message.team_id}\nUSERNAME: {message.sender_name}\n"
             f"EMAIL: {user_email}\nUSER-ID: {message.user_id}\n"
             f"IS-DIRECT: {message.is_direct_message}\nMENTIONS: {message.mentions}\n"
             f"MESSAGE: {message.text}"
         )
-        self.driver.reply_to(message, reply)
+        await self.driver.areply_to(message, reply)
 
     @listen_to("^ping$", re.IGNORECASE, needs_mention=True)
     async def ping_reply(self, message: Message):
         """Pong."""
-        self.driver.reply_to(message, "pong")
+        await self.driver.areply_to(message, "pong")
 
     @listen_to(
         "^reply at (.*)$", re.IGNORECASE, needs_mention=True, category="schedule"
@@ -170,6 +172,8 @@ class ExamplePlugin(Plugin):
         Arguments:
             - seconds: How many seconds to sleep for.
         """
-        self.driver.reply_to(message, f"Okay, I will be waiting {seconds} seconds.")
+        await self.driver.areply_to(
+            message, f"Okay, I will be waiting {seconds} seconds."
+        )
         await asyncio.sleep(int(seconds))
-        self.driver.reply_to(message, "Done!")
+        await self.driver.areply_to(message, "Done!")
@@ -94,6 +94,6 @@ class HelpPlugin(Plugin):
     @listen_to("^help$", needs_mention=True, human_description="help")
     async def help(self, message: Message):
         """Shows this help information."""
-        self.driver.reply_to(
+        await self.driver.areply_to(
             message, self.get_help_string(message), direct=self.direct_help
         )
@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import functools
+import inspect
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+from enum import Enum
+from multiprocessing.connection import Client, Connection, Listener
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+from mmpy_bot.timeouts import log_timeout
+
+if TYPE_CHECKING:
+    from mmpy_bot.driver import Driver
+    from mmpy_bot.function import Function
+    from mmpy_bot.plugins import Plugin
+
+log = logging.getLogger("mmpy.process_executor")
+
+
+class Executor(str, Enum):
+    """Where the synchronous listeners of a plugin run."""
+
+    # On the threadpool of the driver
+    THREAD = "thread"
+    # On a pool of processes, see ProcessExecutor
+    PROCESS = "process"
+
+
+class DriverProxy:
+    """Stands in for the Driver in listener processes. Its methods are called on the
+    real driver in the bot process, and return the result.
+
+    Only the blocking methods (e.g. reply_to, not areply_to) can be called, and their
+    arguments and results need to be picklable.
+    """
+
+    def __init__(self, address, authkey: bytes, user_id: str, username: str):
+        self._address = address
+        self._authkey = authkey
+        self.user_id = user_id
+        self.username = username
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return functools.partial(self._call, name)
+
+    def _call(self, name: str, *args, **kwargs):
+        global _connection
+        with _connection_lock:
+            if _connection is None:
+                _connection = Client(self._address, authkey=self._authkey)
+            _connection.send((name, args, kwargs))
+            ok, result = _connection.recv()
+        if not ok:
+            raise result
+        return result
+
+
+# State of a listener process
+_driver: Optional[DriverProxy] = None
+_connection: Optional[Connection] = None
+_connection_lock = threading.Lock()
+_plugins: Dict[str, Plugin] = {}
+
+
+def _init_process(driver: DriverProxy):
+    global _driver
+    _driver = driver
+
+
+def _call_listener(
+    plugin_key: str,
+    plugin_state: bytes,
+    attribute: Tuple[str, int],
+    event,
+    groups: Tuple[str, ...],
+):
+    """Runs a listener in a listener process, on this process's copy of its plugin."""
+    plugin = _plugins.get(plugin_key)
+    if plugin is None:
+        plugin = _plugins[plugin_key] = pickle.loads(plugin_state)
+        plugin.driver = _driver  # type: ignore
+    name, index = attribute
+    listener = getattr(type(plugin), name)
+    function = ([listener] + listener.siblings)[index]
+    function.plugin = plugin
+    return function(event, *groups)
+
+
+class ProcessExecutor:
+    """Runs synchronous listeners on a pool of processes, so CPU-bound listeners aren't
+    held up by the GIL. The processes are started when the first listener runs.
+
+    Each process works on its own copy of the plugin, made when one of its listeners
+    first runs in a process. Changes to the attributes of the plugin don't carry over
+    between the bot and the processes. The driver of the copy is a DriverProxy.
+
+    Arguments:
+    - driver: Driver, on which the calls of the DriverProxy are made.
+    - num_processes: int, size of the pool, 0 means one process per CPU.
+    """
+
+    def __init__(self, driver: Driver, num_processes: int = 0):
+        self.driver = driver
+        self.num_processes = num_processes or os.cpu_count() or 1
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._listener: Optional[Listener] = None
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        # Pickled plugins by id, see _plugin_state
+        self._plugin_states: Dict[int, Tuple[str, bytes]] = {}
+        # Listener calls that were submitted and haven't finished yet
+        self._futures: Set[concurrent.futures.Future] = set()
+        # Calls that ran past their timeout and are still running
+        self._stuck: Set[concurrent.futures.Future] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._pool is not None
+
+    def get_stuck_calls(self) -> int:
+        """Returns how many listener calls ran past their timeout and still occupy a
+        process."""
+        return len(self._stuck)
+
+    def start(self):
+        with self._lock:
+            if self._pool is not None:
+                return
+            authkey = os.urandom(32)
+            self._listener = Listener(authkey=authkey)
+            thread = threading.Thread(
+                target=self._accept_connections,
+                args=(self._listener,),
+                name="mmpy-driver-proxy",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+            proxy = DriverProxy(
+                self._listener.address,
+                authkey,
+                user_id=self.driver.user_id,
+                username=self.driver.username,
+            )
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                self.num_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process,
+                initargs=(proxy,),
+            )
+        log.info(f"Started {self.num_processes} listener processes.")
+
+    def stop(self, timeout: Optional[float] = None) -> int:
+        """Cancels the listener calls that didn't start yet, waits at most timeout
+        seconds for the running ones and stops the processes. Processes that are still
+        busy after that are terminated, and the number of calls they were running is
+        returned."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            listener, self._listener = self._listener, None
+        if pool is None:
+            return 0
+        # ProcessPoolExecutor.shutdown can't wait for a limited time.
+        pool.shutdown(wait=False, cancel_futures=True)
+        _, running = concurrent.futures.wait(list(self._futures), timeout)
+        if running:
+            log.warning(f"Terminating listener processes running {len(running)} calls.")
+            for process in list(pool._processes.values()):  # type: ignore
+                process.terminate()
+        pool.shutdown(wait=True)
+        listener.close()  # type: ignore
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads.clear()
+        self._plugin_states.clear()
+        log.info("Listener processes stopped.")
+        return len(running)
+
+    def _plugin_state(self, plugin: Plugin) -> Tuple[str, bytes]:
+        """Returns the key and pickled state of the plugin, which is pickled only once
+        and then sent along with each call."""
+        state = self._plugin_states.get(id(plugin))
+        if state is None:
+            try:
+                data = pickle.dumps(plugin)
+            except Exception as e:
+                raise TypeError(
+                    f"Plugin {plugin.__class__.__name__} can't be copied to a listener"
+                    f" process: {e}"
+                ) from e
+            state = self._plugin_states[id(plugin)] = (f"{id(plugin)}", data)
+        return state
+
+    def submit(self, function: Function, event, *groups) -> concurrent.futures.Future:
+        """Runs the listener in one of the processes."""
+        self.start()
+        plugin_key, plugin_state = self._plugin_state(function.plugin)  # type: ignore
+        future = self._pool.submit(  # type: ignore
+            _call_listener,
+            plugin_key,
+            plugin_state,
+            function.attribute,
+            event,
+            groups,
+        )
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return future
+
+    async def run(self, function: Function, event, *groups, timeout: float = 0) -> Any:
+        """Runs the listener in one of the processes and returns its result.
+
+        A process can't be interrupted without breaking the whole pool, so a call that
+        is still running after timeout seconds is only logged and counted as stuck
+        (see get_stuck_calls), and this keeps waiting for it. Calls that didn't start
+        by then are cancelled.
+        """
+        future = self.submit(function, event, *groups)
+        waiter = asyncio.wrap_future(future)
+        if not timeout:
+            return await waiter
+        try:
+            done, _ = await asyncio.wait({waiter}, timeout=timeout)
+        except asyncio.CancelledError:
+            waiter.cancel()
+            raise
+        if not done:
+            log_timeout(
+                function.name,  # type: ignore
+                timeout,
+                Executor.PROCESS.value,
+                plugin=function.plugin.__class__.__name__,
+            )
+            if future.cancel():
+                return None
+            self._stuck.add(future)
+            future.add_done_callback(self._stuck.discard)
+            try:
+                return await waiter
+            finally:
+                # The callback above runs on another thread, possibly only after this
+                # coroutine resumed.
+                if future.done():
+                    self._stuck.discard(future)
+        return await waiter
+
+    def _accept_connections(self, listener: Listener):
+        # Each listener process connects once, when it first uses the DriverProxy.
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, EOFError):
+                return
+            thread = threading.Thread(
+                target=self._serve, args=(connection,), daemon=True
+            )
+            thread.start()
+
+    def _serve(self, connection: Connection):
+        """Makes the driver calls of a listener process."""
+        with connection:
+            while True:
+                try:
+                    name, args, kwargs = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    method = getattr(self.driver, name)
+                    if inspect.iscoroutinefunction(method):
+                        raise TypeError(
+                            f"Driver.{name} is a coroutine, use its blocking version in"
+                            " listener processes."
+                        )
+                    response = (True, method(*args, **kwargs))
+                except Exception as e:
+                    response = (False, e)
+                try:
+                    connection.send(response)
+                except Exception as e:
+                    # E.g. the result can't be pickled.
+                    connection.send((False, TypeError(str(e))))
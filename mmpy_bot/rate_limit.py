@@ -0,0 +1,278 @@
+import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Dict, List, Optional
+
+import httpx
+from mattermostautodriver.client import AsyncClient, Client
+
+log = logging.getLogger("mmpy.rate_limit")
+
+
+class RequestPriority(IntEnum):
+    """Order in which outgoing requests are sent when they have to wait for the rate
+    limit. Lower values go first."""
+
+    # Replies, direct messages and reactions that a user is waiting for
+    HIGH = 0
+    NORMAL = 1
+    # Bulk posts, e.g. announcements or scheduled reports
+    BULK = 2
+
+
+_priority: contextvars.ContextVar[Optional[RequestPriority]] = contextvars.ContextVar(
+    "request_priority", default=None
+)
+
+
+@contextmanager
+def request_priority(priority: RequestPriority):
+    """Sends every request made in this context (thread or task) with the given
+    priority, e.g. `with request_priority(RequestPriority.BULK): ...`"""
+    token = _priority.set(RequestPriority(priority))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def prioritized(priority: RequestPriority):
+    """Decorator that sends the requests of a (coroutine) function with the given
+    priority, unless the caller already chose one with request_priority."""
+
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if _priority.get() is not None:
+                    return await function(*args, **kwargs)
+                with request_priority(priority):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _priority.get() is not None:
+                return function(*args, **kwargs)
+            with request_priority(priority):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class RateLimiter:
+    """Token bucket that paces the outgoing API requests of all worker threads and
+    coroutines, so the bot stays within the rate limit of the Mattermost server.
+
+    Requests that have to wait are released in order of their RequestPriority, then in
+    order of arrival. The burst and the remaining tokens follow the X-RateLimit-*
+    headers of the server, the rate itself is configured. Requests that are rejected
+    with status 429 are retried with backoff, also when the pacing is disabled.
+
+    Arguments:
+    - rate: float, number of requests per second, 0 disables the pacing.
+    - burst: int, number of requests that may be sent at once after an idle period.
+    - max_retries: int, how often a request is retried after a 429 response.
+    """
+
+    def __init__(self, rate: float = 0, burst: int = 100, max_retries: int = 5):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+
+        self.tokens = float(burst)
+        self._updated_at = time.monotonic()
+        # Set when the server reports that the limit is exhausted
+        self._blocked_until = 0.0
+        self._condition = threading.Condition()
+        # Heap of waiting requests: [priority, sequence number]
+        self._waiting: List[List[int]] = []
+        self._counter = itertools.count()
+
+        self.requests = 0
+        self.throttled = 0
+
+    def _refill(self, now: float):
+        self.tokens = min(
+            self.burst, self.tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    def _enqueue(self) -> List[int]:
+        priority = _priority.get()
+        ticket = [RequestPriority.NORMAL if priority is None else priority]
+        ticket.append(next(self._counter))
+        heapq.heappush(self._waiting, ticket)
+        return ticket
+
+    def _poll(self, ticket: List[int]) -> float:
+        """Takes a token if the ticket is first in line, otherwise returns how long to
+        wait before trying again. Must be called with the condition held."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._waiting[0] is ticket and self.tokens >= 1:
+            heapq.heappop(self._waiting)
+            self.tokens -= 1
+            self.requests += 1
+            # Let the next request in line check whether it can go as well.
+            self._condition.notify_all()
+            return 0
+        return max((1 - self.tokens) / self.rate, 0.001)
+
+    def _discard(self, ticket: List[int]):
+        with self._condition:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+    def acquire(self):
+        """Blocks the current thread until the request may be sent."""
+        if not self.rate:
+            return
+        with self._condition:
+            ticket = self._enqueue()
+            while wait := self._poll(ticket):
+                self._condition.wait(wait)
+
+    async def acquire_async(self):
+        """Waits without blocking the event loop until the request may be sent."""
+        if not self.rate:
+            return
+        with self._condition:
+            ticket = self._enqueue()
+        try:
+            while True:
+                with self._condition:
+                    wait = self._poll(ticket)
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            self._discard(ticket)
+            raise
+
+    def update(self, response: httpx.Response, attempt: int) -> Optional[float]:
+        """Adjusts the bucket to the rate limit headers of the response.
+
+        Returns how long to wait before retrying the request if it was rejected because
+        of the rate limit, or None if it shouldn't be retried.
+        """
+        headers = response.headers
+        now = time.monotonic()
+        with self._condition:
+            self._refill(now)
+            if "X-RateLimit-Limit" in headers:
+                self.burst = int(headers["X-RateLimit-Limit"])
+            if "X-RateLimit-Remaining" in headers:
+                remaining = int(headers["X-RateLimit-Remaining"])
+                self.tokens = min(self.tokens, remaining)
+                if remaining <= 0 and "X-RateLimit-Reset" in headers:
+                    reset = float(headers["X-RateLimit-Reset"])
+                    self._blocked_until = max(self._blocked_until, now + reset)
+
+        if response.status_code != 429:
+            return None
+
+        self.throttled += 1
+        if attempt >= self.max_retries:
+            log.warning(f"Rate limited, giving up after {attempt} retries.")
+            return None
+
+        backoff = min(0.5 * 2**attempt, 30)
+        delay = max(float(headers.get("Retry-After", 0)), backoff)
+        with self._condition:
+            self._blocked_until = max(self._blocked_until, now + delay)
+        log.info(f"Rate limited, retrying in {delay:.1f} seconds.")
+        return delay
+
+    def stats(self) -> Dict[str, float]:
+        with self._condition:
+            return {
+                "tokens": self.tokens,
+                "waiting": len(self._waiting),
+                "requests": self.requests,
+                "throttled": self.throttled,
+            }
+
+
+class RateLimitedClient(Client):
+    """Blocking mattermostautodriver client that sends its requests through a shared
+    RateLimiter, if one is set."""
+
+    rate_limiter: Optional[RateLimiter] = None
+
+    def make_request(
+        self,
+        method,
+        endpoint,
+        options=None,
+        params=None,
+        data=None,
+        files=None,
+        basepath=None,
+    ):
+        if self.rate_limiter is None or basepath is not None:
+            return super().make_request(
+                method, endpoint, options, params, data, files, basepath
+            )
+
+        request, url, request_params = self._build_request(
+            method, options, params, data, files
+        )
+        for attempt in itertools.count():
+            self.rate_limiter.acquire()
+            response = request(url + endpoint, **request_params)
+            if (delay := self.rate_limiter.update(response, attempt)) is None:
+                break
+            time.sleep(delay)
+
+        self._check_response(response)
+        return response
+
+
+class RateLimitedAsyncClient(AsyncClient):
+    """Async counterpart of RateLimitedClient."""
+
+    rate_limiter: Optional[RateLimiter] = None
+
+    async def make_request(
+        self,
+        method,
+        endpoint,
+        options=None,
+        params=None,
+        data=None,
+        files=None,
+        basepath=None,
+    ):
+        if self.rate_limiter is None or basepath is not None:
+            return await super().make_request(
+                method, endpoint, options, params, data, files, basepath
+            )
+
+        request, url, request_params = self._build_request(
+            method, options, params, data, files
+        )
+        for attempt in itertools.count():
+            await self.rate_limiter.acquire_async()
+            response = await request(url + endpoint, **request_params)
+            if (delay := self.rate_limiter.update(response, attempt)) is None:
+                break
+            await asyncio.sleep(delay)
+
+        self._check_response(response)
+        return response
@@ -1,10 +1,118 @@
-from datetime import datetime
+import functools
+import heapq
+import importlib
+import inspect
+import itertools
+import logging
+import pickle
+import threading
+import uuid
+from collections import Counter
+from collections.abc import MutableSequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from enum import Enum
 from multiprocessing import Pipe, Process
 from multiprocessing.connection import Connection
-from typing import Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set
 
 import schedule
-from schedule import default_scheduler
+
+from mmpy_bot.cron import CronSchedule
+from mmpy_bot.job_store import JobStore, MisfirePolicy, StoredJob
+
+log = logging.getLogger("mmpy.scheduler")
+
+
+class JobConcurrency(str, Enum):
+    """What to do when a job is due while its previous run hasn't finished yet."""
+
+    # Start another run alongside the current one.
+    OVERLAP = "overlap"
+    # Skip the run. The next run is scheduled once the current one finishes.
+    SKIP = "skip"
+    # Start the run as soon as the current one finishes.
+    QUEUE = "queue"
+
+
+def _set_concurrency(self: schedule.Job, policy: JobConcurrency) -> schedule.Job:
+    """Sets the JobConcurrency policy of a job, e.g.
+    `schedule.every(10).seconds.concurrency("queue").do(job)`."""
+    self._concurrency = JobConcurrency(policy)
+    return self
+
+
+def _is_cancel(result) -> bool:
+    return isinstance(result, schedule.CancelJob) or result is schedule.CancelJob
+
+
+class _SubprocessCall:
+    """Replaces the job_func of a job tagged "subprocess", to run it in another process
+    than the calling thread."""
+
+    def __init__(self, function: Callable):
+        self.function = function
+
+    def __getattr__(self, name: str):
+        # Job.__repr__ reads the name, args and keywords of the partial job_func.
+        return getattr(self.function, name)
+
+
+class _ProcessPoolCall(_SubprocessCall):
+    """Runs the function on a reusable process pool."""
+
+    def __init__(self, function: Callable, pool: Callable[[], ProcessPoolExecutor]):
+        super().__init__(function)
+        self.pool = pool
+
+    def __call__(self):
+        return self.pool().submit(self.function).result()
+
+
+class _ForkedCall(_SubprocessCall):
+    """Runs a function that can't be pickled in a new forked process each time."""
+
+    def __call__(self):
+        def wrapped_run(pipe: Connection):
+            pipe.send(self.function())
+
+        pipe, child_pipe = Pipe()
+        process = Process(target=wrapped_run, args=(child_pipe,))
+        process.start()
+        try:
+            return pipe.recv()
+        finally:
+            process.join()
+
+
+class _StoredCall:
+    """The job_func of a job loaded from a JobStore. The function is looked up and the
+    arguments are unpickled when the job runs for the first time, so loading many jobs
+    stays cheap."""
+
+    def __init__(self, scheduler: "Scheduler", reference: str, arguments: bytes):
+        self.scheduler = scheduler
+        self.reference = reference
+        self.arguments = arguments
+        self.__name__ = reference.replace(":", ".").rsplit(".", 1)[-1]
+        self._partial: Optional[functools.partial] = None
+
+    @property
+    def partial(self) -> functools.partial:
+        if self._partial is None:
+            function = self.scheduler.resolve_reference(self.reference)
+            args, kwargs = pickle.loads(self.arguments)
+            self._partial = functools.partial(function, *args, **kwargs)
+        return self._partial
+
+    def __getattr__(self, name: str):
+        # Job.__repr__ reads the args and keywords of the partial job_func.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.partial, name)
+
+    def __call__(self):
+        return self.partial()
 
 
 class OneTimeJob(schedule.Job):
@@ -23,15 +131,592 @@ class OneTimeJob(schedule.Job):
             raise AssertionError("The next_time parameter should be a datetime object.")
         self.at_time = next_time
         self.next_run = next_time
+        if self.scheduler is not None and hasattr(self.scheduler, "reschedule"):
+            self.scheduler.reschedule(self)
 
     def run(self):
         super().run()
         return schedule.CancelJob()
 
 
-def _default_scheduler_once(self, trigger_time: datetime):
-    job = OneTimeJob(0, self)
-    job.set_next_run(trigger_time)
+class CronJob(schedule.Job):
+    """A job that runs whenever one of its cron expressions matches, except on the
+    excluded dates. The expressions are compiled once, so calculating the next run
+    is cheap however many times they match, see CronSchedule."""
+
+    def __init__(
+        self,
+        expressions: Sequence[str],
+        scheduler: Optional[schedule.Scheduler] = None,
+        exclude: Iterable[date] = (),
+    ):
+        super().__init__(0, scheduler)
+        self.cron = CronSchedule(expressions, exclude)
+
+    def _schedule_next_run(self):
+        next_run = self.cron.next_after(datetime.now())
+        # Never, if only excluded dates were left.
+        self.next_run = next_run or datetime.max
+
+    def missed_runs(self, now: datetime) -> int:
+        """Returns how many runs were due since next_run, for MisfirePolicy.RUN_ALL."""
+        return max(self.cron.count_between(self.next_run, now), 1)
+
+    def __repr__(self):
+        txt = super().__repr__()
+        expressions = ", ".join(e.expression for e in self.cron.expressions)
+        return txt.replace("Every 0 None", f"Cron '{expressions}'")
+
+
+class _JobList(MutableSequence):
+    """The jobs list of a Scheduler. It keeps the heap of the scheduler up to date when
+    jobs are added or removed through the regular list interface (e.g. by
+    schedule.Job.do or schedule.clear), and is backed by an insertion-ordered dict so
+    jobs can be removed in constant time."""
+
+    def __init__(self, scheduler: "Scheduler"):
+        self._scheduler = scheduler
+        self._jobs: Dict[schedule.Job, None] = {}
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def __iter__(self) -> Iterator[schedule.Job]:
+        return iter(list(self._jobs))
+
+    def __contains__(self, job) -> bool:
+        return job in self._jobs
+
+    def __getitem__(self, index):
+        if index == 0 and self._jobs:
+            return next(iter(self._jobs))
+        return list(self._jobs)[index]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, (list, _JobList)) and list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return repr(list(self._jobs))
+
+    def append(self, job: schedule.Job):
+        with self._scheduler._lock:
+            self._jobs[job] = None
+            self._scheduler._add(job)
+
+    def remove(self, job: schedule.Job):
+        with self._scheduler._lock:
+            try:
+                del self._jobs[job]
+            except KeyError:
+                raise ValueError(f"{job!r} is not scheduled.") from None
+            self._scheduler._discard(job)
+
+    def _replace(self, jobs: List[schedule.Job]):
+        with self._scheduler._lock:
+            jobs_dict = dict.fromkeys(jobs)
+            for job in self._jobs:
+                if job not in jobs_dict:
+                    self._scheduler._discard(job)
+            self._jobs = jobs_dict
+            self._scheduler._rebuild()
+
+    def __setitem__(self, index, value):
+        jobs = list(self._jobs)
+        jobs[index] = value
+        self._replace(jobs)
+
+    def __delitem__(self, index):
+        jobs = list(self._jobs)
+        del jobs[index]
+        self._replace(jobs)
+
+    def insert(self, index: int, job: schedule.Job):
+        jobs = list(self._jobs)
+        jobs.insert(index, job)
+        self._replace(jobs)
+
+    def clear(self):
+        self._replace([])
+
+
+class Scheduler(schedule.Scheduler):
+    """schedule.Scheduler that keeps its jobs in a min-heap ordered by their next run
+    time, so run_pending only looks at the jobs that are due instead of every job.
+
+    wait_for_next_job sleeps exactly until the next job is due, and returns early when
+    a job is added that should run before that.
+
+    run_pending doesn't run the due jobs itself but hands them to a pool of worker
+    threads, subject to the JobConcurrency policy of each job (SKIP by default). Jobs
+    tagged "subprocess" run on a pool of reusable processes.
+
+    Jobs marked with persist are kept in the JobStore passed to load_jobs, and survive
+    a restart.
+
+    Arguments:
+    - max_workers: int, number of threads to run jobs on.
+    - max_processes: int, number of processes to run "subprocess" jobs on.
+    """
+
+    def __init__(self, max_workers: int = 4, max_processes: int = 2):
+        super().__init__()
+        self.max_workers = max_workers
+        self.max_processes = max_processes
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.RLock()
+        self._wakeup = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self.jobs: _JobList = _JobList(self)  # type: ignore
+        # Entries [next run, sequence number, job]. An entry is stale if the job was
+        # removed or rescheduled since, see _entries.
+        self._heap: List[list] = []
+        self._entries: Dict[schedule.Job, list] = {}
+        self._counter = itertools.count()
+        # Number of runs of each job that are in progress, or waiting (QUEUE policy)
+        self._running: Counter = Counter()
+        self._queued: Counter = Counter()
+        # Jobs that are off the heap until their current run finishes (SKIP policy)
+        self._paused: Set[schedule.Job] = set()
+        # Number of missed runs to catch up on (MisfirePolicy.RUN_ALL)
+        self._catch_up: Counter = Counter()
+
+        self.store: Optional[JobStore] = None
+        self.misfire_policy = MisfirePolicy.RUN_ONCE
+        # Persistent jobs by id, and the objects whose methods they may call
+        self._stored: Dict[str, schedule.Job] = {}
+        self._targets: Dict[str, object] = {}
+
+    def _push(self, job: schedule.Job):
+        if self._catch_up[job]:
+            # Run again right away instead of at the next regular time.
+            self._catch_up[job] -= 1
+            job.next_run = datetime.now()
+        else:
+            self._catch_up.pop(job, None)
+        entry = [job.next_run, next(self._counter), job]
+        self._entries[job] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            # Let wait_for_next_job know that it should wake up earlier.
+            self._wakeup.notify_all()
+        if self.store is not None and getattr(job, "_store_id", None):
+            self.store.update_runs(
+                [(job._store_id, _timestamp(job.next_run), _timestamp(job.last_run))]
+            )
+
+    def _add(self, job: schedule.Job):
+        if job not in self._paused:
+            self._push(job)
+
+    def _discard(self, job: schedule.Job):
+        self._entries.pop(job, None)
+        self._catch_up.pop(job, None)
+        store_id = getattr(job, "_store_id", None)
+        if store_id and self._stored.get(store_id) is job:
+            del self._stored[store_id]
+            if self.store is not None:
+                self.store.remove([store_id])
+
+    def _rebuild(self):
+        """Rebuilds the heap after the jobs list was changed in bulk."""
+        self._entries.clear()
+        self._heap.clear()
+        for job in self.jobs:
+            if job not in self._paused:
+                self._entries[job] = entry = [job.next_run, next(self._counter), job]
+                self._heap.append(entry)
+        heapq.heapify(self._heap)
+        self._wakeup.notify_all()
+
+    def reschedule(self, job: schedule.Job):
+        """Updates the position of a job whose next_run was changed by hand."""
+        with self._lock:
+            if job in self.jobs and job not in self._paused:
+                self._push(job)
+
+    def once(self, trigger_time: datetime) -> OneTimeJob:
+        """Schedules a new job that runs once, at the given time."""
+        job = OneTimeJob(0, self)
+        job.set_next_run(trigger_time)
+        return job
+
+    def cron(self, *expressions: str, exclude: Iterable[date] = ()) -> CronJob:
+        """Schedules a new job that runs whenever one of the cron expressions matches,
+        but not on the excluded dates."""
+        return CronJob(expressions, self, exclude)
+
+    def _pop_due(self, now: datetime) -> List[schedule.Job]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            job = entry[2]
+            if self._entries.get(job) is not entry:
+                continue
+            if job.next_run != entry[0]:
+                # Its next_run was changed without telling us.
+                self._push(job)
+                continue
+            del self._entries[job]
+            due.append(job)
+        return due
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="mmpy-job"
+                )
+            return self._executor
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(self.max_processes)
+            return self._process_pool
+
+    def shutdown(self, wait: bool = True):
+        """Stops the worker threads and processes, after the running jobs finished if
+        wait is True. They are started again when the next job is due."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            process_pool, self._process_pool = self._process_pool, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+        if process_pool is not None:
+            process_pool.shutdown(wait=wait)
+
+    def run_pending(self):
+        """Starts the jobs that are due on the worker threads, without waiting for
+        them."""
+        with self._lock:
+            for job in sorted(self._pop_due(datetime.now())):
+                self._dispatch(job)
+
+    def _dispatch(self, job: schedule.Job):
+        # Must be called with the lock held
+        policy = getattr(job, "_concurrency", JobConcurrency.SKIP)
+        if policy is JobConcurrency.SKIP or isinstance(job, OneTimeJob):
+            # Job.run schedules the next run once this one finished.
+            self._paused.add(job)
+            self._start(job, reschedule=True)
+            return
+
+        # Keep the job on schedule while this run is in progress.
+        job._schedule_next_run()
+        if not job._is_overdue(job.next_run):
+            self._push(job)
+        if policy is JobConcurrency.QUEUE and self._running[job]:
+            self._queued[job] += 1
+        else:
+            self._start(job, reschedule=False)
+
+    def _start(self, job: schedule.Job, reschedule: bool):
+        self._running[job] += 1
+        self.executor.submit(self._execute, job, reschedule)
+
+    def _execute(self, job: schedule.Job, reschedule: bool):
+        """Runs a job on a worker thread."""
+        cancel = False
+        try:
+            if reschedule:
+                self._run_job(job)
+            elif job._is_overdue(datetime.now()):
+                cancel = True
+            else:
+                # Like Job.run, but the next run was scheduled already.
+                cancel = _is_cancel(_prepare(self, job).job_func())
+                job.last_run = datetime.now()
+        except Exception:
+            log.exception(f"Unhandled exception in scheduled job {job}")
+            if reschedule:
+                # Job.run didn't get to schedule the next run.
+                job._schedule_next_run()
+                cancel = isinstance(job, OneTimeJob) or job._is_overdue(job.next_run)
+        finally:
+            self._job_finished(job, reschedule, cancel)
+
+    def _job_finished(self, job: schedule.Job, reschedule: bool, cancel: bool):
+        with self._lock:
+            self._running[job] -= 1
+            if not self._running[job]:
+                del self._running[job]
+            if reschedule:
+                self._paused.discard(job)
+
+            if cancel or job not in self.jobs:
+                self._queued.pop(job, None)
+                self.cancel_job(job)
+            elif self._queued[job]:
+                self._queued[job] -= 1
+                if not self._queued[job]:
+                    del self._queued[job]
+                self._start(job, reschedule=False)
+            elif reschedule:
+                self._push(job)
+            elif job not in self._entries and job not in self._running:
+                # The run deadline of the job (see Job.until) has passed.
+                self.cancel_job(job)
+
+            if not self._running:
+                self._idle.notify_all()
+
+    def get_running_jobs(self) -> int:
+        """Returns how many job runs are in progress."""
+        with self._lock:
+            return sum(self._running.values())
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Waits until no job is running anymore. Returns False if some still were
+        once the timeout passed."""
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._running, timeout)
+
+    def register_target(self, name: str, target: object):
+        """Lets persistent jobs call the methods of the given object (e.g. a plugin or
+        the driver), which is looked up by name when they are loaded again."""
+        self._targets[name] = target
+
+    def _reference(self, function: Callable) -> str:
+        """Returns a name by which the function can be found again after a restart."""
+        target = getattr(function, "__self__", None)
+        if target is not None and not inspect.ismodule(target):
+            for name, registered in self._targets.items():
+                if registered is target:
+                    return f"{name}.{function.__name__}"
+            raise ValueError(
+                f"Can't persist a job that calls {function!r}, the object it belongs to "
+                "isn't registered with Scheduler.register_target."
+            )
+        qualname = getattr(function, "__qualname__", "")
+        if not qualname or "<" in qualname:
+            raise ValueError(
+                f"Can't persist a job that calls {function!r}, only module-level "
+                "functions and methods of registered objects can be persisted."
+            )
+        return f"{function.__module__}:{qualname}"
+
+    def resolve_reference(self, reference: str) -> Callable:
+        """Looks up the function that a persisted job calls."""
+        if ":" in reference:
+            module, qualname = reference.split(":", 1)
+            target = importlib.import_module(module)
+        else:
+            name, qualname = reference.split(".", 1)
+            if name not in self._targets:
+                raise LookupError(f"No object named {name} was registered.")
+            target = self._targets[name]
+        for attribute in qualname.split("."):
+            target = getattr(target, attribute)
+        return target  # type: ignore
+
+    def persist_job(
+        self,
+        job: schedule.Job,
+        job_id: Optional[str] = None,
+        misfire_policy: Optional[MisfirePolicy] = None,
+    ) -> schedule.Job:
+        """Keeps the job in the JobStore, so it is loaded again after a restart. A job
+        that was persisted with the same id before is replaced."""
+        if self.store is None:
+            raise ValueError("Can't persist jobs without a JobStore, see load_jobs.")
+        if isinstance(job.job_func, _StoredCall):
+            reference, arguments = job.job_func.reference, job.job_func.arguments
+        else:
+            function = job.job_func
+            if isinstance(function, _SubprocessCall):
+                function = function.function
+            reference = self._reference(function.func)
+            arguments = pickle.dumps((function.args, function.keywords))
+        spec = {
+            name: value
+            for name, value in vars(job).items()
+            if name in _SPEC_ATTRIBUTES or name == "_concurrency"
+        }
+        job_id = job_id or getattr(job, "_store_id", None) or uuid.uuid4().hex
+
+        with self._lock:
+            previous = self._stored.get(job_id)
+            if previous is not None and previous is not job:
+                self.cancel_job(previous)
+            job._store_id = job_id
+            if misfire_policy is not None:
+                job._misfire_policy = MisfirePolicy(misfire_policy)
+            self._stored[job_id] = job
+            self.store.add(
+                StoredJob(
+                    id=job_id,
+                    job_class=f"{type(job).__module__}:{type(job).__qualname__}",
+                    function=reference,
+                    arguments=arguments,
+                    spec=pickle.dumps(spec),
+                    next_run=_timestamp(job.next_run),
+                    last_run=_timestamp(job.last_run),
+                    misfire_policy=getattr(job, "_misfire_policy", None),
+                )
+            )
+        return job
+
+    def load_jobs(
+        self,
+        store: JobStore,
+        misfire_policy: MisfirePolicy = MisfirePolicy.RUN_ONCE,
+    ) -> List[schedule.Job]:
+        """Uses the given store for persistent jobs, and schedules the jobs it holds.
+
+        Jobs that should have run in the meantime are handled according to their own
+        or the given MisfirePolicy.
+        """
+        self.store = store
+        self.misfire_policy = MisfirePolicy(misfire_policy)
+        now = datetime.now()
+        jobs, updates, expired = [], [], []
+
+        for stored in store.load():
+            if stored.id in self._stored:
+                continue
+            job = self._restore(stored)
+            if job.next_run < now:
+                policy = getattr(job, "_misfire_policy", self.misfire_policy)
+                if policy is MisfirePolicy.SKIP:
+                    if isinstance(job, OneTimeJob):
+                        expired.append(stored.id)
+                        continue
+                    job._schedule_next_run()
+                else:
+                    if policy is MisfirePolicy.RUN_ALL:
+                        missed = _missed_runs(job, now)
+                        if missed > 1:
+                            self._catch_up[job] = missed - 1
+                    job.next_run = now
+                updates.append((stored.id, _timestamp(job.next_run), stored.last_run))
+            jobs.append(job)
+
+        with self._lock:
+            for job in jobs:
+                self.jobs._jobs[job] = None
+                self._stored[job._store_id] = job
+                self._entries[job] = entry = [job.next_run, next(self._counter), job]
+                self._heap.append(entry)
+            heapq.heapify(self._heap)
+            self._wakeup.notify_all()
+        store.update_runs(updates)
+        store.remove(expired)
+        log.info(f"Loaded {len(jobs)} persistent jobs.")
+        return jobs
+
+    def _restore(self, stored: StoredJob) -> schedule.Job:
+        module, qualname = stored.job_class.split(":", 1)
+        job_class = importlib.import_module(module)
+        for attribute in qualname.split("."):
+            job_class = getattr(job_class, attribute)
+
+        spec = pickle.loads(stored.spec)
+        # Subclasses may take other arguments, their attributes are restored below.
+        job = job_class.__new__(job_class)  # type: ignore
+        schedule.Job.__init__(job, 0, self)
+        vars(job).update(spec)
+        job.job_func = _StoredCall(self, stored.function, stored.arguments)
+        job.next_run = datetime.fromtimestamp(stored.next_run)
+        if stored.last_run is not None:
+            job.last_run = datetime.fromtimestamp(stored.last_run)
+        if stored.misfire_policy:
+            job._misfire_policy = MisfirePolicy(stored.misfire_policy)
+        job._store_id = stored.id
+        return job
+
+    def get_next_run(self, tag=None) -> Optional[datetime]:
+        if tag is not None:
+            return super().get_next_run(tag)
+        with self._lock:
+            # Drop stale entries so the first one is accurate.
+            while self._heap and self._entries.get(self._heap[0][2]) is not (
+                self._heap[0]
+            ):
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    next_run = property(get_next_run)
+
+    def wait_for_next_job(self, timeout: Optional[float] = None):
+        """Blocks until the next job is due, a job was added that is due earlier, the
+        timeout passed or wakeup was called."""
+        with self._lock:
+            next_run = self.get_next_run()
+            if next_run is not None:
+                idle = (next_run - datetime.now()).total_seconds()
+                if idle <= 0:
+                    return
+                timeout = idle if timeout is None else min(timeout, idle)
+            self._wakeup.wait(timeout)
+
+    def wakeup(self):
+        """Wakes up the threads in wait_for_next_job."""
+        with self._lock:
+            self._wakeup.notify_all()
+
+
+# Attributes of schedule.Job that describe when it runs
+_SPEC_ATTRIBUTES = {
+    "interval",
+    "latest",
+    "unit",
+    "at_time",
+    "at_time_zone",
+    "start_day",
+    "cancel_after",
+    "tags",
+    "cron",
+}
+
+
+def _timestamp(moment: Optional[datetime]) -> Optional[float]:
+    return None if moment is None else moment.timestamp()
+
+
+def _missed_runs(job: schedule.Job, now: datetime) -> int:
+    """Returns how many runs of the job were due since its next_run."""
+    if isinstance(job, OneTimeJob):
+        return 1
+    if hasattr(job, "missed_runs"):
+        return job.missed_runs(now)
+    if job.unit not in ("seconds", "minutes", "hours", "days", "weeks"):
+        return 1
+    period = timedelta(**{job.unit: job.interval})
+    return int((now - job.next_run) / period) + 1
+
+
+def _persist(
+    self: schedule.Job,
+    job_id: Optional[str] = None,
+    misfire_policy: Optional[MisfirePolicy] = None,
+) -> schedule.Job:
+    """Keeps the job across restarts, e.g. `schedule.once(t).do(f).persist("id")`. See
+    Scheduler.persist_job."""
+    return self.scheduler.persist_job(self, job_id, misfire_policy)
+
+
+def _prepare(scheduler: schedule.Scheduler, job: schedule.Job) -> schedule.Job:
+    """Makes a job tagged "subprocess" run its function on the process pool of the
+    scheduler, or in a new process if the function can't be pickled."""
+    if "subprocess" in job.tags and not isinstance(job.job_func, _SubprocessCall):
+        function = job.job_func
+        if isinstance(function, _StoredCall):
+            function = function.partial
+        try:
+            pickle.dumps(function)
+            picklable = isinstance(scheduler, Scheduler)
+        except Exception:
+            picklable = False
+        if picklable:
+            job.job_func = _ProcessPoolCall(
+                function, lambda: scheduler.process_pool  # type: ignore
+            )
+        else:
+            log.debug(f"Running {job} in a new process each time, as it can't be sent")
+            job.job_func = _ForkedCall(function)  # type: ignore
     return job
 
 
@@ -39,26 +724,11 @@ def _run_job(self, job):
     """Overrides default_scheduler._run_job to support running the jobs in a separate
     process.
 
-    Either way, this waits for the result in a dedicated thread to prevent blocking the
-    event loop.
+    The Scheduler calls this on one of its worker threads, so waiting for the result
+    doesn't block the scheduler or the event loop.
     """
-    # Launch job in a dedicated process and send the result through a pipe.
-    if "subprocess" in job.tags:
-
-        def wrapped_run(pipe: Connection):
-            result = job.run()
-            pipe.send(result)
-
-        pipe, child_pipe = Pipe()
-        p = Process(target=wrapped_run, args=(child_pipe,))
-        p.start()
-        # This still blocks despite running in a subprocess
-        result = pipe.recv()
-    else:
-        # Or simply run the job in this thread
-        result = job.run()
-
-    if isinstance(result, schedule.CancelJob) or result is schedule.CancelJob:
+    result = _prepare(self, job).run()
+    if _is_cancel(result):
         self.cancel_job(job)
 
 
@@ -68,10 +738,21 @@ def _once(trigger_time: Optional[datetime] = None):
         trigger_time = datetime.now()
     if not isinstance(trigger_time, datetime):
         raise AssertionError("The trigger_time parameter should be a datetime object.")
-    return default_scheduler.once(self=default_scheduler, trigger_time=trigger_time)
+    return default_scheduler.once(trigger_time=trigger_time)
+
+
+def _cron(*expressions: str, exclude: Iterable[date] = ()) -> CronJob:
+    """Adds support for scheduling jobs with cron expressions to the
+    default_scheduler, e.g. `schedule.cron("0 9 * * mon-fri").do(job)`."""
+    return default_scheduler.cron(*expressions, exclude=exclude)
 
 
 # Monkey-Patching
-default_scheduler.once = _default_scheduler_once
+default_scheduler = Scheduler()
+schedule.default_scheduler = default_scheduler
+schedule.jobs = default_scheduler.jobs
 schedule.Scheduler._run_job = _run_job
+schedule.Job.concurrency = _set_concurrency
+schedule.Job.persist = _persist
 schedule.once = _once
+schedule.cron = _cron
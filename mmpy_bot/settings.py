@@ -57,6 +57,21 @@ class Settings:
     WEBHOOK_HOST_ENABLED: bool = False
     WEBHOOK_HOST_URL: str = "http://127.0.0.1"
     WEBHOOK_HOST_PORT: int = 8579
+    # Seconds to wait for a listener to respond to a webhook request (0 means forever),
+    # and the HTTP status that is sent once that deadline passes.
+    WEBHOOK_RESPONSE_TIMEOUT: float = 30
+    WEBHOOK_TIMEOUT_STATUS: int = 504
+    # Extra paths to accept webhooks on besides /hooks/{webhook_id}. They may contain
+    # more variables, which are passed to the listener as event.route_params, e.g.
+    # "/teams/{team}/hooks/{webhook_id}".
+    WEBHOOK_ROUTES: Sequence[str] = field(default_factory=list)
+    # Maximum number of events that may be sent to /hooks/batch in one request
+    WEBHOOK_BATCH_MAX_EVENTS: int = 1000
+    # Number of processes to receive webhooks in, which share the port through
+    # SO_REUSEPORT. 0 runs the webhook server on a thread of the bot instead.
+    WEBHOOK_PROCESSES: int = 0
+    # Listen on this Unix domain socket instead of WEBHOOK_HOST_URL and _PORT
+    WEBHOOK_UNIX_SOCKET: Optional[str] = None
     DEBUG: bool = False
     # Respond to channel message "!help" (without @bot)
     RESPOND_CHANNEL_HELP: bool = False
@@ -66,8 +81,76 @@ class Settings:
     LOG_DATE_FORMAT: str = "%m/%d/%Y %H:%M:%S"
 
     IGNORE_USERS: Sequence[str] = field(default_factory=list)
-    # How often to check whether any scheduled jobs need to be run, default every second
+    # Scheduled jobs run as soon as they are due. This is the longest the scheduler
+    # sleeps in between, e.g. to notice that the bot is stopping.
     SCHEDULER_PERIOD: float = 1.0
+    # Number of threads that scheduled jobs run on, and of processes for the jobs
+    # tagged "subprocess"
+    SCHEDULER_WORKERS: int = 4
+    SCHEDULER_PROCESSES: int = 2
+    # Keep the jobs marked with `.persist()` in this SQLite database, so they survive a
+    # restart. Jobs that were due in the meantime are handled according to
+    # JOB_MISFIRE_POLICY: "run_once", "run_all" or "skip".
+    JOB_STORE_FILE: Optional[str] = None
+    JOB_MISFIRE_POLICY: str = "run_once"
+
+    # Maximum number of listener calls that may run at the same time, in total and per
+    # plugin. 0 means unlimited.
+    MAX_CONCURRENT_LISTENERS: int = 0
+    MAX_CONCURRENT_LISTENERS_PER_PLUGIN: int = 0
+    # How many listener calls may wait for a free slot before OVERLOAD_POLICY applies
+    MAX_PENDING_LISTENERS: int = 100
+    # How many tasks may wait for a free worker thread, 0 means unlimited
+    THREADPOOL_QUEUE_SIZE: int = 0
+    # The threadpool runs at least MIN_WORKERS threads, and adds more up to MAX_WORKERS
+    # while tasks wait longer than TARGET_WAIT seconds for one. Threads above the
+    # minimum stop after being idle for IDLE_TIMEOUT seconds. The scheduler and webhook
+    # server each occupy a worker thread.
+    THREADPOOL_MIN_WORKERS: int = 4
+    THREADPOOL_MAX_WORKERS: int = 32
+    THREADPOOL_TARGET_WAIT: float = 0.1
+    THREADPOOL_IDLE_TIMEOUT: float = 60.0
+    # Queued tasks run by priority (see listen_to), but for every priority level a
+    # task is below another, it goes first once it waited this many seconds longer.
+    THREADPOOL_PRIORITY_AGING: float = 10.0
+    # Seconds after which listeners time out, see listen_to. 0 means never. Stuck
+    # worker threads are replaced if REPLACE_STUCK_WORKERS is set.
+    LISTENER_TIMEOUT: float = 0
+    REPLACE_STUCK_WORKERS: bool = True
+    # Number of processes for listeners that use the "process" executor, 0 means one
+    # per CPU
+    LISTENER_PROCESSES: int = 0
+    # On shutdown, the bot stops accepting events and waits at most this many seconds
+    # for queued and running listeners and scheduled jobs, before cancelling the rest.
+    SHUTDOWN_TIMEOUT: float = 30
+    # What to do when the limits above are reached: "block" (stop reading new events
+    # until there is room), "drop_oldest", "drop_newest" or "busy" (drop the new event
+    # and reply with OVERLOAD_BUSY_MESSAGE).
+    OVERLOAD_POLICY: str = "block"
+    OVERLOAD_BUSY_MESSAGE: str = "I'm too busy right now, please try again later."
+    # Run blocking driver calls (e.g. driver.reply_to) that are made from a coroutine on
+    # a worker thread, so they don't hold up the event loop. They then return an
+    # awaitable future instead of the result. Prefer the async versions, e.g.
+    # `await driver.areply_to(...)`.
+    OFFLOAD_BLOCKING_DRIVER_CALLS: bool = False
+    # How many direct channel ids to cache, and after how many seconds they expire (0
+    # means never, the id of a direct channel doesn't change).
+    DM_CHANNEL_CACHE_SIZE: int = 10000
+    DM_CHANNEL_CACHE_TTL: float = 0
+    # Optional JSON file to keep the cached direct channel ids in across restarts. The
+    # file is ignored when it was saved for another bot account.
+    DM_CHANNEL_CACHE_FILE: Optional[str] = None
+    # How many users, channels and team members to cache, and after how many seconds
+    # they expire. Entries are invalidated earlier when the websocket reports a change.
+    METADATA_CACHE_SIZE: int = 10000
+    METADATA_CACHE_TTL: float = 300
+    # Maximum number of API requests per second (0 disables pacing) and how many may be
+    # sent at once. While pacing, the burst and the remaining requests follow the
+    # server's X-RateLimit-* headers. Requests that are rejected with status 429 are
+    # always retried, up to RATE_LIMIT_MAX_RETRIES times.
+    RATE_LIMIT_PER_SECOND: float = 0
+    RATE_LIMIT_BURST: int = 100
+    RATE_LIMIT_MAX_RETRIES: int = 5
 
     SCHEME: str = field(init=False)  # Will be taken from the URL. Defaults to https.
 
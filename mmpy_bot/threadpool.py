@@ -1,100 +1,723 @@
 import asyncio
+import concurrent.futures
+import heapq
+import itertools
 import logging
 import threading
 import time
-from queue import Queue
+from enum import IntEnum
+from queue import Empty, Full, Queue
+from typing import Callable, Dict, List, Optional, Tuple
 
+from mmpy_bot.limiter import OverloadPolicy
 from mmpy_bot.scheduler import default_scheduler
+from mmpy_bot.timeouts import (
+    CancellationToken,
+    ListenerCancelled,
+    log_timeout,
+    using_token,
+)
 from mmpy_bot.webhook_server import WebHookServer
 
 log = logging.getLogger("mmpy.threadpool")
 
 
+class TaskPriority(IntEnum):
+    """Order in which the ThreadPool runs queued tasks. Lower values go first, but
+    tasks of a lower priority still run once they waited long enough, see _TaskQueue.
+    """
+
+    # Commands that a user is waiting for, and the scheduler and webhook server
+    INTERACTIVE = 0
+    # E.g. listeners that log or index every message
+    BACKGROUND = 1
+    # Large batches of work, e.g. imports or reports
+    BULK = 2
+
+    @classmethod
+    def _missing_(cls, value):
+        # Also accept the names, e.g. TaskPriority("bulk")
+        if isinstance(value, str):
+            return cls.__members__.get(value.upper())
+        return None
+
+
+class _TaskQueue(Queue):
+    """Queue that hands out tasks by priority, then in order of arrival.
+
+    To keep a steady stream of urgent tasks from starving the others, tasks age: each
+    priority level counts as if the task was queued `aging` seconds later. A bulk task
+    thus goes before interactive tasks that were queued more than 2 * aging seconds
+    after it. The order is fixed when a task is queued, so this is still a plain heap.
+
+    Items are (function, args, time.monotonic() at which they were queued, future,
+    priority).
+    """
+
+    def __init__(self, maxsize: int = 0, aging: float = 10.0):
+        self.aging = aging
+        super().__init__(maxsize)
+
+    # These are called by Queue with its mutex held.
+    def _init(self, maxsize):
+        # Heap of [sort key, sequence number, item]
+        self.queue: List[list] = []
+        self._counter = itertools.count()
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, item):
+        queued_at, priority = item[2], item[4]
+        key = queued_at + priority * self.aging
+        heapq.heappush(self.queue, [key, next(self._counter), item])
+
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
+
+    def peek(self) -> Optional[tuple]:
+        """Returns the task that goes next, without taking it off the queue."""
+        with self.mutex:
+            return self.queue[0][2] if self.queue else None
+
+    def get_least_urgent(self, priority: TaskPriority) -> Optional[tuple]:
+        """Takes the oldest of the queued tasks of the lowest priority off the queue,
+        unless all of them are more urgent than the given priority. Raises Empty if no
+        task is queued."""
+        with self.mutex:
+            if not self.queue:
+                raise Empty
+            index = max(
+                range(len(self.queue)),
+                key=lambda i: (self.queue[i][2][4], -self.queue[i][1]),
+            )
+            if self.queue[index][2][4] < priority:
+                return None
+            entry = self.queue[index]
+            self.queue[index] = self.queue[-1]
+            self.queue.pop()
+            heapq.heapify(self.queue)
+            self.not_full.notify()
+            return entry[2]
+
+
+class _WorkerState:
+    """Statistics of a worker thread. Only the worker itself writes them, so they can
+    be read at any time without a lock. The supervisor writes flagged and detached
+    when the current task of the worker times out."""
+
+    __slots__ = ("busy_since", "completed", "failed", "timer", "flagged", "detached")
+
+    def __init__(self):
+        # time.monotonic() at which the current task started, None while idle
+        self.busy_since: Optional[float] = None
+        self.completed = 0
+        # Tasks that raised an exception
+        self.failed = 0
+        # (task, token, deadline) of a running TimedTask
+        self.timer: Optional[Tuple["TimedTask", CancellationToken, float]] = None
+        # The timer that ran out, as long as the worker is stuck on it
+        self.flagged: Optional[tuple] = None
+        # Whether the worker was replaced, and stops once its task is done
+        self.detached = False
+
+    @property
+    def stuck(self) -> bool:
+        return self.flagged is not None and self.flagged is self.timer
+
+
+# The state of the worker running on the current thread
+_worker = threading.local()
+
+
+class TimedTask:
+    """Wraps a task that should finish within timeout seconds when it runs on the
+    ThreadPool. Otherwise, the pool cancels its CancellationToken (see
+    mmpy_bot.timeouts.current_token), logs the timeout and counts the worker as stuck
+    until the task returns. If replace_stuck_workers is set, another worker takes
+    its place right away.
+
+    Arguments:
+    - function: callable, the task.
+    - timeout: float, seconds.
+    - name: str, name of the task in the logs.
+    - log_fields: any other details to log along with a timeout.
+    """
+
+    def __init__(
+        self, function, timeout: float, name: Optional[str] = None, **log_fields
+    ):
+        self.function = function
+        self.timeout = timeout
+        self.name = name or getattr(function, "__qualname__", repr(function))
+        self.log_fields = log_fields
+
+    def __call__(self, *args):
+        state: Optional[_WorkerState] = getattr(_worker, "state", None)
+        token = CancellationToken()
+        if state is not None:
+            state.timer = (self, token, time.monotonic() + self.timeout)
+        try:
+            with using_token(token):
+                return self.function(*args)
+        except ListenerCancelled:
+            log.info(f"{self.name} stopped after it timed out.")
+        finally:
+            if state is not None:
+                state.timer = None
+
+    def dropped(self):
+        if hasattr(self.function, "dropped"):
+            self.function.dropped()
+
+
+class TaskFuture(concurrent.futures.Future):
+    """The result of a task added to the ThreadPool. Await it from a coroutine with
+    asyncio.wrap_future.
+
+    Like an asyncio future, it logs the exception of a failed task once it is garbage
+    collected, unless somebody retrieved it, so the errors of tasks that nobody waits
+    for still show up.
+    """
+
+    def __init__(self, function=None):
+        super().__init__()
+        self.name = getattr(function, "name", None) or getattr(
+            function, "__qualname__", repr(function)
+        )
+        self._retrieved = False
+
+    def result(self, timeout=None):
+        self._retrieved = True
+        return super().result(timeout)
+
+    def exception(self, timeout=None):
+        self._retrieved = True
+        return super().exception(timeout)
+
+    def __del__(self):
+        if self._retrieved or not self.done() or self.cancelled():
+            return
+        exception = super().exception()
+        if exception is not None:
+            log.error(
+                f"Unhandled exception in task {self.name}",
+                exc_info=(type(exception), exception, exception.__traceback__),
+            )
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
 class ThreadPool(object):
-    def __init__(self, num_workers: int):
+    def __init__(
+        self,
+        num_workers: int,
+        max_queue_size: int = 0,
+        overload_policy: OverloadPolicy = OverloadPolicy.BLOCK,
+        max_workers: int = 0,
+        target_queue_wait: float = 0.1,
+        idle_timeout: float = 60.0,
+        replace_stuck_workers: bool = True,
+        priority_aging: float = 10.0,
+    ):
         """Threadpool class to easily specify a number of worker threads and assign work
         to any of them.
 
+        The pool starts with num_workers threads. If max_workers is higher, it adds
+        threads while tasks wait longer than target_queue_wait for a free worker, and
+        stops the extra threads again once they were idle for idle_timeout seconds.
+
         Arguments:
-        - num_workers: int, how many threads to run simultaneously.
+        - num_workers: int, how many threads to run at least.
+        - max_queue_size: int, how many tasks can wait for a free worker, 0 means
+            unlimited.
+        - overload_policy: OverloadPolicy, what to do when a task is added to a full
+            queue. BLOCK waits for room, DROP_OLDEST discards the longest waiting task
+            of the lowest priority, DROP_NEWEST and BUSY discard the new task.
+            Discarded tasks that have a `dropped` method are notified through it.
+        - max_workers: int, how many threads to run at most. Defaults to num_workers,
+            which keeps the size of the pool fixed.
+        - target_queue_wait: float, seconds a task may wait for a worker before the
+            pool grows.
+        - idle_timeout: float, seconds after which an idle thread above num_workers
+            stops.
+        - replace_stuck_workers: bool, whether to start another thread in place of one
+            whose TimedTask ran past its timeout, so the pool keeps its capacity.
+        - priority_aging: float, seconds of waiting that make up for one level of
+            TaskPriority, see _TaskQueue.
         """
         self.num_workers = num_workers
+        self.max_workers = max(max_workers, num_workers)
+        self.target_queue_wait = target_queue_wait
+        self.idle_timeout = idle_timeout
+        self.replace_stuck_workers = replace_stuck_workers
         self.alive = False
-        self._queue = Queue()
-        self._busy_workers = Queue()
-        self._threads = []
+        # Set while stop waits for the remaining tasks
+        self.draining = False
+        self.overload_policy = OverloadPolicy(overload_policy)
+        self._queue = _TaskQueue(maxsize=max_queue_size, aging=priority_aging)
+        self._workers: Dict[threading.Thread, _WorkerState] = {}
+        # Only held to start or stop threads, never to run or count tasks
+        self._workers_lock = threading.Lock()
+        self._retired_completed = 0
+        self._retired_failed = 0
+        # Replaced workers that are still stuck on a task
+        self._stuck: Dict[threading.Thread, _WorkerState] = {}
+        self._supervisor: Optional[threading.Thread] = None
+        self._dropped_tasks = 0
+        # Only written by the supervisor
+        self._timed_out_tasks = 0
+        # Number of queued or running scheduler and webhook server loops
+        self._service_tasks = 0
+        # Coroutines in submit_async that wait for room in the queue
+        self._room_lock = threading.Lock()
+        self._room_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def max_queue_size(self) -> int:
+        return self._queue.maxsize
+
+    @property
+    def elastic(self) -> bool:
+        return self.max_workers > self.num_workers
+
+    def add_task(
+        self,
+        function,
+        *args,
+        priority: TaskPriority = TaskPriority.INTERACTIVE,
+        block: bool = True,
+    ) -> TaskFuture:
+        """Adds a task to the queue, and returns the future of its result. Tasks run
+        in order of their priority, see TaskPriority.
+
+        If the task was dropped because the queue is full, the future is cancelled.
+        Cancelling the future takes the task off the queue, unless it started already.
+        With the BLOCK overload policy, a full queue makes this wait for room, or raise
+        queue.Full if block is False. Coroutines should use submit_async instead.
+        """
+        future = TaskFuture(function)
+        priority = TaskPriority(priority)
+        if self.overload_policy is OverloadPolicy.BLOCK:
+            self._queue.put(
+                (function, args, time.monotonic(), future, priority), block=block
+            )
+            return future
 
-    def add_task(self, function, *args):
-        self._queue.put((function, args))
+        while True:
+            try:
+                self._queue.put_nowait(
+                    (function, args, time.monotonic(), future, priority)
+                )
+                return future
+            except Full:
+                pass
+
+            # Never drop queued tasks once the pool is stopping, they may be stop
+            # signals.
+            if self.overload_policy is not OverloadPolicy.DROP_OLDEST or not self.alive:
+                self._dropped_tasks += 1
+                future.cancel()
+                return future
+
+            try:
+                dropped = self._queue.get_least_urgent(priority)
+            except Empty:
+                continue
+            self._dropped_tasks += 1
+            if dropped is None:
+                # Every queued task is more urgent than this one.
+                future.cancel()
+                return future
+            self._queue.task_done()
+            self._drop(*dropped)
+
+    @staticmethod
+    def _drop(function, args, queued_at, future: TaskFuture, priority):
+        future.cancel()
+        # Give tasks that track their own state a chance to clean up.
+        if hasattr(function, "dropped"):
+            function.dropped()
+
+    async def submit_async(self, submit: Callable[..., TaskFuture]) -> TaskFuture:
+        """Calls submit, e.g. a partial of add_task, from a coroutine without blocking
+        the event loop if the queue is full. submit is called with block=False, and
+        must raise queue.Full instead of waiting for room. It's retried each time a
+        worker takes a task off the queue, so only this coroutine waits.
+        """
+        try:
+            return submit(block=False)
+        except Full:
+            pass
+        loop = asyncio.get_running_loop()
+        while True:
+            # Register before trying again, so room that is made in between isn't
+            # missed.
+            waiter = loop.create_future()
+            entry = (loop, waiter)
+            with self._room_lock:
+                self._room_waiters.append(entry)
+            try:
+                try:
+                    return submit(block=False)
+                except Full:
+                    pass
+                await waiter
+            finally:
+                with self._room_lock:
+                    if entry in self._room_waiters:
+                        self._room_waiters.remove(entry)
+
+    def notify_room(self):
+        """Wakes up the coroutines in submit_async that wait for room, e.g. after a
+        task was taken off the queue."""
+        if not self._room_waiters:
+            return
+        with self._room_lock:
+            waiters, self._room_waiters = self._room_waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                # The event loop was closed in the meantime.
+                pass
 
     def get_busy_workers(self):
-        return self._busy_workers.qsize()
+        return sum(
+            state.busy_since is not None for state in list(self._workers.values())
+        )
+
+    def get_queued_tasks(self):
+        return self._queue.qsize()
+
+    def get_dropped_tasks(self):
+        return self._dropped_tasks
+
+    def get_completed_tasks(self):
+        states = list(self._workers.values()) + list(self._stuck.values())
+        return self._retired_completed + sum(state.completed for state in states)
+
+    def get_failed_tasks(self):
+        """Returns how many tasks raised an exception."""
+        states = list(self._workers.values()) + list(self._stuck.values())
+        return self._retired_failed + sum(state.failed for state in states)
+
+    def get_stuck_workers(self):
+        """Returns how many workers are running a TimedTask past its timeout, including
+        those that were replaced already."""
+        states = list(self._workers.values()) + list(self._stuck.values())
+        return sum(state.stuck for state in states)
+
+    def get_timed_out_tasks(self):
+        return self._timed_out_tasks
+
+    def get_num_workers(self):
+        """Returns how many worker threads are running right now."""
+        return len(self._workers)
+
+    def get_queue_wait(self) -> float:
+        """Returns how many seconds the next queued task has been waiting."""
+        task = self._queue.peek()
+        if task is None:
+            return 0.0
+        return time.monotonic() - task[2]
 
     def start(self):
         self.alive = True
         # Spawn num_workers threads that will wait for work to be added to the queue
-        for _ in range(self.num_workers):
-            worker = threading.Thread(target=self.handle_work)
-            self._threads.append(worker)
-            worker.start()
+        with self._workers_lock:
+            for _ in range(self.num_workers):
+                self._start_worker()
+        self._supervisor = threading.Thread(
+            target=self._supervise, name="mmpy-threadpool-supervisor", daemon=True
+        )
+        self._supervisor.start()
+
+    def stop(self, timeout: Optional[float] = None) -> Dict[str, int]:
+        """Lets the queued and running tasks and scheduled jobs finish, then stops all
+        threads. The scheduler stops starting new jobs right away.
+
+        After timeout seconds, tasks that are still queued are dropped, the tokens of
+        running TimedTasks are cancelled and the threads that are still busy are left
+        behind. Returns how many queued tasks, running tasks and scheduled jobs were
+        abandoned that way.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        log.info("Stopping threadpool, waiting for tasks...")
+        self.draining = True
+        default_scheduler.wakeup()
+        # Nothing works on the queue if the pool isn't running.
+        finished = not self.alive or self._wait_for_tasks(deadline)
+        jobs_finished = default_scheduler.join(_remaining(deadline))
+        abandoned = {
+            "queued_tasks": 0,
+            "running_tasks": 0,
+            "scheduled_jobs": default_scheduler.get_running_jobs(),
+        }
 
-    def stop(self):
-        """Signals all threads that they should stop and waits for them to finish."""
         self.alive = False
+        if not finished:
+            abandoned["queued_tasks"] = self._drop_queued_tasks()
+            abandoned["running_tasks"] = self._cancel_running_tasks()
+        with self._workers_lock:
+            threads = list(self._workers)
         # Signal every thread that it's time to stop
-        for _ in range(self.num_workers):
-            self._queue.put((self._stop_thread, tuple()))
+        for _ in threads:
+            self._queue.put(
+                (
+                    self._stop_thread,
+                    tuple(),
+                    time.monotonic(),
+                    TaskFuture(),
+                    TaskPriority.INTERACTIVE,
+                )
+            )
         # Wait for each of them to finish
-        log.info("Stopping threadpool, waiting for threads...")
-        for thread in self._threads:
-            thread.join()
+        for thread in threads:
+            thread.join(_remaining(deadline))
+        # Threads that stopped on their own leave their stop signal behind.
+        self._drop_queued_tasks()
+        if self._supervisor is not None:
+            self._supervisor.join()
+            self._supervisor = None
+        default_scheduler.shutdown(wait=jobs_finished)
+        self.draining = False
         log.info("Threadpool stopped.")
+        return abandoned
+
+    def _wait_for_tasks(self, deadline: Optional[float]) -> bool:
+        """Waits until only the scheduler and webhook server threads are busy, and no
+        tasks are queued. Returns False if that didn't happen before the deadline."""
+        with self._queue.all_tasks_done:
+            # all_tasks_done is only notified once no task is left at all.
+            while self._queue.unfinished_tasks > self._service_tasks:
+                remaining = _remaining(deadline)
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(min(remaining or 0.05, 0.05))
+        return True
+
+    def _drop_queued_tasks(self) -> int:
+        dropped = 0
+        while True:
+            try:
+                task = self._queue.get_nowait()
+            except Empty:
+                self.notify_room()
+                return dropped
+            self._queue.task_done()
+            dropped += 1
+            self._drop(*task)
+
+    def _cancel_running_tasks(self) -> int:
+        """Cancels the tokens of the running tasks, and returns how many there are
+        besides the scheduler and webhook server."""
+        states = list(self._workers.values()) + list(self._stuck.values())
+        for state in states:
+            timer = state.timer
+            if timer is not None:
+                timer[1].cancel()
+        busy = sum(state.busy_since is not None for state in states)
+        return max(busy - self._service_tasks, 0)
 
     def _stop_thread(self):
         """Used to stop individual threads."""
         return
 
+    def _start_worker(self):
+        # Must be called with the workers lock held
+        worker = threading.Thread(target=self.handle_work)
+        self._workers[worker] = _WorkerState()
+        worker.start()
+
+    def _grow(self):
+        """Adds a worker thread if tasks are waiting and the pool isn't at its
+        maximum."""
+        with self._workers_lock:
+            if not self.alive or len(self._workers) >= self.max_workers:
+                return
+            if self._queue.empty():
+                return
+            self._start_worker()
+            log.debug(f"Threadpool grew to {len(self._workers)} workers.")
+
+    def _retire(self, worker: threading.Thread, force: bool = False) -> bool:
+        """Removes an idle worker thread if the pool is larger than its minimum.
+        Returns whether the thread should stop."""
+        with self._workers_lock:
+            if not force and len(self._workers) <= self.num_workers:
+                return False
+            state = self._workers.pop(worker, None)
+            if state is not None:
+                self._retired_completed += state.completed
+                self._retired_failed += state.failed
+            if not force:
+                log.debug(f"Threadpool shrank to {len(self._workers)} workers.")
+            return True
+
+    def _supervise(self):
+        """Grows the pool while the next queued task waits too long, also if every
+        worker is stuck on a long task and none of them gets to notice. Also flags the
+        workers whose TimedTask ran past its timeout."""
+        while self.alive:
+            time.sleep(self.target_queue_wait)
+            if self.elastic and self.get_queue_wait() > self.target_queue_wait:
+                self._grow()
+            self._check_timeouts()
+
+    def _check_timeouts(self):
+        now = time.monotonic()
+        for worker, state in list(self._workers.items()):
+            timer = state.timer
+            if timer is None or timer[2] > now or state.flagged is timer:
+                continue
+            state.flagged = timer
+            task, token, _ = timer
+            token.cancel()
+            self._timed_out_tasks += 1
+            log_timeout(
+                task.name, task.timeout, "thread", worker=worker.name, **task.log_fields
+            )
+            if self.replace_stuck_workers:
+                self._replace(worker, state)
+
+    def _replace(self, worker: threading.Thread, state: _WorkerState):
+        """Starts a new worker in place of a stuck one, which stops once its task is
+        done."""
+        with self._workers_lock:
+            # The worker checks whether it was detached under the lock as well, once
+            # its task returned, so it either sees the flag or isn't stuck anymore.
+            if not self.alive or not state.stuck:
+                return
+            if self._workers.pop(worker, None) is None:
+                return
+            state.detached = True
+            self._stuck[worker] = state
+            self._start_worker()
+        log.info(f"Replaced stuck worker {worker.name}.")
+
     def handle_work(self):
+        worker = threading.current_thread()
+        state = self._workers.get(worker) or _WorkerState()
+        _worker.state = state
+        # Only threads above the minimum time out, but the size of the pool can change
+        # while we wait, so all of them check now and then.
+        timeout = self.idle_timeout if self.elastic else None
         while self.alive:
             # Wait for a new task (blocking)
-            function, arguments = self._queue.get()
-            # Notify the pool that we started working
-            self._busy_workers.put(1)
             try:
-                function(*arguments)
-            except Exception:
-                log.exception("Unhandled exception in main loop")
-            except BaseException:
+                function, arguments, queued_at, future, _ = self._queue.get(
+                    timeout=timeout
+                )
+            except Empty:
+                if self._retire(worker):
+                    return
+                continue
+            self.notify_room()
+            if time.monotonic() - queued_at > self.target_queue_wait and self.elastic:
+                self._grow()
+            if not future.set_running_or_notify_cancel():
+                # Cancelled while it was queued
+                self._queue.task_done()
+                if hasattr(function, "dropped"):
+                    function.dropped()
+                continue
+            # Let the pool know that we started working
+            state.busy_since = time.monotonic()
+            try:
+                future.set_result(function(*arguments))
+            except Exception as e:
+                state.failed += 1
+                future.set_exception(e)
+            except BaseException as e:
                 # Can be KeyboardInterrupt, SystemExit, ...
                 self.alive = False
-            # Notify the pool that we finished working
+                future.set_exception(e)
+            # Let the pool know that we finished working
+            if function != self._stop_thread:
+                state.completed += 1
+            state.busy_since = None
             self._queue.task_done()
-            self._busy_workers.get()
+            # Unless somebody waits for it, this logs the exception of the task.
+            del future
+            if state.flagged is not None and self._leave_if_detached(worker, state):
+                log.info(f"Replaced worker {worker.name} finished its task and stops.")
+                return
+        self._retire(worker, force=True)
+
+    def _leave_if_detached(self, worker: threading.Thread, state: _WorkerState) -> bool:
+        """Called by a worker whose task timed out, once it returned. Returns whether
+        the worker was replaced in the meantime, and should stop."""
+        # Taking the lock orders this with _replace, see there.
+        with self._workers_lock:
+            state.flagged = None
+            if not state.detached:
+                return False
+            self._stuck.pop(worker, None)
+            self._retired_completed += state.completed
+            self._retired_failed += state.failed
+            return True
+
+    def start_scheduler_thread(
+        self, trigger_period: float, max_workers: int = 4, max_processes: int = 2
+    ):
+        """Starts the scheduled jobs as soon as they are due. The scheduler sleeps until
+        the next job is due, but at most trigger_period seconds.
+
+        The jobs run on max_workers threads of their own, or max_processes processes if
+        they are tagged "subprocess", so they never hold up the scheduler.
+        """
+        default_scheduler.max_workers = max_workers
+        default_scheduler.max_processes = max_processes
 
-    def start_scheduler_thread(self, trigger_period: float):
         def run_pending():
             log.info("Scheduler thread started.")
-            while self.alive:
-                time.sleep(trigger_period)
-                try:
-                    default_scheduler.run_pending()
-                except Exception:
-                    log.exception("Unhandled exception in main loop")
-                except BaseException:
-                    # Can be KeyboardInterrupt, SystemExit, ...
-                    self.alive = False
+            try:
+                while self.alive and not self.draining:
+                    default_scheduler.wait_for_next_job(timeout=trigger_period)
+                    if not self.alive or self.draining:
+                        break
+                    try:
+                        default_scheduler.run_pending()
+                    except Exception:
+                        log.exception("Unhandled exception in main loop")
+                    except BaseException:
+                        # Can be KeyboardInterrupt, SystemExit, ...
+                        self.alive = False
+            finally:
+                self._end_service_task()
             log.info("Scheduler thread stopped.")
 
-        self.add_task(run_pending)
+        self._add_service_task(run_pending)
 
     def start_webhook_server_thread(self, webhook_server: WebHookServer):
         async def start_server():
             log.info("Webhook server thread started.")
-            await webhook_server.start()
-            while self.alive:
-                # We just use this to keep the loop running in a non-blocking way
-                await asyncio.sleep(1)
-            await webhook_server.stop()
+            try:
+                await webhook_server.start()
+                while self.alive:
+                    # We just use this to keep the loop running in a non-blocking way
+                    await asyncio.sleep(1)
+                await webhook_server.stop()
+            finally:
+                self._end_service_task()
             log.info("Webhook server thread stopped.")
 
-        self.add_task(asyncio.run, start_server())
+        self._add_service_task(asyncio.run, start_server())
+
+    def _add_service_task(self, function, *args):
+        """Adds a task that runs until the pool stops, which stop doesn't wait for."""
+        with self._workers_lock:
+            self._service_tasks += 1
+        self.add_task(function, *args)
+
+    def _end_service_task(self):
+        with self._workers_lock:
+            self._service_tasks -= 1
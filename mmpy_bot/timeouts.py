@@ -0,0 +1,73 @@
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+log = logging.getLogger("mmpy.timeouts")
+
+
+class ListenerCancelled(Exception):
+    """Raised by CancellationToken.raise_if_cancelled once a listener timed out."""
+
+
+class CancellationToken:
+    """Tells a synchronous listener that it ran past its timeout. Threads can't be
+    stopped from the outside, so long-running listeners should check the token of
+    their call (see current_token) now and then and give up once it is cancelled."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Sleeps for at most timeout seconds, but wakes up once the token is cancelled.
+        Returns whether it was cancelled."""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise ListenerCancelled()
+
+
+_local = threading.local()
+# Returned outside of listeners that have a timeout, and never cancelled
+_NEVER_CANCELLED = CancellationToken()
+
+
+def current_token() -> CancellationToken:
+    """Returns the CancellationToken of the listener running on this thread."""
+    return getattr(_local, "token", None) or _NEVER_CANCELLED
+
+
+@contextmanager
+def using_token(token: CancellationToken):
+    """Makes current_token return the given token on this thread, within the block."""
+    previous = getattr(_local, "token", None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def log_timeout(listener: str, timeout: float, executor: str, **fields):
+    """Logs that a listener timed out. The details are also passed as `extra` fields,
+    so structured log handlers can pick them up."""
+    details = " ".join(f"{key}={value}" for key, value in fields.items())
+    log.warning(
+        f"Listener {listener} timed out after {timeout}s on the {executor} executor."
+        + (f" {details}" if details else ""),
+        extra={
+            "event": "listener_timeout",
+            "listener": listener,
+            "timeout": timeout,
+            "executor": executor,
+            **fields,
+        },
+    )
@@ -1,4 +1,13 @@
 import asyncio
+import json
+import queue
+from collections import deque
+from typing import Deque, Iterable, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 
 def spaces(num: int):
@@ -16,3 +25,77 @@ def completed_future():
 def split_docstring(doc):
     """Split docstring into first line (header) and full body."""
     return (doc.split("\n", 1)[0], doc) if doc is not None else ("", "")
+
+
+def json_loads(data):
+    """Decodes a JSON string, using orjson if it is installed since it is considerably
+    faster than the standard library."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AsyncQueue(queue.Queue):
+    """Thread-safe queue.Queue that can also be awaited from an event loop.
+
+    Used to hand items over between threads that run different event loops: a put from
+    any thread wakes the coroutines waiting in get_async through
+    loop.call_soon_threadsafe, so there is no need to poll.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize)
+        # Futures of the coroutines waiting for an item, with their event loop
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    def _put(self, item):
+        # Called by put with self.mutex held.
+        super()._put(item)
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters:
+            loop, future = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # The loop of this waiter was closed in the meantime.
+                continue
+
+    def put_many(self, items: Iterable):
+        """Puts several items at once, taking the lock and waking the consumers only
+        once. Bounded queues still put the items one by one, so they can block."""
+        if self.maxsize > 0:
+            for item in items:
+                self.put(item)
+            return
+
+        with self.not_full:
+            count = 0
+            for item in items:
+                queue.Queue._put(self, item)
+                count += 1
+            if not count:
+                return
+            self._wake_waiters()
+            self.unfinished_tasks += count
+            self.not_empty.notify(count)
+
+    async def get_async(self):
+        """Removes and returns an item from the queue, waiting without blocking the
+        event loop if it is empty."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.mutex:
+                if self._qsize():
+                    item = self._get()
+                    self.not_full.notify()
+                    return item
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            await future
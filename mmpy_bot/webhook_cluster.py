@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import socket
+import threading
+import time
+from multiprocessing.connection import Connection, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+from mmpy_bot.utils import AsyncQueue
+from mmpy_bot.webhook_server import WebHookServer
+
+log = logging.getLogger("mmpy.webhook_cluster")
+
+# Sent over a pipe to tell the other side to stop
+_STOP = None
+# Sent to the server processes to turn away new requests while the bot shuts down
+_DRAIN = "drain"
+# Seconds between checks for requests whose response deadline passed
+_EXPIRE_INTERVAL = 1.0
+
+
+class _PipeQueue:
+    """Stands in for the event queue of a WebHookServer in a worker process, and sends
+    the events to the bot process instead."""
+
+    def __init__(self, connection: Connection):
+        self.connection = connection
+        self._lock = threading.Lock()
+
+    def put(self, event):
+        self.put_many([event])
+
+    def put_many(self, events):
+        with self._lock:
+            self.connection.send(("events", list(events)))
+
+
+def _run_worker(index: int, connection: Connection, options: Dict[str, Any]):
+    """Entry point of a webhook server process."""
+    logging.basicConfig(level=options["log_level"])
+    server = WebHookServer(
+        url=options["url"],
+        port=options["port"],
+        event_queue=_PipeQueue(connection),  # type: ignore
+        response_queue=AsyncQueue(),
+        **options["server_kwargs"],
+    )
+    server.reuse_port = options["sock"] is None and not server.socket_path
+    server.sock = options["sock"]
+    for path in options["routes"]:
+        server.add_route(path)
+    for matcher, timeout, status in options["deadlines"]:
+        server.set_response_deadline(matcher, timeout, status)
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+
+        def receive_responses():
+            # Responses routed back by the bot process, until it asks us to stop.
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    break
+                if message is _STOP:
+                    break
+                if message == _DRAIN:
+                    server.draining = True
+                    continue
+                server.response_queue.put(message)
+            loop.call_soon_threadsafe(stopped.set)
+
+        await server.start()
+        threading.Thread(target=receive_responses, daemon=True).start()
+        connection.send(("ready", os.getpid()))
+        log.info(f"Webhook server process {index} started.")
+        await stopped.wait()
+        await server.stop()
+        log.info(f"Webhook server process {index} stopped.")
+
+    asyncio.run(serve())
+
+
+class WebHookCluster:
+    """Runs the WebHookServer in several processes, so webhook requests are received
+    and parsed on other cores than the bot and don't compete with the listeners for
+    the GIL or a worker thread.
+
+    The processes listen on the same TCP port through SO_REUSEPORT, letting the kernel
+    balance the connections, or share a single listening (Unix domain) socket. They
+    send the events to the bot over a pipe each. The events end up in event_queue like
+    those of a single WebHookServer, and responses put on response_queue are routed
+    back to the process that received the request, by request id.
+
+    Arguments:
+    - url: str, address to listen on.
+    - port: int, TCP port to listen on.
+    - num_processes: int, number of server processes.
+    - socket_path: str, listen on this Unix domain socket instead of url and port.
+    - **server_kwargs: passed on to the WebHookServer of each process, e.g.
+        response_timeout.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        port: int,
+        num_processes: int = 2,
+        event_queue: Optional[AsyncQueue] = None,
+        response_queue: Optional[AsyncQueue] = None,
+        socket_path: Optional[str] = None,
+        **server_kwargs,
+    ):
+        if num_processes < 1:
+            raise ValueError("A WebHookCluster needs at least one process.")
+        self.url = url
+        self.port = port
+        self.num_processes = num_processes
+        self.socket_path = socket_path
+        self.server_kwargs = server_kwargs
+        self.running = False
+        self._draining = False
+
+        self.event_queue = event_queue or AsyncQueue()
+        self.response_queue = response_queue or AsyncQueue()
+
+        self._routes: List[str] = []
+        self._deadlines: List[Tuple[re.Pattern, Optional[float], Optional[int]]] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._connections: List[Connection] = []
+        self._send_locks: Dict[Connection, threading.Lock] = {}
+        self._threads: List[threading.Thread] = []
+        # The socket that all processes accept connections on, if they share one
+        self._socket: Optional[socket.socket] = None
+        # request id -> connection of the process that waits for the response, and
+        # the time.monotonic() after which it stops waiting (None means never)
+        self._owners: Dict[str, Tuple[Connection, Optional[float]]] = {}
+        self.received = 0
+        self.late_responses = 0
+
+    def add_route(self, path: str):
+        """See WebHookServer.add_route. Must be called before start."""
+        if "{webhook_id}" not in path:
+            raise ValueError(f"Webhook route {path!r} lacks a {{webhook_id}} variable.")
+        self._routes.append(path)
+
+    def set_response_deadline(
+        self,
+        matcher: re.Pattern,
+        timeout: Optional[float] = None,
+        status: Optional[int] = None,
+    ):
+        """See WebHookServer.set_response_deadline. Must be called before start."""
+        self._deadlines.append((matcher, timeout, status))
+
+    @property
+    def draining(self) -> bool:
+        return self._draining
+
+    @draining.setter
+    def draining(self, draining: bool):
+        """Like WebHookServer.draining, turns away new requests while the bot shuts
+        down. Can only be switched on."""
+        if draining and not self._draining:
+            self._draining = True
+            for connection in self._connections:
+                self._send(connection, _DRAIN)
+
+    def _response_timeout(self, webhook_id: str) -> float:
+        """See WebHookServer.get_response_deadline."""
+        default = self.server_kwargs.get("response_timeout", 30)
+        for matcher, timeout, _ in self._deadlines:
+            if matcher.search(webhook_id):
+                return default if timeout is None else timeout
+        return default
+
+    def get_metrics(self) -> Dict[str, int]:
+        """Returns the number of server processes that are alive, and the requests
+        forwarded through them."""
+        return {
+            "processes": sum(process.is_alive() for process in self._processes),
+            "in_flight": len(self._owners),
+            "received": self.received,
+            "late_responses": self.late_responses,
+        }
+
+    def _listen(self) -> Optional[socket.socket]:
+        """Opens the socket that the processes share, if they don't use
+        SO_REUSEPORT."""
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(self.socket_path)
+        elif hasattr(socket, "SO_REUSEPORT"):
+            if self.port == 0:
+                # Pick a free port that all processes can bind to.
+                with socket.socket() as probe:
+                    probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                    probe.bind((self.url.replace("http://", ""), 0))
+                    self.port = probe.getsockname()[1]
+            return None
+        else:
+            sock = socket.socket()
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.url.replace("http://", ""), self.port))
+            self.port = sock.getsockname()[1]
+        sock.listen(128)
+        return sock
+
+    def start(self, timeout: float = 30):
+        """Starts the server processes and waits until they all accept requests."""
+        self._socket = self._listen()
+        options = {
+            "url": self.url,
+            "port": self.port,
+            "sock": self._socket,
+            "server_kwargs": {"socket_path": self.socket_path, **self.server_kwargs},
+            "routes": self._routes,
+            "deadlines": self._deadlines,
+            "log_level": logging.getLogger().level,
+        }
+        # Don't fork the threads of the bot along with the process.
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.num_processes):
+            connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=_run_worker,
+                args=(index, child_connection, options),
+                name=f"mmpy-webhook-{index}",
+                daemon=True,
+            )
+            process.start()
+            child_connection.close()
+            self._processes.append(process)
+            self._connections.append(connection)
+            self._send_locks[connection] = threading.Lock()
+
+        for index, connection in enumerate(self._connections):
+            if not connection.poll(timeout):
+                self.stop()
+                raise RuntimeError(f"Webhook server process {index} didn't start.")
+            connection.recv()
+
+        self.running = True
+        self._threads = [
+            threading.Thread(target=self._forward_events, daemon=True),
+            threading.Thread(target=self._route_responses, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        log.info(f"Started {self.num_processes} webhook server processes.")
+
+    def stop(self, timeout: float = 5):
+        """Stops the server processes and waits for them to finish."""
+        self.running = False
+        for connection in self._connections:
+            self._send(connection, _STOP)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        # Wake up the response router.
+        self.response_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+        for connection in self._connections:
+            connection.close()
+        if self._socket is not None:
+            self._socket.close()
+            if self.socket_path and os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        self._processes, self._connections, self._threads = [], [], []
+        self._send_locks.clear()
+        self._owners.clear()
+        log.info("Webhook server processes stopped.")
+
+    def _send(self, connection: Connection, message):
+        try:
+            with self._send_locks[connection]:
+                connection.send(message)
+        except (OSError, ValueError):
+            # The process exited (or the pipe was closed) in the meantime.
+            log.debug("Couldn't reach webhook server process.")
+
+    def _forward_events(self):
+        """Passes the events received by the server processes on to the bot."""
+        connections = list(self._connections)
+        next_expiry = time.monotonic() + _EXPIRE_INTERVAL
+        while self.running and connections:
+            for connection in wait(connections, timeout=0.5):
+                try:
+                    _, events = connection.recv()
+                except (EOFError, OSError):
+                    connections.remove(connection)
+                    self._forget(lambda owner, expires: owner is connection)
+                    if self.running:
+                        log.error("A webhook server process exited unexpectedly.")
+                    continue
+                # Register the owner before the bot can respond to the events.
+                now = time.monotonic()
+                for event in events:
+                    timeout = self._response_timeout(event.webhook_id)
+                    expires = now + timeout if timeout else None
+                    self._owners[event.request_id] = (connection, expires)
+                self.received += len(events)
+                self.event_queue.put_many(events)
+
+            now = time.monotonic()
+            if now >= next_expiry:
+                # The server processes gave up on these requests already.
+                self._forget(
+                    lambda owner, expires: expires is not None and expires < now
+                )
+                next_expiry = now + _EXPIRE_INTERVAL
+
+    def _forget(self, condition):
+        """Removes the requests whose (connection, expiry time) match the condition.
+        Responses that arrive for them later are counted as late."""
+        for request_id, entry in list(self._owners.items()):
+            if condition(*entry) and self._owners.get(request_id) is entry:
+                self._owners.pop(request_id, None)
+
+    def _route_responses(self):
+        """Sends the responses of the bot to the process that waits for them."""
+        while True:
+            item = self.response_queue.get()
+            if item is _STOP:
+                break
+            request_id, _ = item
+            entry = self._owners.pop(request_id, None)
+            if entry is None:
+                self.late_responses += 1
+                log.debug(f"Discarding response for unknown request {request_id}")
+                continue
+            self._send(entry[0], item)
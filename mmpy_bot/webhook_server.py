@@ -1,13 +1,18 @@
 import asyncio
-import random
+import logging
+import re
+import socket
 import time
-from queue import Empty, Queue
-from typing import Optional
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from aiohttp import web
 
+from mmpy_bot.utils import AsyncQueue, json_loads
 from mmpy_bot.wrappers import ActionEvent, WebHookEvent
 
+log = logging.getLogger("mmpy.webhook_server")
+
 
 class NoResponse:
     """Used to notify the request handler that no web response should be sent."""
@@ -35,33 +40,127 @@ class WebHookServer:
         self,
         url: str,
         port: int,
-        event_queue: Optional[Queue] = None,
-        response_queue: Optional[Queue] = None,
+        event_queue: Optional[AsyncQueue] = None,
+        response_queue: Optional[AsyncQueue] = None,
+        response_timeout: float = 30,
+        timeout_status: int = 504,
+        batch_max_events: int = 1000,
+        socket_path: Optional[str] = None,
     ):
+        """Arguments:
+        - response_timeout: float, default number of seconds to wait for a listener to
+            respond to a webhook request, 0 means forever.
+        - timeout_status: int, HTTP status of the response sent once the deadline
+            passed, e.g. 504 (Gateway Timeout) or 200.
+        - batch_max_events: int, maximum number of events in a request to /hooks/batch.
+        - socket_path: str, listen on this Unix domain socket instead of url and port.
+        """
         self.app = web.Application()
         self.app_runner = web.AppRunner(self.app)
         self.url = url
         self.port = port
+        self.socket_path = socket_path
+        # Set by WebHookCluster to share the address with the other server processes
+        self.reuse_port = False
+        self.sock: Optional[socket.socket] = None
         self.running = False
+        # Set while the bot shuts down, requests are turned away in the meantime
+        self.draining = False
 
         # Create queues if necessary.
-        self.event_queue = event_queue or Queue()
-        self.response_queue = response_queue or Queue()
-        self.response_handlers = {}
+        self.event_queue = event_queue or AsyncQueue()
+        self.response_queue = response_queue or AsyncQueue()
+        self.response_handlers: Dict[str, asyncio.Future] = {}
+
+        # Response deadlines of specific webhooks: pattern -> (timeout, status)
+        self.response_timeout = response_timeout
+        self.timeout_status = timeout_status
+        self._deadlines: Dict[re.Pattern, Tuple[float, int]] = {}
+        self._deadline_cache: Dict[str, Tuple[float, int]] = {}
+        # Counters to monitor the requests that are waiting for a response
+        self.received = 0
+        self.timed_out = 0
+        self.late_responses = 0
+
+        # Request ids of events that were acknowledged without waiting for a response
+        self._detached: Set[str] = set()
+        self.batch_max_events = batch_max_events
+        self.batches = 0
 
-        # Register /hooks endpoint
-        self.app.add_routes([web.post("/hooks/{webhook_id}", self.process_webhook)])
+        # Register /hooks endpoints. The batch endpoint goes first, so it takes
+        # precedence over a webhook with the id "batch".
+        self.app.router.add_post("/hooks/batch", self.process_batch)
+        self.add_route("/hooks/{webhook_id}")
+
+    def add_route(self, path: str):
+        """Accepts webhook requests on another path, which may contain more variables
+        than the webhook id, e.g. `/teams/{team}/hooks/{webhook_id}`. Their values are
+        passed on to the listener as event.route_params."""
+        if "{webhook_id}" not in path:
+            raise ValueError(f"Webhook route {path!r} lacks a {{webhook_id}} variable.")
+        self.app.router.add_post(path, self.process_webhook)
 
     async def start(self):
         webhook_host_ip = self.url.replace("http://", "")
         await self.app_runner.setup()
-        site = web.TCPSite(self.app_runner, webhook_host_ip, self.port)
+        if self.sock is not None:
+            site = web.SockSite(self.app_runner, self.sock)
+        elif self.socket_path:
+            site = web.UnixSite(self.app_runner, self.socket_path)
+        else:
+            site = web.TCPSite(
+                self.app_runner,
+                webhook_host_ip,
+                self.port,
+                reuse_port=self.reuse_port or None,
+            )
         await site.start()
         self.running = True
 
         # Schedule the response awaiting function to the same loop as the web server
         asyncio.get_event_loop().create_task(self._obtain_responses_loop())
 
+    def set_response_deadline(
+        self,
+        matcher: re.Pattern,
+        timeout: Optional[float] = None,
+        status: Optional[int] = None,
+    ):
+        """Overrides the response timeout and/or timeout status for the webhooks whose
+        id matches the given pattern."""
+        self._deadlines[matcher] = (
+            self.response_timeout if timeout is None else timeout,
+            self.timeout_status if status is None else status,
+        )
+        self._deadline_cache.clear()
+
+    def get_response_deadline(self, webhook_id: str) -> Tuple[float, int]:
+        """Returns the response timeout and timeout status of the given webhook."""
+        deadline = self._deadline_cache.get(webhook_id)
+        if deadline is None:
+            deadline = next(
+                (
+                    deadline
+                    for matcher, deadline in self._deadlines.items()
+                    if matcher.search(webhook_id)
+                ),
+                (self.response_timeout, self.timeout_status),
+            )
+            if len(self._deadline_cache) < 1000:
+                self._deadline_cache[webhook_id] = deadline
+        return deadline
+
+    def get_metrics(self) -> Dict[str, int]:
+        """Returns the number of webhook requests waiting for a response, and counters
+        of received, timed out and late responded requests."""
+        return {
+            "in_flight": len(self.response_handlers),
+            "received": self.received,
+            "batches": self.batches,
+            "timed_out": self.timed_out,
+            "late_responses": self.late_responses,
+        }
+
     async def stop(self):
         await self.app_runner.cleanup()
         self.running = False
@@ -70,45 +169,202 @@ class WebHookServer:
         """Checks the response queue for incoming responses and passes them on to the
         functions awaiting them."""
         while True:
-            try:
-                request_id, response = self.response_queue.get_nowait()
-                print(f"Received response {response} for request {request_id}")
-                try:
-                    if not self.response_handlers[request_id].cancelled():
-                        self.response_handlers[request_id].set_result(response)
-                    del self.response_handlers[request_id]
-                except KeyError:
-                    # If this handler already received a response, we can skip this.
-                    pass
-            except Empty:
-                await asyncio.sleep(0.5)
+            request_id, response = await self.response_queue.get_async()
+            log.debug(f"Received response {response} for request {request_id}")
+            handler = self.response_handlers.pop(request_id, None)
+            if handler is None and request_id in self._detached:
+                # The batch of this event was acknowledged without waiting for it.
+                self._detached.discard(request_id)
+            elif handler is None:
+                # The request already received a response, or timed out meanwhile.
+                self.late_responses += 1
+                log.debug(f"Discarding late response for request {request_id}")
+            elif not handler.done():
+                handler.set_result(response)
 
-    @handle_json_error
-    async def process_webhook(self, request: web.Request):
-        data = await request.json()
-        webhook_id = request.match_info.get("webhook_id", "")
+    def _create_event(
+        self, data: Dict, webhook_id: str, route_params: Dict[str, str]
+    ) -> WebHookEvent:
         if "trigger_id" in data:
             # Use the trigger ID to identify this request
-            event = ActionEvent(
-                data, request_id=data["trigger_id"], webhook_id=webhook_id
-            )
-        else:
-            # Generate an ID based on the current time and a random number.
-            event = WebHookEvent(
+            return ActionEvent(
                 data,
-                request_id=f"{time.time()}_{random.randint(0, 10000)}",
+                request_id=data["trigger_id"],
                 webhook_id=webhook_id,
+                route_params=route_params,
             )
-        self.event_queue.put(event)
+        # Generate an ID based on the current time and a random part, which has to be
+        # unique across the processes of a WebHookCluster as well.
+        return WebHookEvent(
+            data,
+            request_id=f"{time.time()}_{uuid.uuid4().hex}",
+            webhook_id=webhook_id,
+            route_params=route_params,
+        )
 
-        # Register a Future object that will signal us when a response has arrived,
-        # and wait for it to complete.
-        await_response = asyncio.get_event_loop().create_future()
+    def _register(self, event: WebHookEvent) -> asyncio.Future:
+        """Registers a Future object that will signal us when a response to the event
+        has arrived."""
+        self.received += 1
+        await_response = asyncio.get_running_loop().create_future()
         self.response_handlers[event.request_id] = await_response
-        await await_response
+        return await_response
+
+    async def _await_response(
+        self, event: WebHookEvent, await_response: asyncio.Future
+    ) -> Tuple[int, Any]:
+        """Waits until the event was responded to or its deadline passed, and returns
+        the HTTP status and the response (or NoResponse)."""
+        timeout, timeout_status = self.get_response_deadline(event.webhook_id)
+        try:
+            return 200, await asyncio.wait_for(await_response, timeout or None)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            log.warning(
+                f"No response to webhook {event.webhook_id} within {timeout} seconds, "
+                f"responding with status {timeout_status}."
+            )
+            return timeout_status, NoResponse
+        finally:
+            # Also cleans up if the client disconnected in the meantime.
+            if self.response_handlers.get(event.request_id) is await_response:
+                del self.response_handlers[event.request_id]
 
-        result = await_response.result()
+    def _detach(self, events: List[WebHookEvent]):
+        """Remembers the events whose responses are discarded, until their deadline
+        passed like it would if we waited for them."""
+        self._detached.update(event.request_id for event in events)
+        expiring = [
+            (timeout, event.request_id)
+            for event in events
+            if (timeout := self.get_response_deadline(event.webhook_id)[0])
+        ]
+        if expiring:
+            asyncio.get_running_loop().call_later(
+                max(timeout for timeout, _ in expiring),
+                self._detached.difference_update,
+                [request_id for _, request_id in expiring],
+            )
+
+    def _unavailable(self) -> web.Response:
+        return web.json_response(
+            {"status": "failed", "reason": "The bot is shutting down."}, status=503
+        )
+
+    @handle_json_error
+    async def process_webhook(self, request: web.Request):
+        if self.draining:
+            return self._unavailable()
+        data = await request.json()
+        route_params = dict(request.match_info)
+        webhook_id = route_params.pop("webhook_id", "")
+        event = self._create_event(data, webhook_id, route_params)
+
+        # Register the future before the event is handed over, so a quick response
+        # can't arrive before there is anyone waiting for it.
+        await_response = self._register(event)
+        self.event_queue.put(event)
+
+        status, result = await self._await_response(event, await_response)
         if result is NoResponse:
-            return web.Response(status=200)
+            return web.Response(status=status)
 
         return web.json_response(result)
+
+    async def _read_batch(self, request: web.Request) -> List:
+        """Reads the events of a batch request, either a JSON list (or an object with
+        an "events" list), or newline-delimited JSON."""
+        if request.content_type in ("application/x-ndjson", "application/jsonl"):
+            items = []
+            async for line in request.content:
+                if line.strip():
+                    items.append(json_loads(line))
+                if len(items) > self.batch_max_events:
+                    break
+        else:
+            items = json_loads(await request.read())
+            if isinstance(items, dict):
+                items = items.get("events")
+        if not isinstance(items, list):
+            raise ValueError("Expected a list of events.")
+        return items
+
+    @handle_json_error
+    async def process_batch(self, request: web.Request):
+        """Accepts many webhook events in one request. Each event is an object like
+        `{"webhook_id": "ping", "data": {...}}`.
+
+        By default, the response lists a result per event, in the same order:
+        `{"status": 200, "response": ...}`, or only the status if no response was
+        sent. With `?ack=1`, the events are acknowledged with status 202 as soon as they
+        are queued, and the responses of the listeners are discarded.
+        """
+        if self.draining:
+            return self._unavailable()
+        items = await self._read_batch(request)
+        if len(items) > self.batch_max_events:
+            return web.json_response(
+                {
+                    "status": "failed",
+                    "reason": f"A batch holds at most {self.batch_max_events} events.",
+                },
+                status=413,
+            )
+        acknowledge = request.query.get("ack", "").lower() in ("1", "true", "yes")
+        route_params = dict(request.match_info)
+
+        events: List[WebHookEvent] = []
+        results: List[Optional[Dict]] = []
+        request_ids: Set[str] = set()
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(
+                item.get("webhook_id"), str
+            ):
+                results.append({"status": 400, "reason": "Missing webhook_id."})
+                continue
+            data = item.get("data", {})
+            if not isinstance(data, dict):
+                results.append({"status": 400, "reason": "Expected data object."})
+                continue
+            event = self._create_event(data, item["webhook_id"], route_params)
+            if event.request_id in request_ids:
+                # Its response would be routed to the earlier event with this id.
+                results.append({"status": 400, "reason": "Duplicate trigger_id."})
+                continue
+            request_ids.add(event.request_id)
+            events.append(event)
+            results.append(None)
+        self.batches += 1
+
+        if acknowledge:
+            self.received += len(events)
+            self._detach(events)
+            self.event_queue.put_many(events)
+            return web.json_response(
+                {
+                    "status": "accepted",
+                    "accepted": len(events),
+                    "rejected": len(results) - len(events),
+                },
+                status=202,
+            )
+
+        futures = [self._register(event) for event in events]
+        self.event_queue.put_many(events)
+        responses = iter(
+            await asyncio.gather(
+                *(
+                    self._await_response(event, await_response)
+                    for event, await_response in zip(events, futures)
+                )
+            )
+        )
+        for i, result in enumerate(results):
+            if result is None:
+                status, response = next(responses)
+                results[i] = (
+                    {"status": status}
+                    if response is NoResponse
+                    else {"status": status, "response": response}
+                )
+        return web.json_response({"results": results})
@@ -1,75 +1,147 @@
-from functools import cached_property
-from typing import Dict
+from typing import Dict, Optional, Union
+
+from mmpy_bot.utils import json_loads
+
+
+def _decode(value):
+    """Mattermost sends some nested values as JSON strings, decode those."""
+    return json_loads(value) if isinstance(value, (str, bytes)) else value
 
 
 class EventWrapper:
     """Wrapper around the body of a mattermost network event, e.g. new posts or webhook
-    requests. Contains cached properties for convenient variable access.
+    requests. Contains properties for convenient variable access.
+
+    Subclasses store the commonly used fields in __slots__, so that events waiting in
+    queues take up as little memory as possible. Other attributes can still be set,
+    the instance dict is only created when that happens.
 
     Arguments:
     - body: dictionary, body of the network request that contains this event.
+    - raw_body: str, optional JSON encoded body. If given, the decoded body is not kept
+        in memory but decoded again when `body` is first accessed.
     """
 
+    __slots__ = ("_body", "_raw_body", "__dict__")
+
     def __init__(
         self,
-        body: Dict,
+        body: Optional[Dict] = None,
+        raw_body: Optional[Union[str, bytes]] = None,
     ):
-        self.body = body
+        if body is None and raw_body is None:
+            raise ValueError("Either body or raw_body should be specified.")
+        self._body = body if raw_body is None else None
+        self._raw_body = raw_body
 
+    @property
+    def body(self) -> Dict:
+        if self._body is None:
+            self._body = self._decode_body()
+        return self._body
 
-class Message(EventWrapper):
-    @cached_property
-    def id(self):
-        return self.body["data"]["post"]["id"]
+    @body.setter
+    def body(self, body: Dict):
+        self._body = body
+        self._raw_body = None
 
-    @cached_property
-    def user_id(self):
-        return self.body["data"]["post"]["user_id"]
+    def _decode_body(self) -> Dict:
+        return json_loads(self._raw_body)
 
-    @cached_property
-    def text(self):
-        return self.body["data"]["post"]["message"].strip()
 
-    @cached_property
-    def channel_id(self):
-        return self.body["data"]["post"]["channel_id"]
+class Message(EventWrapper):
+    """Wrapper around a `posted` websocket event.
 
-    @cached_property
-    def channel_name(self):
-        return self.body["data"]["channel_name"]
+    The commonly used fields are extracted once when the message is created. The
+    mentions, which Mattermost sends as a nested JSON string, are only decoded when
+    first accessed.
+    """
 
-    @cached_property
-    def file_ids(self):
-        return self.body["data"]["post"].get("file_ids", [])
+    __slots__ = (
+        "id",
+        "user_id",
+        "channel_id",
+        "root_id",
+        "parent_id",
+        "file_ids",
+        "team_id",
+        "channel_type",
+        "channel_name",
+        "sender_name",
+        "text",
+        "_message",
+        "_mentions",
+    )
 
-    @cached_property
+    def __init__(
+        self,
+        body: Optional[Dict] = None,
+        raw_body: Optional[Union[str, bytes]] = None,
+    ):
+        super().__init__(body, raw_body)
+        self._extract(self._decode_body() if body is None else body)
+
+    def _extract(self, body: Dict):
+        data = body["data"]
+        post = data["post"] = _decode(data["post"])
+
+        self.id = post.get("id")
+        self.user_id = post.get("user_id")
+        self.channel_id = post.get("channel_id")
+        self.root_id = post.get("root_id", "")
+        self.parent_id = post.get("parent_id", "").strip()
+        self.file_ids = post.get("file_ids", [])
+        self.team_id = data.get("team_id", "").strip()
+        self._message = post.get("message", "")
+        self.text = self._message.strip()
+        self.channel_type = data.get("channel_type")
+        self.channel_name = data.get("channel_name")
+        self.sender_name = data.get("sender_name", "").strip().strip("@")
+        self._mentions = data.get("mentions") or []
+
+    @EventWrapper.body.setter
+    def body(self, body: Dict):
+        EventWrapper.body.fset(self, body)
+        # Keep the extracted fields in line with the new body.
+        self._extract(body)
+
+    def _decode_body(self) -> Dict:
+        body = super()._decode_body()
+        data = body["data"]
+        data["post"] = _decode(data["post"])
+        if hasattr(self, "_message"):
+            # The message text may have been modified before it was wrapped, e.g. to
+            # strip off a mention of the bot.
+            data["post"]["message"] = self._message
+            data["mentions"] = self.mentions
+        return body
+
+    def __reduce__(self):
+        # Send only the body, or the still encoded body if we have it, to other
+        # processes. The text may differ from the encoded one, see _decode_body.
+        # Attributes that were set on top of the slots are sent along as well.
+        extra = getattr(self, "__dict__", None) or None
+        if self._raw_body is None:
+            return (self.__class__, (self._body,), extra)
+        text = {"_message": self._message, "text": self.text}
+        return (self.__class__, (None, self._raw_body), (extra, text))
+
+    @property
     def is_direct_message(self):
-        return self.body["data"]["channel_type"] == "D"
+        return self.channel_type == "D"
 
-    @cached_property
+    @property
     def mentions(self):
-        return self.body["data"].get("mentions", [])
-
-    @cached_property
-    def parent_id(self):
-        return self.body["data"]["post"].get("parent_id", "").strip()
+        if isinstance(self._mentions, (str, bytes)):
+            self._mentions = json_loads(self._mentions)
+            if self._body is not None:
+                self._body["data"]["mentions"] = self._mentions
+        return self._mentions
 
-    @cached_property
+    @property
     def reply_id(self):
         return self.root_id or self.id
 
-    @cached_property
-    def root_id(self):
-        return self.body["data"]["post"]["root_id"]
-
-    @cached_property
-    def sender_name(self):
-        return self.body["data"].get("sender_name", "").strip().strip("@")
-
-    @cached_property
-    def team_id(self):
-        return self.body["data"].get("team_id", "").strip()
-
 
 class WebHookEvent(EventWrapper):
     """Wrapper around an incoming webhook post request.
@@ -77,34 +149,40 @@ class WebHookEvent(EventWrapper):
     Arguments:
     - request_id: str, unique identifier of this web request
     - webhook_id: str, the webhook id that was triggered.
+    - route_params: dict, the other variables of the webhook path, e.g. the team of
+        `/teams/{team}/hooks/{webhook_id}`.
     """
 
+    __slots__ = ("request_id", "webhook_id", "route_params", "responded")
+
     def __init__(
         self,
         *args,
         request_id: str,
         webhook_id: str,
+        route_params: Optional[Dict[str, str]] = None,
         **kwargs,
     ):
         super().__init__(*args, **kwargs)
         self.request_id = request_id
         self.webhook_id = webhook_id
+        self.route_params = route_params or {}
         # Whether a web response was already sent to this request or not.
         self.responded = False
 
-    @cached_property
+    @property
     def text(self):
         return self.body.get("text")
 
-    @cached_property
+    @property
     def channel_name(self):
         return self.body.get("channel", self.body.get("channel_name"))
 
-    @cached_property
+    @property
     def props(self):
         return self.body.get("props", {})
 
-    @cached_property
+    @property
     def type(self):
         return self.body.get("type")
 
@@ -113,34 +191,36 @@ class ActionEvent(WebHookEvent):
     """Wrapper around an incoming webhook event that was triggered by an action, e.g.
     pressing a button or submitting a form."""
 
-    @cached_property
+    __slots__ = ()
+
+    @property
     def channel_id(self):
         return self.body.get("channel_id")
 
-    @cached_property
+    @property
     def context(self):
         return self.body.get("context")
 
-    @cached_property
+    @property
     def data_source(self):
         return self.body.get("data_source")
 
-    @cached_property
+    @property
     def post_id(self):
         return self.body.get("post_id")
 
-    @cached_property
+    @property
     def team_id(self):
         return self.body.get("team_id")
 
-    @cached_property
+    @property
     def trigger_id(self):
         return self.body.get("trigger_id")
 
-    @cached_property
+    @property
     def user_id(self):
         return self.body.get("user_id")
 
-    @cached_property
+    @property
     def user_name(self):
         return self.body.get("user_name")
@@ -28,7 +28,10 @@ setup(
     platforms=["Any"],
     packages=find_packages(exclude=excludes),
     install_requires=requires("requirements.txt"),
-    extras_require={"dev": requires("dev-requirements.txt")},
+    extras_require={
+        "dev": requires("dev-requirements.txt"),
+        "orjson": ["orjson>=3.8"],
+    },
     package_data={"mmpy_bot": ["mmpy_bot/version.txt"]},
     include_package_data=True,
     entry_points={
@@ -0,0 +1,82 @@
+"""Compares message dispatch time of a linear scan over every listener pattern with
+the ListenerIndex prefilter, for increasing numbers of listeners."""
+
+import random
+import re
+import string
+import timeit
+
+from mmpy_bot.listener_index import ListenerIndex
+
+LISTENER_COUNTS = [10, 50, 100, 200, 400, 800]
+NUM_MESSAGES = 2000
+
+
+def random_word(rng: random.Random, length: int = 8):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def make_listeners(rng: random.Random, count: int):
+    listeners = {}
+    while len(listeners) < count:
+        word = random_word(rng)
+        kind = rng.random()
+        if kind < 0.6:
+            pattern = rf"^{word}(?: |$)(.*)?"
+        elif kind < 0.8:
+            pattern = rf"{word} ([0-9]+)"
+        elif kind < 0.95:
+            pattern = rf"^{word}$"
+        else:
+            pattern = rf"(?i)\b{word}\b"
+        listeners[re.compile(pattern)] = [pattern]
+    return listeners
+
+
+def make_messages(rng: random.Random, listeners):
+    commands = [p.pattern.strip("^").split("(")[0] for p in listeners]
+    messages = []
+    for _ in range(NUM_MESSAGES):
+        words = [random_word(rng, rng.randint(2, 9)) for _ in range(rng.randint(3, 30))]
+        # Roughly one in ten messages is a bot command.
+        if rng.random() < 0.1:
+            words.insert(0, rng.choice(commands))
+        messages.append(" ".join(words))
+    return messages
+
+
+def linear(listeners, messages):
+    for text in messages:
+        for matcher, functions in listeners.items():
+            if matcher.search(text):
+                pass
+
+
+def indexed(index, messages):
+    for text in messages:
+        for match, functions in index.search(text):
+            pass
+
+
+def main():
+    rng = random.Random(0)
+    print(f"{'listeners':>10} {'linear (us/msg)':>16} {'indexed (us/msg)':>17}")
+    for count in LISTENER_COUNTS:
+        listeners = make_listeners(rng, count)
+        messages = make_messages(rng, listeners)
+        index = ListenerIndex(listeners)
+
+        linear_time = min(
+            timeit.repeat(lambda: linear(listeners, messages), number=1, repeat=3)
+        )
+        indexed_time = min(
+            timeit.repeat(lambda: indexed(index, messages), number=1, repeat=3)
+        )
+        print(
+            f"{count:>10} {linear_time / NUM_MESSAGES * 1e6:>16.1f}"
+            f" {indexed_time / NUM_MESSAGES * 1e6:>17.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Measures the memory used by 100k queued messages, comparing messages that keep their
+decoded body with messages that only keep the raw websocket event."""
+
+import gc
+import json
+import queue
+import time
+import tracemalloc
+
+from mmpy_bot.wrappers import Message
+
+NUM_MESSAGES = 100_000
+
+
+def raw_event(index: int) -> str:
+    post = {
+        "id": f"post{index:022d}",
+        "create_at": 1533085458236 + index,
+        "update_at": 1533085458236 + index,
+        "edit_at": 0,
+        "delete_at": 0,
+        "is_pinned": False,
+        "user_id": "131gkd5thbdxiq141b3514bgjh",
+        "channel_id": "4fgt3n51f7ftpff91gk1iy1zow",
+        "root_id": "",
+        "parent_id": "",
+        "original_id": "",
+        "message": f"deploy service-{index % 50} to staging please",
+        "type": "",
+        "props": {},
+        "hashtags": "",
+        "pending_post_id": "",
+    }
+    return json.dumps(
+        {
+            "event": "posted",
+            "data": {
+                "channel_display_name": "Off-Topic",
+                "channel_name": "off-topic",
+                "channel_type": "O",
+                "mentions": json.dumps(["qmw86q7qsjriura9jos75i4why"]),
+                "post": json.dumps(post),
+                "sender_name": "@betty",
+                "team_id": "au64gza3iint3r31e7ewbrrasw",
+            },
+            "broadcast": {
+                "omit_users": None,
+                "user_id": "",
+                "channel_id": "4fgt3n51f7ftpff91gk1iy1zow",
+                "team_id": "",
+            },
+            "seq": index,
+        }
+    )
+
+
+def measure(events, keep_raw: bool):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    messages: queue.Queue = queue.Queue()
+    for raw in events:
+        body = json.loads(raw)
+        messages.put(Message(body, raw_body=raw if keep_raw else None))
+    elapsed = time.perf_counter() - start
+    # The raw events are allocated before tracing started, so they aren't counted.
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, peak, elapsed
+
+
+def main():
+    events = [raw_event(index) for index in range(NUM_MESSAGES)]
+    raw_size = sum(len(raw) for raw in events)
+    print(f"{NUM_MESSAGES} queued messages, {raw_size / 2**20:.1f} MiB of raw events")
+    print(f"{'kept state':>12} {'retained MiB':>13} {'peak MiB':>9} {'build s':>8}")
+    for label, keep_raw in (("decoded body", False), ("raw event", True)):
+        current, peak, elapsed = measure(events, keep_raw)
+        print(
+            f"{label:>12} {current / 2**20:>13.1f} {peak / 2**20:>9.1f} "
+            f"{elapsed:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
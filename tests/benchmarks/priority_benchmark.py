@@ -0,0 +1,60 @@
+"""Measures how long interactive tasks wait for a worker thread while a flood of
+background tasks is queued, with every task queued in order of arrival (as if they all
+had the same priority) versus with TaskPriority.BACKGROUND for the flood."""
+
+import statistics
+import threading
+import time
+
+from mmpy_bot.threadpool import TaskPriority, ThreadPool
+
+WORKERS = 4
+FLOOD_TASKS = 2000
+TASK_DURATION = 0.005
+INTERACTIVE_TASKS = 200
+INTERACTIVE_PERIOD = 0.01
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(flood_priority: TaskPriority):
+    pool = ThreadPool(num_workers=WORKERS)
+    pool.start()
+    waits = []
+    lock = threading.Lock()
+
+    def interactive(queued_at: float):
+        with lock:
+            waits.append(time.perf_counter() - queued_at)
+
+    for _ in range(FLOOD_TASKS):
+        pool.add_task(time.sleep, TASK_DURATION, priority=flood_priority)
+    for _ in range(INTERACTIVE_TASKS):
+        pool.add_task(interactive, time.perf_counter())
+        time.sleep(INTERACTIVE_PERIOD)
+    pool.stop()
+    return waits
+
+
+def main():
+    print(
+        f"{FLOOD_TASKS} background tasks of {TASK_DURATION * 1000:.0f} ms on"
+        f" {WORKERS} workers, {INTERACTIVE_TASKS} interactive tasks"
+    )
+    print(f"{'flood priority':>15} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for label, priority in (
+        ("interactive", TaskPriority.INTERACTIVE),
+        ("background", TaskPriority.BACKGROUND),
+    ):
+        waits = run(priority)
+        print(
+            f"{label:>15} {statistics.median(waits) * 1000:>8.1f}"
+            f" {percentile(waits, 0.99) * 1000:>8.1f} {max(waits) * 1000:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compares the schedule library's Scheduler, which scans every job on each call of
+run_pending, with the heap-based Scheduler of mmpy_bot at 100k one-time jobs: the time
+to register them, the cost of a run_pending call while a few jobs are due, and how
+late jobs run when the scheduler thread polls every second versus waits for the next
+due job."""
+
+import random
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+
+import schedule
+
+from mmpy_bot.scheduler import OneTimeJob, Scheduler
+
+NUM_JOBS = 100_000
+TICKS = 20
+POLL_PERIOD = 1.0
+LATENESS_JOBS = 20
+
+
+def once(scheduler: schedule.Scheduler, trigger_time: datetime, function, *args):
+    job = OneTimeJob(0, scheduler)
+    job.set_next_run(trigger_time)
+    return job.do(function, *args)
+
+
+def fill(scheduler: schedule.Scheduler) -> float:
+    now = datetime.now()
+    start = time.perf_counter()
+    for _ in range(NUM_JOBS):
+        once(scheduler, now + timedelta(seconds=random.uniform(60, 86400)), print)
+    return time.perf_counter() - start
+
+
+def tick_cost(scheduler: schedule.Scheduler) -> float:
+    """Average duration of run_pending with a single job due per call."""
+    durations = []
+    for _ in range(TICKS):
+        once(scheduler, datetime.now(), lambda: None)
+        start = time.perf_counter()
+        scheduler.run_pending()
+        durations.append(time.perf_counter() - start)
+    return statistics.mean(durations)
+
+
+def lateness(scheduler: schedule.Scheduler, wait) -> float:
+    """Median delay between the time jobs should run and the time they did."""
+    delays = []
+    stop = threading.Event()
+
+    def loop():
+        while not stop.is_set():
+            wait()
+            scheduler.run_pending()
+
+    thread = threading.Thread(target=loop)
+    thread.start()
+    for _ in range(LATENESS_JOBS):
+        due = datetime.now() + timedelta(seconds=random.uniform(0.05, 0.5))
+        once(scheduler, due, lambda due=due: delays.append(datetime.now() - due))
+        time.sleep(0.25)
+    time.sleep(POLL_PERIOD + 0.5)
+    stop.set()
+    if isinstance(scheduler, Scheduler):
+        scheduler.wakeup()
+    thread.join()
+    return statistics.median(delay.total_seconds() for delay in delays)
+
+
+def main():
+    print(f"{NUM_JOBS} pending one-time jobs")
+    print(f"{'scheduler':>10} {'fill s':>8} {'run_pending ms':>15} {'late ms':>9}")
+    for label, scheduler in (
+        ("scan", schedule.Scheduler()),
+        ("heap", Scheduler()),
+    ):
+        fill_time = fill(scheduler)
+        cost = tick_cost(scheduler)
+        if isinstance(scheduler, Scheduler):
+            wait = lambda: scheduler.wait_for_next_job(POLL_PERIOD)  # noqa: E731
+        else:
+            wait = lambda: time.sleep(POLL_PERIOD)  # noqa: E731
+        late = lateness(scheduler, wait)
+        print(f"{label:>10} {fill_time:>8.2f} {cost * 1000:>15.3f} {late * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
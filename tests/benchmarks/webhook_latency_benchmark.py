@@ -0,0 +1,108 @@
+"""Measures the round trip latency of webhook requests through the WebHookServer and a
+responder on another event loop, like the bot's EventHandler. Compares the previous
+handoff, which polled the queues every 0.5 seconds, with the event-driven AsyncQueue
+handoff."""
+
+import asyncio
+import queue
+import statistics
+import threading
+import time
+
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+
+from mmpy_bot.webhook_server import WebHookServer
+
+POLLING_REQUESTS = 20
+HANDOFF_REQUESTS = 500
+POLL_INTERVAL = 0.5
+
+
+class PollingWebHookServer(WebHookServer):
+    """The response loop as it was before the event-driven handoff."""
+
+    async def _obtain_responses_loop(self):
+        while True:
+            try:
+                request_id, response = self.response_queue.get_nowait()
+                if not self.response_handlers[request_id].cancelled():
+                    self.response_handlers[request_id].set_result(response)
+                del self.response_handlers[request_id]
+            except queue.Empty:
+                await asyncio.sleep(POLL_INTERVAL)
+
+
+async def polling_responder(server: WebHookServer):
+    while True:
+        try:
+            event = server.event_queue.get_nowait()
+            server.response_queue.put((event.request_id, {"text": "pong"}))
+        except queue.Empty:
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+async def handoff_responder(server: WebHookServer):
+    while True:
+        event = await server.event_queue.get_async()
+        server.response_queue.put((event.request_id, {"text": "pong"}))
+
+
+def run_server(server: WebHookServer, started: threading.Event, state: dict):
+    async def serve():
+        test_server = TestServer(server.app, host="127.0.0.1")
+        await test_server.start_server()
+        state["url"] = str(test_server.make_url("/hooks/ping"))
+        state["loop"] = asyncio.get_running_loop()
+        state["stopped"] = asyncio.Event()
+        responses = asyncio.create_task(server._obtain_responses_loop())
+        started.set()
+        await state["stopped"].wait()
+        responses.cancel()
+        await test_server.close()
+
+    asyncio.run(serve())
+
+
+async def measure(server: WebHookServer, responder, num_requests: int):
+    started, state = threading.Event(), {}
+    thread = threading.Thread(target=run_server, args=(server, started, state))
+    thread.start()
+    started.wait()
+
+    responder_task = asyncio.create_task(responder(server))
+    latencies = []
+    async with ClientSession() as session:
+        for _ in range(num_requests):
+            start = time.perf_counter()
+            async with session.post(state["url"], json={"text": "ping"}) as response:
+                await response.json()
+            latencies.append(time.perf_counter() - start)
+
+    responder_task.cancel()
+    state["loop"].call_soon_threadsafe(state["stopped"].set)
+    thread.join()
+    return latencies
+
+
+def report(label: str, latencies):
+    latencies = sorted(latency * 1000 for latency in latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{label:>10} {len(latencies):>9} {statistics.median(latencies):>11.2f} "
+        f"{statistics.mean(latencies):>9.2f} {p99:>8.2f}"
+    )
+
+
+def main():
+    print(
+        f"{'handoff':>10} {'requests':>9} {'median ms':>11} {'mean ms':>9} {'p99 ms':>8}"
+    )
+    server = PollingWebHookServer(url="http://127.0.0.1", port=0)
+    report("polling", asyncio.run(measure(server, polling_responder, POLLING_REQUESTS)))
+    server = WebHookServer(url="http://127.0.0.1", port=0)
+    report("event", asyncio.run(measure(server, handoff_responder, HANDOFF_REQUESTS)))
+
+
+if __name__ == "__main__":
+    main()
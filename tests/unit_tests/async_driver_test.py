@@ -0,0 +1,145 @@
+import asyncio
+import json
+import threading
+from unittest import mock
+
+import httpx
+
+from mmpy_bot.driver import Driver
+
+from .event_handler_test import create_message
+
+
+def mock_transport(requests):
+    def handler(request: httpx.Request):
+        requests.append(request)
+        if request.url.path == "/api/v4/channels/direct":
+            return httpx.Response(201, json={"id": "direct_channel_id"})
+        return httpx.Response(201, json={"id": "post_id"})
+
+    return httpx.MockTransport(handler)
+
+
+def create_driver():
+    driver = Driver({"url": "chat.example.com", "port": 443, "token": "token"})
+    driver.client.token = "token"
+    driver.user_id = "bot_id"
+    return driver
+
+
+class TestAsyncDriver:
+    def test_areply_to(self):
+        driver = create_driver()
+        requests = []
+
+        async def scenario():
+            api = driver.async_driver.api
+            api.client.client = httpx.AsyncClient(transport=mock_transport(requests))
+            message = create_message(text="hello")
+            result = await driver.areply_to(message, "hi!")
+            assert result == {"id": "post_id"}
+            # The pooled client is reused for subsequent requests
+            assert driver.async_driver.api is api
+            await driver.areply_to(message, "hi in private!", direct=True)
+            await driver.async_driver.close()
+
+        asyncio.run(scenario())
+
+        reply, direct_channel, direct_message = requests
+        assert reply.url.path == "/api/v4/posts"
+        assert reply.headers["Authorization"] == "Bearer token"
+        assert json.loads(reply.content) == {
+            "channel_id": "4fgt3n51f7ftpff91gk1iy1zow",
+            "message": "hi!",
+            "file_ids": [],
+            "root_id": "wqpuawcw3iym3pq63s5xi1776r",
+            "props": {},
+        }
+        assert json.loads(direct_channel.content) == [
+            "bot_id",
+            "131gkd5thbdxiq141b3514bgjh",
+        ]
+        assert json.loads(direct_message.content)["channel_id"] == "direct_channel_id"
+
+    def test_new_client_per_loop(self):
+        driver = create_driver()
+
+        async def get_api():
+            return driver.async_driver.api
+
+        first = asyncio.run(get_api())
+        with mock.patch.object(first.client, "close") as close:
+            assert asyncio.run(get_api()) is not first
+        # The client of the old loop is closed
+        close.assert_called_once()
+
+    def test_shutdown(self):
+        driver = create_driver()
+        loop = asyncio.new_event_loop()
+
+        async def get_api():
+            return driver.async_driver.api
+
+        api = loop.run_until_complete(get_api())
+        with mock.patch.object(api.client, "close") as close:
+            # Closes the client on its own loop
+            driver.async_driver.shutdown()
+        close.assert_called_once()
+        assert driver.async_driver._api is None
+        loop.close()
+
+
+class TestBlockingCalls:
+    def test_warn_on_event_loop(self, caplog):
+        driver = create_driver()
+
+        async def scenario():
+            with mock.patch.object(driver.reactions, "save_reaction") as save:
+                driver.react_to(create_message(), "+1")
+                driver.react_to(create_message(), "+1")
+                assert save.call_count == 2
+
+        asyncio.run(scenario())
+        warnings = [r for r in caplog.records if "Driver.react_to" in r.message]
+        assert len(warnings) == 1
+        assert "await driver.areact_to" in warnings[0].message
+
+    def test_no_warning_off_event_loop(self, caplog):
+        driver = create_driver()
+        with mock.patch.object(driver.reactions, "save_reaction"):
+            driver.react_to(create_message(), "+1")
+        assert not caplog.records
+
+    def test_offload(self):
+        driver = create_driver()
+        driver.offload_blocking_calls = True
+
+        async def scenario():
+            with mock.patch.object(
+                driver.reactions,
+                "save_reaction",
+                side_effect=lambda options: threading.get_ident(),
+            ):
+                future = driver.react_to(create_message(), "+1")
+                assert isinstance(future, asyncio.Future)
+                return await future
+
+        # The request ran on a worker thread rather than on the event loop
+        assert asyncio.run(scenario()) != threading.get_ident()
+
+    def test_offload_logs_errors(self, caplog):
+        driver = create_driver()
+        driver.offload_blocking_calls = True
+
+        async def scenario():
+            with mock.patch.object(
+                driver.reactions, "save_reaction", side_effect=ValueError("failed")
+            ):
+                # Nobody awaits the future, the error is logged instead.
+                future = driver.react_to(create_message(), "+1")
+                await asyncio.wait([future])
+
+        asyncio.run(scenario())
+        (record,) = [r for r in caplog.records if r.levelname == "ERROR"]
+        assert record.message == "Offloaded call Driver.react_to failed"
+        assert record.exc_info[0] is ValueError
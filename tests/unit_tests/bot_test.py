@@ -3,7 +3,8 @@ from unittest import mock
 
 import pytest
 
-from mmpy_bot import Bot, ExamplePlugin, Settings
+from mmpy_bot import Bot, ExamplePlugin, Settings, schedule
+from mmpy_bot.job_store import SQLiteJobStore
 from mmpy_bot.plugins import PluginManager
 
 from ..integration_tests.utils import TestPlugin
@@ -47,7 +48,10 @@ class TestBot:
 
     @mock.patch.multiple("mmpy_bot.Plugin", on_start=mock.DEFAULT, on_stop=mock.DEFAULT)
     def test_run(self, bot, **mocks):
-        with mock.patch.object(bot.driver, "init_websocket") as init_websocket:
+        async_driver = bot.driver.async_driver
+        with mock.patch.object(
+            bot.driver, "init_websocket"
+        ) as init_websocket, mock.patch.object(async_driver, "shutdown") as shutdown:
             bot.run()
             init_websocket.assert_called_once()
 
@@ -55,6 +59,30 @@ class TestBot:
                 plugin.on_start.assert_called_once()
 
             bot.stop()
+            # The pooled connections of the async driver are closed
+            shutdown.assert_called_once()
 
             for plugin in bot.plugin_manager.plugins:
                 plugin.on_stop.assert_called_once()
+
+    @mock.patch("mmpy_bot.driver.Driver.login")
+    def test_stop_keeps_persisted_jobs(self, login, tmp_path):
+        class ClearingPlugin(ExamplePlugin):
+            def on_stop(self):
+                schedule.clear()
+
+        path = tmp_path / "jobs.sqlite"
+        bot = Bot(
+            plugins=[ClearingPlugin()], settings=Settings(JOB_STORE_FILE=str(path))
+        )
+        try:
+            schedule.every(10).minutes.do(print, "hello").persist("hello")
+            with mock.patch.object(bot.driver, "init_websocket"):
+                bot.run()
+            bot.stop()
+        finally:
+            schedule.clear()
+
+        store = SQLiteJobStore(path)
+        assert [job.id for job in store.load()] == ["hello"]
+        store.close()
@@ -0,0 +1,99 @@
+import json
+from unittest import mock
+
+from mmpy_bot.cache import LRUCache, MetadataCache
+
+
+class TestLRUCache:
+    def test_eviction(self):
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        # Accessing a makes b the least recently used entry
+        assert cache.get("a") == 1
+        cache.set("c", 3)
+        assert "b" not in cache
+        assert cache.get("a") == 1 and cache.get("c") == 3
+        assert len(cache) == 2
+
+    @mock.patch("mmpy_bot.cache.time.time")
+    def test_ttl(self, time):
+        time.return_value = 1000
+        cache = LRUCache(ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=0)
+
+        time.return_value = 1009
+        assert cache.get("a") == 1
+        time.return_value = 1010
+        assert cache.get("a") is None
+        assert "a" not in cache
+        # An entry with ttl 0 never expires
+        assert cache.get("b") == 2
+
+    def test_stats(self):
+        cache = LRUCache()
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+    def test_save_and_load(self, tmp_path):
+        path = tmp_path / "cache.json"
+        cache = LRUCache(ttl=100)
+        cache.update({"a": 1, "b": "two"})
+        cache.save(path)
+
+        loaded = LRUCache()
+        loaded.load(path)
+        assert loaded.get("a") == 1 and loaded.get("b") == "two"
+
+        # Files saved for another owner are ignored
+        cache.save(path, owner="bot_a")
+        for owner, expected in [("bot_a", 1), ("bot_b", None), (None, None)]:
+            loaded = LRUCache()
+            loaded.load(path, owner=owner)
+            assert loaded.get("a") == expected
+
+        # Missing or corrupt files are ignored
+        LRUCache().load(tmp_path / "missing.json")
+        path.write_text("not json")
+        LRUCache().load(path)
+
+
+class TestMetadataCache:
+    def test_handle_event(self):
+        cache = MetadataCache()
+        cache.users.set("user_id", {"id": "user_id"})
+        cache.add_channel({"id": "channel_id", "team_id": "team_id", "name": "town"})
+        cache.team_members.set(("team_id", "user_id"), {"roles": "team_user"})
+
+        cache.handle_event({"event": "user_updated", "data": {"user": {"id": "other"}}})
+        assert "user_id" in cache.users
+        cache.handle_event(
+            {"event": "user_updated", "data": {"user": {"id": "user_id"}}}
+        )
+        assert "user_id" not in cache.users
+
+        # Channels are nested JSON strings
+        channel = {"id": "channel_id", "team_id": "team_id", "name": "renamed"}
+        cache.handle_event(
+            {"event": "channel_updated", "data": {"channel": json.dumps(channel)}}
+        )
+        assert "channel_id" not in cache.channels
+        assert ("team_id", "town") not in cache.channel_ids
+
+        cache.handle_event(
+            {
+                "event": "memberrole_updated",
+                "data": {
+                    "member": json.dumps({"team_id": "team_id", "user_id": "user_id"})
+                },
+            }
+        )
+        assert ("team_id", "user_id") not in cache.team_members
+
+    def test_stats(self):
+        cache = MetadataCache()
+        cache.users.get("user_id")
+        assert cache.stats()["users"] == {"size": 0, "hits": 0, "misses": 1}
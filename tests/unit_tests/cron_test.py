@@ -0,0 +1,122 @@
+from datetime import date, datetime
+
+import pytest
+
+from mmpy_bot import schedule
+from mmpy_bot.cron import CronExpression, CronSchedule
+from mmpy_bot.job_store import MisfirePolicy, SQLiteJobStore
+from mmpy_bot.scheduler import CronJob, Scheduler
+
+# A Sunday
+SUNDAY = datetime(2026, 10, 18, 12, 0)
+
+
+def fire_times(schedule: CronSchedule, start: datetime, count: int):
+    times = []
+    for _ in range(count):
+        start = schedule.next_after(start)
+        times.append(start)
+    return times
+
+
+class TestCronExpression:
+    @pytest.mark.parametrize(
+        "expression, expected",
+        [
+            ("* * * * *", datetime(2026, 10, 18, 12, 1)),
+            ("*/15 * * * *", datetime(2026, 10, 18, 12, 15)),
+            ("0 9 * * mon-fri", datetime(2026, 10, 19, 9, 0)),
+            ("30 8-18/4 * * *", datetime(2026, 10, 18, 12, 30)),
+            ("0 0 1 jan *", datetime(2027, 1, 1, 0, 0)),
+            ("0 0 29 2 *", datetime(2028, 2, 29, 0, 0)),
+            ("0 0 * * 7", datetime(2026, 10, 25, 0, 0)),
+            # Either the day of month or the day of week has to match.
+            ("0 0 31 * mon", datetime(2026, 10, 19, 0, 0)),
+            ("@daily", datetime(2026, 10, 19, 0, 0)),
+            ("@hourly", datetime(2026, 10, 18, 13, 0)),
+        ],
+    )
+    def test_next_after(self, expression, expected):
+        assert CronExpression(expression).next_after(SUNDAY) == expected
+
+    def test_end_of_year(self):
+        expression = CronExpression("59 23 31 12 *")
+        assert expression.next_after(datetime(2026, 12, 31, 23, 58, 30)) == datetime(
+            2026, 12, 31, 23, 59
+        )
+        assert expression.next_after(datetime(2026, 12, 31, 23, 59)) == datetime(
+            2027, 12, 31, 23, 59
+        )
+
+    @pytest.mark.parametrize(
+        "expression",
+        ["* * * *", "60 * * * *", "* * * foo *", "5-1 * * * *", "*/0 * * * *"],
+    )
+    def test_invalid(self, expression):
+        with pytest.raises(ValueError):
+            CronExpression(expression)
+
+    def test_never_matches(self):
+        with pytest.raises(ValueError):
+            CronExpression("0 0 30 2 *")
+
+
+class TestCronSchedule:
+    def test_several_expressions_and_exclude(self):
+        cron = CronSchedule(
+            ["0 9 * * mon-fri", "30 17 * * mon-fri"], exclude=[date(2026, 10, 20)]
+        )
+        assert fire_times(cron, SUNDAY, 4) == [
+            datetime(2026, 10, 19, 9, 0),
+            datetime(2026, 10, 19, 17, 30),
+            datetime(2026, 10, 21, 9, 0),
+            datetime(2026, 10, 21, 17, 30),
+        ]
+
+    def test_count_between(self):
+        cron = CronSchedule(["*/10 * * * *"])
+        assert cron.count_between(SUNDAY, datetime(2026, 10, 18, 13, 0)) == 7
+        assert cron.count_between(SUNDAY, datetime(2026, 10, 19), limit=5) == 5
+
+
+class TestCronJob:
+    def test_schedule_cron(self):
+        job = schedule.cron("0 9 * * mon-fri").do(print, "standup")
+        try:
+            assert isinstance(job, CronJob)
+            assert job in schedule.jobs
+            assert job.next_run.hour == 9 and job.next_run.weekday() < 5
+            assert repr(job).startswith("Cron '0 9 * * mon-fri' do print('standup')")
+        finally:
+            schedule.cancel_job(job)
+
+    def test_runs_and_reschedules(self):
+        scheduler = Scheduler()
+        calls = []
+        job = scheduler.cron("* * * * *").do(calls.append, 1)
+        job.next_run = datetime.now()
+        scheduler.reschedule(job)
+        scheduler.run_pending()
+        assert scheduler.join(timeout=5)
+
+        assert calls == [1]
+        assert job.next_run > datetime.now()
+        assert job.next_run.second == 0
+
+    def test_persist(self, tmp_path):
+        store = SQLiteJobStore(tmp_path / "jobs.sqlite")
+        scheduler = Scheduler()
+        scheduler.load_jobs(store)
+        scheduler.cron("*/5 * * * *").do(print).persist("cron")
+        missed = datetime(2026, 10, 18, 12, 0).timestamp()
+        store.update_runs([("cron", missed, None)])
+
+        scheduler = Scheduler()
+        scheduler.load_jobs(store, misfire_policy=MisfirePolicy.SKIP)
+        (job,) = scheduler.jobs
+        assert isinstance(job, CronJob)
+        assert job.next_run > datetime.now() and job.next_run.minute % 5 == 0
+
+        job.next_run = datetime(2026, 10, 18, 12, 0)
+        assert job.missed_runs(datetime(2026, 10, 18, 12, 12)) == 3
+        store.close()
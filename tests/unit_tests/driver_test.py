@@ -0,0 +1,107 @@
+from unittest import mock
+
+from mmpy_bot.driver import Driver
+
+from .event_handler_test import create_message
+
+
+def create_driver(**kwargs):
+    driver = Driver({"url": "chat.example.com", "port": 443}, **kwargs)
+    driver.user_id = "bot_id"
+    return driver
+
+
+class TestDirectChannels:
+    def test_cached_direct_channel(self):
+        driver = create_driver()
+        with mock.patch.object(
+            driver.channels, "create_direct_channel", return_value={"id": "dm_id"}
+        ) as create_direct_channel, mock.patch.object(
+            driver.posts, "create_post"
+        ) as create_post:
+            message = create_message()
+            driver.reply_to(message, "psst", direct=True)
+            driver.reply_to(message, "psst again", direct=True)
+
+            create_direct_channel.assert_called_once_with(
+                ["bot_id", "131gkd5thbdxiq141b3514bgjh"]
+            )
+            assert create_post.call_count == 2
+            assert create_post.call_args[0][0]["channel_id"] == "dm_id"
+
+    def test_prewarm(self):
+        driver = create_driver()
+        channels = [
+            {"id": "dm_a", "type": "D", "name": "bot_id__user_a"},
+            {"id": "dm_b", "type": "D", "name": "user_b__bot_id"},
+            {"id": "town-square", "type": "O", "name": "town-square"},
+        ]
+        with mock.patch.object(
+            driver.channels, "get_channels_for_user", return_value=channels
+        ), mock.patch.object(
+            driver.channels, "create_direct_channel", return_value={"id": "dm_c"}
+        ) as create_direct_channel:
+            driver.prewarm_direct_channels(["user_a", "user_c"])
+
+            # Only the channel that didn't exist yet is created
+            create_direct_channel.assert_called_once_with(["bot_id", "user_c"])
+
+        assert driver.get_direct_channel_id("user_a") == "dm_a"
+        assert driver.get_direct_channel_id("user_b") == "dm_b"
+        assert driver.get_direct_channel_id("user_c") == "dm_c"
+        assert len(driver.dm_channels) == 3
+
+    def test_persisted(self, tmp_path):
+        cache_file = tmp_path / "dm_channels.json"
+        driver = create_driver(dm_channel_cache_file=cache_file)
+        driver.dm_channels.set("user_a", "dm_a")
+        driver.save_caches()
+
+        loaded = create_driver(dm_channel_cache_file=cache_file)
+        loaded.load_caches()
+        assert loaded.dm_channels.get("user_a") == "dm_a"
+
+        # The channels of another bot account are not reused
+        other = create_driver(dm_channel_cache_file=cache_file)
+        other.user_id = "other_bot_id"
+        other.load_caches()
+        assert "user_a" not in other.dm_channels
+
+
+class TestMetadata:
+    def test_get_user_info(self):
+        driver = create_driver()
+        with mock.patch.object(
+            driver.users, "get_user", return_value={"id": "user_id"}
+        ) as get_user:
+            assert driver.get_user_info("user_id") == {"id": "user_id"}
+            assert driver.get_user_info("user_id") == {"id": "user_id"}
+            get_user.assert_called_once_with("user_id")
+
+            # An update over the websocket invalidates the cached user
+            driver.metadata.handle_event(
+                {"event": "user_updated", "data": {"user": {"id": "user_id"}}}
+            )
+            driver.get_user_info("user_id")
+            assert get_user.call_count == 2
+
+        assert driver.metadata.stats()["users"]["hits"] == 1
+
+    def test_get_channel_by_name(self):
+        driver = create_driver()
+        channel = {"id": "channel_id", "team_id": "team_id", "name": "town"}
+        with mock.patch.object(
+            driver.channels, "get_channel_by_name", return_value=channel
+        ) as get_channel_by_name, mock.patch.object(
+            driver.channels, "get_channel"
+        ) as get_channel:
+            assert driver.get_channel_by_name("team_id", "town") == channel
+            assert driver.get_channel_by_name("team_id", "town") == channel
+            assert driver.get_channel("channel_id") == channel
+            get_channel_by_name.assert_called_once()
+            get_channel.assert_not_called()
+
+            # If the channel was renamed, the old name is looked up again
+            driver.metadata.channels.set("channel_id", {**channel, "name": "city"})
+            driver.get_channel_by_name("team_id", "town")
+            assert get_channel_by_name.call_count == 2
@@ -1,8 +1,16 @@
 import asyncio
 import json
+import threading
 from unittest import mock
 
-from mmpy_bot import ExamplePlugin, Message, Settings, WebHookExample
+from mmpy_bot import (
+    ExamplePlugin,
+    Message,
+    Plugin,
+    Settings,
+    WebHookExample,
+    listen_to,
+)
 from mmpy_bot.driver import Driver
 from mmpy_bot.event_handler import EventHandler
 from mmpy_bot.plugins import PluginManager
@@ -97,13 +105,15 @@ class TestEventHandler:
     def test_handle_event(self, handle_post):
         handler = EventHandler(Driver(), Settings(), plugin_manager=PluginManager([]))
         # This event should trigger _handle_post
-        asyncio.run(handler._handle_event(json.dumps(create_message().body)))
+        raw = json.dumps(create_message().body)
+        asyncio.run(handler._handle_event(raw))
         # This event should not
         asyncio.run(handler._handle_event(json.dumps({"event": "some_other_event"})))
 
-        handle_post.assert_called_once_with(create_message().body)
+        handle_post.assert_called_once_with(create_message().body, raw=raw)
 
     @mock.patch("mmpy_bot.driver.Driver.username", new="my_username")
+    @mock.patch("mmpy_bot.driver.Driver.user_id", new=BOT_ID)
     def test_handle_post(self):
         # Create an initialized plugin so its listeners are registered
         plugin = ExamplePlugin()
@@ -166,3 +176,150 @@ class TestEventHandler:
             )
             # Assert the function was called, so we know the asserts succeeded.
             mocked.assert_called_once()
+
+    @mock.patch("mmpy_bot.driver.Driver.username", new="my_username")
+    @mock.patch("mmpy_bot.driver.Driver.user_id", new=BOT_ID)
+    def test_handle_post_overloaded(self):
+        plugin = ExamplePlugin()
+        driver = Driver()
+        plugin_manager = PluginManager([plugin])
+        settings = Settings(
+            MAX_CONCURRENT_LISTENERS=1,
+            MAX_PENDING_LISTENERS=0,
+            OVERLOAD_POLICY="busy",
+        )
+        plugin_manager.initialize(driver, settings)
+        handler = EventHandler(driver, settings, plugin_manager)
+
+        release = asyncio.Event()
+
+        async def mock_call_function(function, message, groups):
+            await release.wait()
+
+        def raw_post(text):
+            body = create_message(text=text).body.copy()
+            body["data"]["post"] = json.dumps(body["data"]["post"])
+            body["data"]["mentions"] = json.dumps(body["data"]["mentions"])
+            return body
+
+        async def scenario():
+            await handler._handle_post(raw_post("sleep 5"))
+            # The first listener occupies the only slot, so this one is rejected
+            await handler._handle_post(raw_post("sleep 6"))
+            await asyncio.sleep(0.01)
+            assert handler.get_load_metrics()["listeners"]["dropped"] == 1
+            release.set()
+            await asyncio.sleep(0.01)
+            assert handler.get_load_metrics()["listeners"]["running"] == 0
+
+        with mock.patch.object(plugin, "call_function", wraps=mock_call_function):
+            with mock.patch.object(driver, "areply_to") as reply_to:
+                asyncio.run(scenario())
+                reply_to.assert_awaited_once_with(
+                    mock.ANY, settings.OVERLOAD_BUSY_MESSAGE
+                )
+
+    @mock.patch("mmpy_bot.driver.Driver.username", new="my_username")
+    @mock.patch("mmpy_bot.driver.Driver.user_id", new=BOT_ID)
+    def test_handle_post_lane_overloaded(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        class OrderedPlugin(Plugin):
+            @listen_to("^wait", ordered_by="channel")
+            def wait(self, message):
+                started.set()
+                release.wait(5)
+
+        plugin = OrderedPlugin()
+        driver = Driver(threadpool_queue_size=1, overload_policy="busy")
+        plugin_manager = PluginManager([plugin])
+        settings = Settings(OVERLOAD_POLICY="busy", THREADPOOL_QUEUE_SIZE=1)
+        plugin_manager.initialize(driver, settings)
+        handler = EventHandler(driver, settings, plugin_manager)
+
+        async def scenario():
+            await handler._handle_post(create_message(text="wait").body)
+            while not started.is_set():
+                await asyncio.sleep(0.01)
+            # The first call is running, so the lane of the channel holds one more and
+            # rejects the rest.
+            for _ in range(3):
+                await handler._handle_post(create_message(text="wait").body)
+            await asyncio.sleep(0.05)
+            assert handler.get_load_metrics()["lanes"]["dropped"] == 2
+            release.set()
+            assert await handler.drain(timeout=5) == 0
+
+        driver.threadpool.start()
+        try:
+            with mock.patch.object(driver, "areply_to") as reply_to:
+                asyncio.run(scenario())
+        finally:
+            driver.threadpool.stop()
+        assert (
+            reply_to.call_args_list
+            == [mock.call(mock.ANY, settings.OVERLOAD_BUSY_MESSAGE)] * 2
+        )
+
+    def test_handle_event_invalidates_metadata(self):
+        driver = Driver()
+        handler = EventHandler(driver, Settings(), plugin_manager=PluginManager([]))
+        driver.metadata.users.set("user_id", {"id": "user_id"})
+        event = {"event": "user_updated", "data": {"user": {"id": "user_id"}}}
+        asyncio.run(handler._handle_event(json.dumps(event)))
+        assert "user_id" not in driver.metadata.users
+
+    @mock.patch("mmpy_bot.event_handler.EventHandler._handle_post")
+    def test_handle_event_skips_decoding(self, handle_post):
+        handler = EventHandler(Driver(), Settings(), plugin_manager=PluginManager([]))
+        with mock.patch(
+            "mmpy_bot.event_handler.json_loads", wraps=json.loads
+        ) as json_loads:
+            # Events we don't handle are discarded without decoding them
+            asyncio.run(
+                handler._handle_event(json.dumps({"event": "typing", "data": {}}))
+            )
+            json_loads.assert_not_called()
+
+            # If the event type isn't the first key, we have to decode everything
+            raw = json.dumps({"seq": 3, "event": "posted"})
+            asyncio.run(handler._handle_event(raw))
+            json_loads.assert_called_once()
+            handle_post.assert_called_once_with({"seq": 3, "event": "posted"}, raw=raw)
+
+    @mock.patch("mmpy_bot.driver.Driver.username", new="my_username")
+    @mock.patch("mmpy_bot.driver.Driver.user_id", new=BOT_ID)
+    def test_drain(self):
+        plugin = ExamplePlugin()
+        driver = Driver()
+        plugin_manager = PluginManager([plugin])
+        plugin_manager.initialize(driver, Settings())
+        handler = EventHandler(driver, Settings(), plugin_manager)
+        finished = []
+
+        async def mock_call_function(function, message, groups):
+            # "sleep 1" finishes in time, "sleep 100" has to be cancelled
+            await asyncio.sleep(0.05 if groups == ["1"] else 100)
+            finished.append(groups)
+
+        def raw_post(text):
+            body = create_message(text=text).body.copy()
+            body["data"]["post"] = json.dumps(body["data"]["post"])
+            return body
+
+        loop = asyncio.new_event_loop()
+        with mock.patch.object(plugin, "call_function", wraps=mock_call_function):
+            loop.run_until_complete(handler._handle_post(raw_post("sleep 1")))
+            loop.run_until_complete(handler._handle_post(raw_post("sleep 100")))
+            # The loop isn't running, so stop runs it until the listeners are done.
+            assert handler.stop(timeout=0.5) == 1
+            assert finished == [["1"]]
+            assert not handler._tasks
+
+            # New events are ignored from now on.
+            with mock.patch.object(handler, "_handle_post") as handle_post:
+                raw = json.dumps(raw_post("sleep 1"))
+                loop.run_until_complete(handler._handle_event(raw))
+                handle_post.assert_not_called()
+        loop.close()
@@ -274,6 +274,23 @@ class TestMessageFunction:
         wrapped.assert_not_called()
         driver.reply_to.assert_not_called()
 
+    def test_ordered_by(self):
+        with pytest.raises(ValueError, match="ordered_by"):
+            listen_to("", ordered_by="team")(example_listener)
+
+        message = create_message()
+        assert listen_to("")(example_listener).lane_key(message) is None
+        assert listen_to("", ordered_by="channel")(example_listener).lane_key(
+            message
+        ) == ("channel", message.channel_id)
+        assert listen_to("", ordered_by="thread")(example_listener).lane_key(
+            message
+        ) == ("thread", message.reply_id)
+        assert listen_to("", ordered_by="user")(example_listener).lane_key(message) == (
+            "user",
+            message.user_id,
+        )
+
 
 def example_webhook_listener(self, event):
     # Used to copy the arg specs to mock.Mock functions.
@@ -292,6 +309,13 @@ class TestWebHookFunction:
         # Verify that the regexp is correct
         assert wrapped_function.matcher == re.compile(pattern)
         assert wrapped_function.function == example_webhook_listener
+        assert wrapped_function.response_timeout is None
+
+        wrapped_function = listen_webhook(
+            pattern, response_timeout=5, timeout_status=200
+        )(example_webhook_listener)
+        assert wrapped_function.response_timeout == 5
+        assert wrapped_function.timeout_status == 200
 
     def test_arguments(self):
         # This function misses the `event` argument
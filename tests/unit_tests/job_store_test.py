@@ -0,0 +1,171 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from mmpy_bot.job_store import MisfirePolicy, SQLiteJobStore, StoredJob
+from mmpy_bot.scheduler import Scheduler
+
+calls = []
+
+
+def record(*args, **kwargs):
+    calls.append((args, kwargs))
+
+
+class Counter:
+    def __init__(self):
+        self.count = 0
+
+    def increment(self, amount: int = 1):
+        self.count += amount
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteJobStore(tmp_path / "jobs.sqlite")
+    yield store
+    store.close()
+
+
+@pytest.fixture(autouse=True)
+def clear_calls():
+    calls.clear()
+
+
+def restart(store: SQLiteJobStore, **kwargs) -> Scheduler:
+    """Returns a new scheduler with the jobs of the store, as after a restart."""
+    scheduler = Scheduler()
+    scheduler.load_jobs(store, **kwargs)
+    return scheduler
+
+
+def run(scheduler: Scheduler):
+    scheduler.run_pending()
+    assert scheduler.join(timeout=5)
+
+
+class TestSQLiteJobStore:
+    def test_round_trip(self, store):
+        job = StoredJob("a", "module:Job", "module:function", b"args", b"spec", 1.5)
+        store.add(job)
+        store.add(StoredJob("b", "module:Job", "module:function", b"", b"", 2.0))
+        assert store.load()[0] == job
+
+        store.update_runs([("a", 3.0, 2.5)])
+        store.remove(["b"])
+        (loaded,) = store.load()
+        assert (loaded.id, loaded.next_run, loaded.last_run) == ("a", 3.0, 2.5)
+
+    def test_replace(self, store):
+        store.add(StoredJob("a", "module:Job", "module:first", b"", b""))
+        store.add(StoredJob("a", "module:Job", "module:second", b"", b""))
+        assert [job.function for job in store.load()] == ["module:second"]
+
+
+class TestPersistentJobs:
+    def test_reload(self, store):
+        scheduler = restart(store)
+        due = datetime.now() + timedelta(seconds=0.2)
+        scheduler.once(due).do(record, 1, key="value").persist("once")
+        scheduler.every(10).minutes.do(record, 2).persist("every")
+
+        scheduler = restart(store)
+        assert len(scheduler.jobs) == 2
+        every = next(job for job in scheduler.jobs if job.unit == "minutes")
+        assert every.interval == 10
+        assert repr(every).startswith("Every 10 minutes do record(2)")
+
+        time.sleep(0.3)
+        run(scheduler)
+        assert calls == [((1,), {"key": "value"})]
+        # The one-time job is gone from the store once it ran.
+        assert [job.id for job in store.load()] == ["every"]
+
+    def test_next_run_is_updated(self, store):
+        scheduler = restart(store)
+        job = scheduler.every(10).minutes.do(record).persist()
+        job.next_run = datetime.now()
+        scheduler.reschedule(job)
+        run(scheduler)
+
+        (stored,) = store.load()
+        assert stored.next_run == pytest.approx(job.next_run.timestamp())
+        assert stored.last_run == pytest.approx(job.last_run.timestamp())
+
+    def test_methods_of_targets(self, store):
+        scheduler = restart(store)
+        counter = Counter()
+        scheduler.register_target("counter", counter)
+        scheduler.once(datetime.now()).do(counter.increment, 2).persist()
+
+        scheduler = restart(store)
+        scheduler.register_target("counter", counter)
+        run(scheduler)
+        assert counter.count == 2
+
+    def test_unpersistable_functions(self, store):
+        scheduler = restart(store)
+        with pytest.raises(ValueError):
+            scheduler.once(datetime.now()).do(lambda: None).persist()
+        with pytest.raises(ValueError):
+            scheduler.once(datetime.now()).do(Counter().increment).persist()
+        with pytest.raises(ValueError):
+            Scheduler().once(datetime.now()).do(record).persist()
+
+    def test_same_id_replaces_job(self, store):
+        scheduler = restart(store)
+        scheduler.every(10).minutes.do(record, 1).persist("job")
+        scheduler.every(10).minutes.do(record, 2).persist("job")
+        assert len(scheduler.jobs) == 1
+
+        scheduler = restart(store)
+        assert scheduler.jobs[0].job_func.args == (2,)
+
+    def test_cancel_removes_from_store(self, store):
+        scheduler = restart(store)
+        job = scheduler.every(10).minutes.do(record).persist()
+        scheduler.every(5).minutes.do(record).persist()
+        scheduler.cancel_job(job)
+        assert len(store.load()) == 1
+        scheduler.clear()
+        assert store.load() == []
+
+
+class TestMisfirePolicy:
+    def persist_missed(self, store, policy=None):
+        """Persists a one-time job and a job that runs every second, both of which
+        missed about three seconds worth of runs."""
+        scheduler = restart(store)
+        scheduler.once(datetime.now()).do(record, "once").persist("once", policy)
+        scheduler.every(1).seconds.do(record, "every").persist("every", policy)
+        missed = (datetime.now() - timedelta(seconds=2.5)).timestamp()
+        store.update_runs([("once", missed, None), ("every", missed, None)])
+
+    def run_names(self, scheduler: Scheduler, times: int = 1):
+        for _ in range(times):
+            run(scheduler)
+        return sorted(args[0] for args, _ in calls)
+
+    def test_run_once(self, store):
+        self.persist_missed(store)
+        scheduler = restart(store, misfire_policy=MisfirePolicy.RUN_ONCE)
+        assert self.run_names(scheduler, times=3) == ["every", "once"]
+
+    def test_run_all(self, store):
+        self.persist_missed(store)
+        scheduler = restart(store, misfire_policy=MisfirePolicy.RUN_ALL)
+        names = self.run_names(scheduler, times=4)
+        assert names == ["every", "every", "every", "once"]
+
+    def test_skip(self, store):
+        self.persist_missed(store)
+        scheduler = restart(store, misfire_policy=MisfirePolicy.SKIP)
+        assert self.run_names(scheduler) == []
+        assert [job.id for job in store.load()] == ["every"]
+        assert scheduler.jobs[0].next_run > datetime.now()
+
+    def test_job_policy_overrides_scheduler(self, store):
+        self.persist_missed(store, MisfirePolicy.SKIP)
+        scheduler = restart(store, misfire_policy=MisfirePolicy.RUN_ALL)
+        assert self.run_names(scheduler) == []
@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+from queue import Full
+
+import pytest
+
+from mmpy_bot.lanes import OrderedLanes
+from mmpy_bot.limiter import OverloadPolicy
+from mmpy_bot.threadpool import ThreadPool
+
+
+@pytest.fixture(scope="function")
+def threadpool():
+    pool = ThreadPool(num_workers=4)
+    pool.start()
+    yield pool
+    pool.stop()
+
+
+class TestOrderedLanes:
+    def test_run_in_order_per_key(self):
+        lanes = OrderedLanes()
+        events = []
+
+        async def job(key, index, delay):
+            events.append(("start", key, index))
+            await asyncio.sleep(delay)
+            events.append(("end", key, index))
+
+        async def scenario():
+            # Earlier jobs take longer, so without lanes they would finish last
+            await asyncio.gather(
+                lanes.run("a", job("a", 0, 0.03)),
+                lanes.run("a", job("a", 1, 0.02)),
+                lanes.run("b", job("b", 0, 0.01)),
+                lanes.run("a", job("a", 2, 0.0)),
+            )
+
+        asyncio.run(scenario())
+
+        a_events = [event for event in events if event[1] == "a"]
+        assert a_events == [
+            ("start", "a", 0),
+            ("end", "a", 0),
+            ("start", "a", 1),
+            ("end", "a", 1),
+            ("start", "a", 2),
+            ("end", "a", 2),
+        ]
+        # Lane b didn't have to wait for lane a
+        assert events.index(("end", "b", 0)) < events.index(("end", "a", 0))
+        assert len(lanes) == 0
+
+    def test_run_continues_after_exception(self):
+        lanes = OrderedLanes()
+
+        async def failing():
+            raise ValueError()
+
+        async def succeeding():
+            return "ok"
+
+        async def scenario():
+            return await asyncio.gather(
+                lanes.run("a", failing()),
+                lanes.run("a", succeeding()),
+                return_exceptions=True,
+            )
+
+        first, second = asyncio.run(scenario())
+        assert isinstance(first, ValueError)
+        assert second == "ok"
+
+    def test_submit_in_order_per_key(self, threadpool):
+        lanes = OrderedLanes()
+        results = {"a": [], "b": []}
+        lock = threading.Lock()
+        concurrent = {"a": 0, "max_a": 0}
+
+        def job(key, index):
+            with lock:
+                if key == "a":
+                    concurrent["a"] += 1
+                    concurrent["max_a"] = max(concurrent["max_a"], concurrent["a"])
+            time.sleep(0.01)
+            results[key].append(index)
+            with lock:
+                if key == "a":
+                    concurrent["a"] -= 1
+
+        for index in range(10):
+            assert not lanes.submit("a", threadpool, job, "a", index).cancelled()
+            assert not lanes.submit("b", threadpool, job, "b", index).cancelled()
+
+        deadline = time.time() + 5
+        while len(lanes) and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert results["a"] == list(range(10))
+        assert results["b"] == list(range(10))
+        assert concurrent["max_a"] == 1
+
+    def test_submit_dropped(self):
+        lanes = OrderedLanes()
+        pool = ThreadPool(
+            num_workers=1, max_queue_size=1, overload_policy=OverloadPolicy.DROP_OLDEST
+        )
+        pool.alive = True
+        first = lanes.submit("a", pool, print, "first")
+        second = lanes.submit("a", pool, print, "second")
+        # This drops the queued drain of lane a, which should free up the lane
+        assert not lanes.submit("b", pool, print, "third").cancelled()
+        assert first.cancelled() and second.cancelled()
+        assert pool.get_dropped_tasks() == 1
+        assert len(lanes) == 1
+
+    @pytest.mark.parametrize(
+        "policy", [OverloadPolicy.DROP_NEWEST, OverloadPolicy.BUSY]
+    )
+    def test_full_lane_drops_newest(self, policy):
+        lanes = OrderedLanes()
+        pool = ThreadPool(num_workers=1, max_queue_size=2, overload_policy=policy)
+        futures = [lanes.submit("a", pool, print, index) for index in range(5)]
+        assert [future.cancelled() for future in futures] == [False] * 2 + [True] * 3
+        assert lanes.dropped == 3
+        # The lane only takes up a single slot in the threadpool queue
+        assert pool.get_queued_tasks() == 1
+
+    def test_full_lane_drops_oldest(self):
+        lanes = OrderedLanes()
+        pool = ThreadPool(
+            num_workers=1, max_queue_size=2, overload_policy=OverloadPolicy.DROP_OLDEST
+        )
+        futures = [lanes.submit("a", pool, print, index) for index in range(4)]
+        assert [future.cancelled() for future in futures] == [True] * 2 + [False] * 2
+        assert lanes.dropped == 2
+
+    def test_full_lane_blocks(self):
+        lanes = OrderedLanes()
+        pool = ThreadPool(num_workers=1, max_queue_size=2)
+        results = []
+        futures = [lanes.submit("a", pool, results.append, index) for index in range(2)]
+        with pytest.raises(Full):
+            lanes.submit("a", pool, results.append, 2, block=False)
+
+        # Waits for the lane to make room once the threadpool runs.
+        submitter = threading.Thread(
+            target=lambda: futures.append(lanes.submit("a", pool, results.append, 2))
+        )
+        submitter.start()
+        time.sleep(0.05)
+        assert submitter.is_alive()
+        pool.start()
+        try:
+            submitter.join(timeout=5)
+            futures[-1].result(timeout=5)
+        finally:
+            pool.stop()
+        assert results == [0, 1, 2]
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from mmpy_bot.limiter import ConcurrencyLimiter, OverloadPolicy
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+class TestConcurrencyLimiter:
+    def test_unlimited(self):
+        async def scenario():
+            limiter = ConcurrencyLimiter()
+            tickets = [await limiter.acquire("plugin") for _ in range(100)]
+            assert all(ticket.result() for ticket in tickets)
+            assert limiter.stats()["running"] == 100
+
+        run(scenario())
+
+    def test_global_limit(self):
+        async def scenario():
+            limiter = ConcurrencyLimiter(max_concurrent=2, max_pending=10)
+            tickets = [await limiter.acquire("plugin") for _ in range(4)]
+            assert [ticket.done() for ticket in tickets] == [True, True, False, False]
+            assert limiter.stats() == {
+                "running": 2,
+                "pending": 2,
+                "admitted": 2,
+                "dropped": 0,
+            }
+
+            # Releasing a slot admits the oldest pending call
+            limiter.release("plugin")
+            assert tickets[2].result()
+            assert not tickets[3].done()
+
+        run(scenario())
+
+    def test_per_key_limit(self):
+        async def scenario():
+            limiter = ConcurrencyLimiter(max_per_key=1, max_pending=10)
+            first = await limiter.acquire("a")
+            second = await limiter.acquire("a")
+            # Another key is not held up by the pending call of the first one
+            other = await limiter.acquire("b")
+            assert first.result() and other.result()
+            assert not second.done()
+
+            limiter.release("b")
+            assert not second.done()
+            limiter.release("a")
+            assert second.result()
+
+        run(scenario())
+
+    @pytest.mark.parametrize(
+        "policy", [OverloadPolicy.DROP_NEWEST, OverloadPolicy.BUSY, "drop_newest"]
+    )
+    def test_drop_newest(self, policy):
+        async def scenario():
+            limiter = ConcurrencyLimiter(max_concurrent=1, max_pending=1, policy=policy)
+            await limiter.acquire("plugin")
+            pending = await limiter.acquire("plugin")
+            dropped = await limiter.acquire("plugin")
+            assert dropped.result() is False
+            assert not pending.done()
+            assert limiter.stats()["dropped"] == 1
+
+        run(scenario())
+
+    def test_drop_oldest(self):
+        async def scenario():
+            limiter = ConcurrencyLimiter(
+                max_concurrent=1, max_pending=1, policy=OverloadPolicy.DROP_OLDEST
+            )
+            await limiter.acquire("plugin")
+            oldest = await limiter.acquire("plugin")
+            newest = await limiter.acquire("plugin")
+            assert oldest.result() is False
+            assert not newest.done()
+
+            limiter.release("plugin")
+            assert newest.result()
+
+        run(scenario())
+
+    def test_block(self):
+        async def scenario():
+            limiter = ConcurrencyLimiter(
+                max_concurrent=1, max_pending=1, policy=OverloadPolicy.BLOCK
+            )
+            await limiter.acquire("plugin")
+            await limiter.acquire("plugin")
+
+            blocked = asyncio.create_task(limiter.acquire("plugin"))
+            await asyncio.sleep(0.01)
+            assert not blocked.done()
+
+            # Once the pending call is admitted there is room in the queue again
+            limiter.release("plugin")
+            ticket = await asyncio.wait_for(blocked, 1)
+            assert not ticket.done()
+            assert limiter.stats()["dropped"] == 0
+
+        run(scenario())
@@ -0,0 +1,152 @@
+import random
+import re
+
+import pytest
+
+from mmpy_bot.listener_index import ListenerIndex, literal_pattern, required_literals
+
+
+def linear_search(listeners, text):
+    return [
+        (match.span(), match.groups(), functions)
+        for matcher, functions in listeners.items()
+        if (match := matcher.search(text))
+    ]
+
+
+def indexed_search(index, text):
+    return [
+        (match.span(), match.groups(), functions)
+        for match, functions in index.search(text)
+    ]
+
+
+@pytest.mark.parametrize(
+    "pattern, expected",
+    [
+        ("^help$", [(True, "help")]),
+        (r"\Ahelp", [(True, "help")]),
+        ("sleep ([0-9]+)", [(False, "sleep ")]),
+        ("^click_command(?: |$)(.*)?", [(True, "click_command")]),
+        ("^busy|jobs$", [(True, "busy"), (False, "jobs")]),
+        (r"\bword\b", [(False, "word")]),
+        ("a+ longer literal", [(False, " longer literal")]),
+        ("^(group)", [(False, "group")]),
+        (".*", None),
+        ("^busy|.*", None),
+        ("[abc]", None),
+    ],
+)
+def test_required_literals(pattern, expected):
+    assert required_literals(re.compile(pattern)) == expected
+
+
+def test_required_literals_multiline():
+    # With MULTILINE, ^ may match after any newline so the literal isn't a prefix.
+    assert required_literals(re.compile("^help", re.MULTILINE)) == [(False, "help")]
+
+
+def test_required_literals_scoped_flags():
+    # The scoped group can't be part of an exact literal
+    assert required_literals(re.compile("ab(?i:c)de")) == [(False, "ab")]
+
+
+@pytest.mark.parametrize(
+    "pattern, expected",
+    [
+        ("ping", "ping"),
+        ("^ping$", "ping"),
+        (r"\Aping\Z", "ping"),
+        (r"ping\.x", "ping.x"),
+        ("pi.g", None),
+        ("(?i)ping", None),
+        ("a|b", None),
+    ],
+)
+def test_literal_pattern(pattern, expected):
+    assert literal_pattern(re.compile(pattern)) == expected
+
+
+PATTERNS = [
+    "^help$",
+    "^hello",
+    "hello",
+    "sleep ([0-9]+)",
+    "^busy|jobs$",
+    "^click_command(?: |$)(.*)?",
+    r"\bdeploy\b (\w+)",
+    "(?i)^status",
+    "^ping",
+    "Give me (.*)",
+    "[0-9]+ apples",
+    ".*",
+    "^$",
+    "ſtatus",
+    "(?i)ſtatus",
+    "^line$",
+]
+
+TEXTS = [
+    "",
+    "help",
+    "help me",
+    "hello there",
+    "say hello",
+    "sleep 5",
+    "please sleep 10 seconds",
+    "busy",
+    "any jobs",
+    "click_command --flag",
+    "click_commands",
+    "deploy prod",
+    "redeploy prod",
+    "STATUS?",
+    "Status report",
+    "ſtatus",
+    "ſTATUS",
+    "İstatus",
+    "Give me apples",
+    "12 apples",
+    "first\nline",
+    "line",
+]
+
+
+def test_index_equals_linear_scan():
+    listeners = {re.compile(p): [p] for p in PATTERNS}
+    listeners[re.compile("^hello", re.IGNORECASE)] = ["^hello (i)"]
+    listeners[re.compile("^line$", re.MULTILINE)] = ["^line$ (m)"]
+    index = ListenerIndex(listeners)
+
+    for text in TEXTS:
+        assert indexed_search(index, text) == linear_search(listeners, text), text
+
+
+def test_index_skips_impossible_patterns():
+    listeners = {re.compile(p): [p] for p in ["^help$", "sleep ([0-9]+)", ".*"]}
+    index = ListenerIndex(listeners)
+
+    # Only the catch-all pattern needs to be searched.
+    assert index.candidates("nothing to see here") == [2]
+    assert index.candidates("help") == [0, 2]
+    assert index.candidates("go to sleep 5") == [1, 2]
+
+
+def test_index_randomized():
+    rng = random.Random(1234)
+    alphabet = "abAB ^$"
+    words = ["ab", "ba", "aab", "bb", "a b", "AB"]
+    listeners = {}
+    for _ in range(200):
+        pattern = rng.choice(["", "^", r"\b"]) + rng.choice(words)
+        if rng.random() < 0.3:
+            pattern += "|" + rng.choice(["^", ""]) + rng.choice(words)
+        if rng.random() < 0.3:
+            pattern += "(.*)"
+        flags = re.IGNORECASE if rng.random() < 0.3 else 0
+        listeners[re.compile(pattern, flags)] = [pattern]
+    index = ListenerIndex(listeners)
+
+    for _ in range(500):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+        assert indexed_search(index, text) == linear_search(listeners, text), text
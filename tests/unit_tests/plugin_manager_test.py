@@ -8,6 +8,8 @@ from mmpy_bot import Plugin, Settings, listen_to, listen_webhook
 from mmpy_bot.driver import Driver
 from mmpy_bot.plugins import PluginManager
 
+from .event_handler_test import BOT_ID, create_message
+
 
 # Used in the plugin tests below
 class FakePlugin(Plugin):
@@ -171,3 +173,101 @@ class TestPluginManager:
                 assert hlp.pattern in map(lambda x: x.pattern, msg_listeners)
             elif hlp.help_type == "webhook":
                 assert hlp.pattern in map(lambda x: x.pattern, hook_listeners)
+
+    @mock.patch("mmpy_bot.driver.Driver.user_id", new=BOT_ID)
+    def test_match_message_listeners(self):
+        self.plugin_manager.initialize(Driver(), Settings())
+
+        def matched(**kwargs):
+            return [
+                function
+                for _, functions in self.plugin_manager.match_message_listeners(
+                    create_message(**kwargs)
+                )
+                for function in functions
+            ]
+
+        # needs_mention listeners are skipped unless the bot is mentioned
+        assert matched(text="pattern", mentions=[BOT_ID]) == [FakePlugin.my_function]
+        assert matched(text="pattern", mentions=[]) == []
+        # A direct message counts as a mention
+        assert matched(text="pattern", mentions=[], channel_type="D") == [
+            FakePlugin.my_function
+        ]
+
+        # direct_only listeners are skipped outside of direct messages, but the
+        # allowed_users restriction is left to the function since it replies.
+        assert matched(text="direct_pattern", mentions=[]) == []
+        assert matched(text="direct_pattern", mentions=[], channel_type="D") == [
+            FakePlugin.direct_function,
+            FakePlugin.my_function,
+        ]
+
+    @mock.patch("mmpy_bot.driver.Driver.user_id", new=BOT_ID)
+    def test_match_message_listeners_silent_restrictions(self):
+        class RestrictedPlugin(Plugin):
+            @listen_to("restricted", allowed_channels=["staff"], silence_fail_msg=True)
+            def channel_function(self, message):
+                pass
+
+            @listen_to("restricted", allowed_users=["admin"], silence_fail_msg=True)
+            def user_function(self, message):
+                pass
+
+            @listen_to("restricted", allowed_channels=["staff"])
+            def loud_function(self, message):
+                pass
+
+        plugin_manager = PluginManager([RestrictedPlugin()])
+        plugin_manager.initialize(Driver(), Settings())
+
+        def matched(**kwargs):
+            return {
+                function.name.split(".")[-1]
+                for _, functions in plugin_manager.match_message_listeners(
+                    create_message(text="restricted", **kwargs)
+                )
+                for function in functions
+            }
+
+        # The loud function always gets called so it can reply with an error
+        assert matched(channel_name="off-topic", sender_name="betty") == {
+            "loud_function"
+        }
+        assert matched(channel_name="staff", sender_name="betty") == {
+            "channel_function",
+            "loud_function",
+        }
+        assert matched(channel_name="off-topic", sender_name="admin") == {
+            "user_function",
+            "loud_function",
+        }
+
+    def test_match_webhook_listeners(self):
+        class HookPlugin(Plugin):
+            @listen_webhook("^deploy$")
+            def exact(self, event):
+                pass
+
+            @listen_webhook("deploy")
+            def substring(self, event):
+                pass
+
+            @listen_webhook("^build_[0-9]+$")
+            def numbered(self, event):
+                pass
+
+        plugin = HookPlugin()
+        manager = PluginManager([plugin])
+        manager.initialize(Driver(), Settings())
+
+        # Exact ids are routed through the table, in registration order
+        assert manager._webhook_routes["deploy"] == [plugin.exact, plugin.substring]
+        assert manager.match_webhook_listeners("deploy") == [
+            plugin.exact,
+            plugin.substring,
+        ]
+        # Other ids still fall back to a regular expression search
+        assert manager.match_webhook_listeners("deploy_now") == [plugin.substring]
+        assert manager.match_webhook_listeners("build_12") == [plugin.numbered]
+        assert manager.match_webhook_listeners("unknown") == []
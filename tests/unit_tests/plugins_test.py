@@ -1,13 +1,23 @@
 import asyncio
+import concurrent.futures
 from unittest import mock
 
+import pytest
+
 from mmpy_bot import Plugin, Settings, listen_to
 from mmpy_bot.driver import Driver
 from mmpy_bot.plugins import PluginManager
+from mmpy_bot.threadpool import TaskPriority, ThreadPool, TimedTask
 
 from .event_handler_test import create_message
 
 
+def finished_task(result=None) -> concurrent.futures.Future:
+    future: concurrent.futures.Future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+
 # Used in the plugin tests below
 class FakePlugin(Plugin):
     @listen_to("pattern", needs_mention=True)
@@ -21,9 +31,34 @@ class FakePlugin(Plugin):
         """Async function docstring."""
         pass
 
+    @listen_to("slow", timeout=0.1)
+    async def my_slow_function(self, message):
+        self.cancelled = False
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+    @listen_to("slow_sync")
+    def my_slow_sync_function(self, message):
+        pass
+
+    @listen_to("fail")
+    def my_failing_function(self, message):
+        raise ValueError(message.text)
+
+    @listen_to(".*", priority="background")
+    def my_logging_function(self, message):
+        pass
+
+    @listen_to("ordered", ordered_by="channel")
+    def my_ordered_function(self, message):
+        pass
+
 
 class TestPlugin:
-    @mock.patch("mmpy_bot.driver.ThreadPool.add_task")
+    @mock.patch("mmpy_bot.driver.ThreadPool.add_task", return_value=finished_task())
     def test_call_function(self, add_task):
         p = FakePlugin()
         # Functions only listen for events when initialized via PluginManager
@@ -35,9 +70,28 @@ class TestPlugin:
             p.call_function(FakePlugin.my_function, message, groups=["test", "another"])
         )
         add_task.assert_called_once_with(
-            FakePlugin.my_function, message, "test", "another"
+            FakePlugin.my_function,
+            message,
+            "test",
+            "another",
+            priority=TaskPriority.INTERACTIVE,
+            block=False,
         )
 
+        # The priority of the listener overrides that of the plugin.
+        add_task.reset_mock()
+        asyncio.run(p.call_function(FakePlugin.my_logging_function, message))
+        assert add_task.call_args.kwargs == {
+            "priority": TaskPriority.BACKGROUND,
+            "block": False,
+        }
+        p.priority = TaskPriority.BULK
+        asyncio.run(p.call_function(FakePlugin.my_function, message))
+        assert add_task.call_args.kwargs == {
+            "priority": TaskPriority.BULK,
+            "block": False,
+        }
+
         # Since this is an async function, it should be called directly through asyncio.
         message = create_message(text="async_pattern")
         with mock.patch.object(p.my_async_function, "function") as mock_function:
@@ -45,3 +99,84 @@ class TestPlugin:
                 p.call_function(FakePlugin.my_async_function, message, groups=[])
             )
             mock_function.assert_called_once_with(p, message)
+
+    def test_call_function_timeout(self, caplog):
+        p = FakePlugin()
+        PluginManager([p]).initialize(Driver(), Settings(LISTENER_TIMEOUT=2))
+
+        # Coroutines are cancelled at their deadline.
+        message = create_message(text="slow")
+        assert asyncio.run(p.call_function(FakePlugin.my_slow_function, message))
+        assert p.cancelled
+        (record,) = caplog.records
+        assert record.listener == "FakePlugin.my_slow_function"
+        assert record.executor == "async"
+
+        # Synchronous functions run as a TimedTask with the default timeout.
+        with mock.patch(
+            "mmpy_bot.driver.ThreadPool.add_task", return_value=finished_task()
+        ) as add_task:
+            message = create_message(text="slow_sync")
+            asyncio.run(p.call_function(FakePlugin.my_slow_sync_function, message))
+            task, *args = add_task.call_args.args
+        assert isinstance(task, TimedTask)
+        assert task.function is FakePlugin.my_slow_sync_function
+        assert task.timeout == 2
+        assert args == [message]
+
+    def test_call_function_awaits_threadpool(self):
+        p = FakePlugin()
+        driver = Driver()
+        PluginManager([p]).initialize(driver, Settings())
+        driver.threadpool = ThreadPool(num_workers=1)
+        driver.threadpool.start()
+        try:
+            # Exceptions of synchronous listeners reach the caller.
+            with pytest.raises(ValueError, match="fail"):
+                asyncio.run(
+                    p.call_function(
+                        FakePlugin.my_failing_function, create_message("fail")
+                    )
+                )
+            assert driver.threadpool.get_failed_tasks() == 1
+        finally:
+            driver.threadpool.stop()
+
+        # A full queue drops the call.
+        driver.threadpool = ThreadPool(
+            num_workers=1, max_queue_size=1, overload_policy="drop_newest"
+        )
+        driver.threadpool.add_task(print)
+        message = create_message("slow_sync")
+        assert not asyncio.run(
+            p.call_function(FakePlugin.my_slow_sync_function, message)
+        )
+
+    def test_call_function_full_queue(self):
+        p = FakePlugin()
+        driver = Driver()
+        PluginManager([p]).initialize(driver, Settings())
+        driver.threadpool = ThreadPool(num_workers=1, max_queue_size=1)
+        driver.threadpool.add_task(print)
+
+        async def scenario():
+            message = create_message("slow_sync")
+            calls = [
+                asyncio.create_task(
+                    p.call_function(FakePlugin.my_slow_sync_function, message)
+                ),
+                # Listeners that run in order per channel wait the same way.
+                asyncio.create_task(
+                    p.call_function(FakePlugin.my_ordered_function, message)
+                ),
+            ]
+            # The event loop keeps running while the calls wait for room in the queue.
+            await asyncio.sleep(0.1)
+            assert not any(call.done() for call in calls)
+            driver.threadpool.start()
+            return await asyncio.wait_for(asyncio.gather(*calls), timeout=5)
+
+        try:
+            assert asyncio.run(scenario()) == [True, True]
+        finally:
+            driver.threadpool.stop()
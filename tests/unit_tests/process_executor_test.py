@@ -0,0 +1,157 @@
+import asyncio
+import os
+import pickle
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from mmpy_bot import Plugin, Settings, listen_to
+from mmpy_bot.plugins import PluginManager
+from mmpy_bot.process_executor import Executor, ProcessExecutor
+from mmpy_bot.threadpool import TaskPriority, ThreadPool
+
+from .event_handler_test import create_message
+from .plugins_test import finished_task
+
+
+class FakeDriver:
+    """Records the calls that listener processes make through their DriverProxy."""
+
+    user_id = "bot_id"
+    username = "bot"
+
+    def __init__(self):
+        self.replies = []
+        self.process_executor = ProcessExecutor(self, num_processes=1)
+
+    def reply_to(self, message, response):
+        self.replies.append((message.text, response))
+        return {"message": response}
+
+    async def areply_to(self, message, response):
+        pass
+
+
+class CpuPlugin(Plugin):
+    executor = Executor.PROCESS
+
+    def __init__(self):
+        super().__init__()
+        self.greeting = "hello from"
+
+    @listen_to("pid")
+    def pid(self, message):
+        post = self.driver.reply_to(message, f"{self.greeting} {os.getpid()}")
+        assert post == {"message": f"{self.greeting} {os.getpid()}"}
+
+    @listen_to("async_reply")
+    def async_reply(self, message):
+        try:
+            self.driver.areply_to(message, "hi")
+        except TypeError:
+            self.driver.reply_to(message, "TypeError")
+
+    @listen_to("thread", executor="thread")
+    def thread(self, message):
+        self.driver.reply_to(message, threading.current_thread().name)
+
+
+class UnpicklablePlugin(Plugin):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+
+    @listen_to("pid", executor="process")
+    def pid(self, message):
+        pass
+
+
+class SlowPlugin(Plugin):
+    executor = Executor.PROCESS
+
+    @listen_to("slow", timeout=0.2)
+    def slow(self, message):
+        # Leaves plenty of time to notice the timeout while the call still runs
+        time.sleep(3)
+
+    @listen_to("fast")
+    def fast(self, message):
+        pass
+
+
+@pytest.fixture
+def driver():
+    driver = FakeDriver()
+    yield driver
+    driver.process_executor.stop()
+
+
+def initialize(driver, plugin: Plugin) -> Plugin:
+    PluginManager([plugin]).initialize(driver, Settings())
+    return plugin
+
+
+class TestProcessExecutor:
+    def test_call_function(self, driver):
+        plugin = initialize(driver, CpuPlugin())
+        message = create_message(text="pid")
+        assert asyncio.run(plugin.call_function(CpuPlugin.pid, message))
+        assert asyncio.run(plugin.call_function(CpuPlugin.async_reply, message))
+
+        pid_reply, async_reply = driver.replies
+        assert pid_reply[0] == "pid"
+        greeting, pid = pid_reply[1].rsplit(" ", 1)
+        assert greeting == "hello from"
+        assert int(pid) != os.getpid()
+        assert async_reply[1] == "TypeError"
+
+    def test_function_overrides_plugin(self, driver):
+        plugin = initialize(driver, CpuPlugin())
+        driver.threadpool = ThreadPool(num_workers=1)
+        driver.threadpool.add_task = mock.Mock(return_value=finished_task())
+        message = create_message()
+        assert asyncio.run(plugin.call_function(CpuPlugin.thread, message))
+        driver.threadpool.add_task.assert_called_once_with(
+            CpuPlugin.thread, message, priority=TaskPriority.INTERACTIVE, block=False
+        )
+        assert not driver.process_executor.running
+
+    def test_unpicklable_plugin(self, driver):
+        plugin = initialize(driver, UnpicklablePlugin())
+        with pytest.raises(TypeError, match="UnpicklablePlugin"):
+            asyncio.run(plugin.call_function(UnpicklablePlugin.pid, create_message()))
+
+    def test_coroutines_cant_use_processes(self):
+        with pytest.raises(ValueError):
+
+            @listen_to("async", executor="process")
+            async def listener(self, message):
+                pass
+
+    def test_plugin_pickle_drops_driver(self, driver):
+        plugin = pickle.loads(pickle.dumps(initialize(driver, CpuPlugin())))
+        assert plugin.driver is None and plugin.greeting == "hello from"
+
+    def test_timeout(self, driver, caplog):
+        plugin = initialize(driver, SlowPlugin())
+        message = create_message(text="slow")
+        # Start the process first, so the call isn't cancelled before it runs.
+        asyncio.run(driver.process_executor.run(SlowPlugin.fast, message))
+
+        async def scenario():
+            call = asyncio.create_task(plugin.call_function(SlowPlugin.slow, message))
+            deadline = time.monotonic() + 2.5
+            while not driver.process_executor.get_stuck_calls():
+                assert time.monotonic() < deadline
+                await asyncio.sleep(0.02)
+            # The call runs past its timeout, but keeps its process.
+            assert not call.done()
+            return await call
+
+        assert asyncio.run(scenario())
+        assert driver.process_executor.get_stuck_calls() == 0
+        (record,) = [r for r in caplog.records if r.msg.startswith("Listener")]
+        assert record.executor == "process"
+        assert record.plugin == "SlowPlugin"
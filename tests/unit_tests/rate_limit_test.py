@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import httpx
+
+from mmpy_bot.driver import Driver
+from mmpy_bot.rate_limit import RateLimiter, RequestPriority, request_priority
+
+from .event_handler_test import create_message
+
+
+class TestRateLimiter:
+    def test_pacing(self):
+        limiter = RateLimiter(rate=100, burst=2)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+        # Two requests fit in the burst, the other four have to wait 10ms each
+        assert time.monotonic() - start >= 0.035
+        assert limiter.stats()["requests"] == 6
+
+    def test_priority(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        limiter.acquire()
+        order = []
+
+        def request(name, priority):
+            with request_priority(priority):
+                limiter.acquire()
+            order.append(name)
+
+        threads = [
+            threading.Thread(target=request, args=("bulk", RequestPriority.BULK)),
+            threading.Thread(target=request, args=("normal", RequestPriority.NORMAL)),
+            threading.Thread(target=request, args=("reply", RequestPriority.HIGH)),
+        ]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.005)
+        for thread in threads:
+            thread.join()
+
+        assert order == ["reply", "normal", "bulk"]
+
+    def test_async_acquire(self):
+        limiter = RateLimiter(rate=100, burst=1)
+
+        async def scenario():
+            await asyncio.gather(*(limiter.acquire_async() for _ in range(3)))
+
+        asyncio.run(scenario())
+        assert limiter.stats()["requests"] == 3
+        assert limiter.stats()["waiting"] == 0
+
+    def test_disabled_by_default(self):
+        driver = Driver({"url": "chat.example.com", "port": 443})
+        assert driver.rate_limiter.rate == 0
+        start = time.monotonic()
+        for _ in range(200):
+            driver.rate_limiter.acquire()
+        assert time.monotonic() - start < 0.1
+
+    def test_headers(self):
+        limiter = RateLimiter(rate=10, burst=100)
+        response = httpx.Response(
+            200,
+            headers={
+                "X-RateLimit-Limit": "50",
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Reset": "1",
+            },
+        )
+        assert limiter.update(response, attempt=0) is None
+        assert limiter.burst == 50
+        assert limiter.tokens == 0
+        # The limiter waits for the reset before sending another request
+        with limiter._condition:
+            assert limiter._poll(limiter._enqueue()) > 0.9
+
+
+class TestRateLimitedClient:
+    def test_retry_throttled(self):
+        driver = Driver({"url": "chat.example.com", "port": 443}, rate_limit_retries=2)
+        driver.user_id = "bot_id"
+        responses = [
+            httpx.Response(429, headers={"Retry-After": "0"}, json={}),
+            httpx.Response(201, json={"id": "post_id"}),
+        ]
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return responses.pop(0)
+
+        driver.client.client = httpx.Client(transport=httpx.MockTransport(handler))
+        with mock.patch("mmpy_bot.rate_limit.time.sleep") as sleep:
+            assert driver.reply_to(create_message(), "hi") == {"id": "post_id"}
+
+        assert len(requests) == 2
+        # Backs off even though Retry-After is 0
+        sleep.assert_called_once_with(0.5)
+        assert driver.rate_limiter.stats()["throttled"] == 1
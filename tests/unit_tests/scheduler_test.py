@@ -1,6 +1,8 @@
+import os
 import tempfile
+import threading
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict
 from unittest.mock import Mock
@@ -8,6 +10,7 @@ from unittest.mock import Mock
 import pytest
 
 from mmpy_bot import schedule
+from mmpy_bot.scheduler import JobConcurrency, Scheduler
 from mmpy_bot.threadpool import ThreadPool
 
 
@@ -66,19 +69,18 @@ def test_recurring_single_call():
     mock.assert_called_once()
 
 
-@pytest.mark.skip(reason="Test runs in Thread-1 (not MainThread) but still blocks")
 def test_recurring_thread():
     def job(modifiable_arg: Dict):
         # Modify the variable, which should be shared with the main thread.
         modifiable_arg["count"] += 1
 
         # Since this should run in a separate thread, this shouldn't block anything.
-        time.sleep(5)
+        time.sleep(2)
 
     # Schedule the above to run every second in a separate thread, but not a separate
-    # process.
+    # process. The runs overlap, which jobs only do if they are allowed to.
     test_dict = {"count": 0}
-    schedule.every(1).seconds.do(job, test_dict)
+    schedule.every(1).seconds.concurrency("overlap").do(job, test_dict)
 
     start = time.time()
     end = start + 3.5  # We want to wait just over 3 seconds
@@ -90,9 +92,8 @@ def test_recurring_thread():
     # Start the pool thread
     pool.start()
 
-    while time.time() < end:
-        # Wait until we reach our 3+ second deadline
-        time.sleep(1)
+    # Wait until we reach our 3+ second deadline
+    time.sleep(end - time.time())
 
     # Stop the pool and scheduler loop
     pool.stop()
@@ -106,7 +107,6 @@ def test_recurring_thread():
     assert test_dict == {"count": 3}
 
 
-@pytest.mark.skip(reason="Test runs in Thread-1 (not MainThread) but still blocks")
 def test_recurring_subprocess():
     def job(path: str, modifiable_arg: Dict):
         path = Path(path)
@@ -119,12 +119,14 @@ def test_recurring_subprocess():
         modifiable_arg["changed"] = True
 
         # Since this should run in a separate process, this shouldn't block anything.
-        time.sleep(5)
+        time.sleep(2)
 
     with tempfile.NamedTemporaryFile("r") as file:
-        # Schedule the above to run every second in a subprocess.
+        # Schedule the above to run every second in a subprocess, with overlapping runs.
         test_dict = {}
-        schedule.every(1).seconds.do(job, file.name, test_dict).tag("subprocess")
+        schedule.every(1).seconds.concurrency("overlap").do(
+            job, file.name, test_dict
+        ).tag("subprocess")
 
         # Assert nothing has changed yet
         file.readline() == "0"
@@ -138,9 +140,8 @@ def test_recurring_subprocess():
         # Start the pool thread
         pool.start()
 
-        while time.time() < end:
-            # Wait until we reach our 3+ second deadline
-            time.sleep(1)
+        # Wait until we reach our 3+ second deadline
+        time.sleep(end - time.time())
 
         # Stop the pool and scheduler loop
         pool.stop()
@@ -155,3 +156,141 @@ def test_recurring_subprocess():
         file.seek(0)
         assert file.readline() == "3"
         assert test_dict == {}  # We expect the dict to not have been changed.
+
+
+def write_pid(path: str):
+    Path(path).write_text(str(os.getpid()))
+
+
+class TestHeapScheduler:
+    def setup_method(self):
+        self.scheduler = Scheduler()
+
+    def test_runs_due_jobs_in_order(self):
+        calls = []
+        now = datetime.now()
+        for offset in (3, -1, 60, -2):
+            self.scheduler.once(now + timedelta(seconds=offset)).do(
+                calls.append, offset
+            )
+        recurring = self.scheduler.every(10).minutes.do(calls.append, "every")
+        recurring.next_run = now - timedelta(seconds=1)
+        self.scheduler.reschedule(recurring)
+
+        self.scheduler.run_pending()
+        assert self.scheduler.join(timeout=5)
+        assert sorted(calls, key=str) == [-1, -2, "every"]
+        # One-time jobs were removed, the recurring job was rescheduled
+        assert len(self.scheduler.jobs) == 3
+        assert recurring in self.scheduler.jobs
+        assert self.scheduler.next_run == now + timedelta(seconds=3)
+
+    def test_list_interface(self):
+        later = datetime.now() + timedelta(hours=1)
+        job = self.scheduler.once(later).do(print).tag("a")
+        self.scheduler.once(later + timedelta(hours=1)).do(print).tag("b")
+        assert self.scheduler.get_jobs("a") == [job]
+
+        self.scheduler.clear("a")
+        assert self.scheduler.next_run == later + timedelta(hours=1)
+        self.scheduler.cancel_job(self.scheduler.jobs[0])
+        assert self.scheduler.jobs == []
+        assert self.scheduler.next_run is None
+
+        # Cancelled jobs don't run, even if they were due
+        job = self.scheduler.once(datetime.now()).do(Mock())
+        self.scheduler.cancel_job(job)
+        self.scheduler.run_pending()
+        assert self.scheduler.join(timeout=5)
+        job.job_func.func.assert_not_called()
+
+    def test_job_cancels_other_job(self):
+        now = datetime.now()
+        second = self.scheduler.once(now + timedelta(seconds=0.2)).do(Mock())
+        first = self.scheduler.once(now).do(lambda: self.scheduler.cancel_job(second))
+        self.scheduler.run_pending()
+        assert self.scheduler.join(timeout=5)
+        assert first not in self.scheduler.jobs
+        assert second not in self.scheduler.jobs
+        time.sleep(0.2)
+        self.scheduler.run_pending()
+        second.job_func.func.assert_not_called()
+
+    def test_wait_for_next_job(self):
+        start = time.perf_counter()
+        self.scheduler.once(datetime.now() + timedelta(seconds=0.1)).do(print)
+        self.scheduler.wait_for_next_job(timeout=5)
+        assert 0.05 < time.perf_counter() - start < 1
+
+        # Adding a job that is due earlier wakes up the waiting thread
+        self.scheduler.once(datetime.now() + timedelta(hours=1)).do(print)
+        self.scheduler.run_pending()
+        timer = threading.Timer(
+            0.1, lambda: self.scheduler.once(datetime.now()).do(print)
+        )
+        timer.start()
+        start = time.perf_counter()
+        self.scheduler.wait_for_next_job(timeout=5)
+        assert time.perf_counter() - start < 1
+        timer.join()
+
+    @pytest.mark.parametrize(
+        "policy, started_while_running, started",
+        [
+            (JobConcurrency.OVERLAP, 2, 2),
+            (JobConcurrency.SKIP, 1, 1),
+            (JobConcurrency.QUEUE, 1, 2),
+        ],
+    )
+    def test_concurrency_policy(self, policy, started_while_running, started):
+        gate = threading.Event()
+        runs = []
+
+        def slow_job():
+            runs.append(time.time())
+            gate.wait(5)
+
+        job = self.scheduler.every(1).seconds.concurrency(policy).do(slow_job)
+        job.next_run = datetime.now()
+        self.scheduler.reschedule(job)
+
+        start = time.perf_counter()
+        self.scheduler.run_pending()
+        # The scheduler doesn't wait for the job to finish
+        assert time.perf_counter() - start < 0.5
+        time.sleep(1.1)
+        self.scheduler.run_pending()
+        time.sleep(0.1)
+        assert len(runs) == started_while_running
+
+        gate.set()
+        assert self.scheduler.join(timeout=5)
+        assert len(runs) == started
+        assert job in self.scheduler.jobs
+        assert job.next_run > datetime.now()
+        self.scheduler.shutdown()
+
+    def test_subprocess_jobs(self, tmp_path):
+        scheduler = Scheduler(max_processes=1)
+        path = tmp_path / "pid"
+        job = scheduler.once(datetime.now()).do(write_pid, str(path)).tag("subprocess")
+        scheduler.run_pending()
+        assert scheduler.join(timeout=30)
+        first_pid = int(path.read_text())
+        assert first_pid != os.getpid()
+
+        # The process is reused for the next job
+        scheduler.once(datetime.now()).do(write_pid, str(path)).tag("subprocess")
+        scheduler.run_pending()
+        assert scheduler.join(timeout=30)
+        assert int(path.read_text()) == first_pid
+        assert job not in scheduler.jobs
+
+        # Functions that can't be pickled run in a new process each time
+        scheduler.once(datetime.now()).do(lambda: write_pid(str(path))).tag(
+            "subprocess"
+        )
+        scheduler.run_pending()
+        assert scheduler.join(timeout=30)
+        assert int(path.read_text()) not in (first_pid, os.getpid())
+        scheduler.shutdown()
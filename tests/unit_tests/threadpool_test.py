@@ -1,8 +1,15 @@
+import asyncio
+import threading
 import time
+from functools import partial
+from queue import Full
 
 import pytest
 
 from mmpy_bot.driver import ThreadPool
+from mmpy_bot.limiter import OverloadPolicy
+from mmpy_bot.threadpool import TaskPriority, TimedTask
+from mmpy_bot.timeouts import current_token
 
 
 @pytest.fixture(scope="function")
@@ -31,3 +38,278 @@ class TestThreadPool:
         assert threadpool.get_busy_workers() == 0
         threadpool.stop()
         assert not threadpool.alive
+
+    def test_drop_newest(self):
+        pool = ThreadPool(
+            num_workers=1, max_queue_size=2, overload_policy=OverloadPolicy.DROP_NEWEST
+        )
+        assert not pool.add_task(print, "first").cancelled()
+        assert not pool.add_task(print, "second").cancelled()
+        assert pool.add_task(print, "third").cancelled()
+        assert pool.get_queued_tasks() == 2
+        assert pool.get_dropped_tasks() == 1
+
+    def test_submit_async(self):
+        pool = ThreadPool(num_workers=1, max_queue_size=1)
+        pool.add_task(print, "first")
+        with pytest.raises(Full):
+            pool.add_task(print, "second", block=False)
+
+        async def scenario():
+            submit = asyncio.create_task(
+                pool.submit_async(partial(pool.add_task, sum, [1, 2]))
+            )
+            await asyncio.sleep(0.05)
+            # Waits for room without blocking the event loop
+            assert not submit.done()
+            pool.start()
+            future = await asyncio.wait_for(submit, timeout=5)
+            return await asyncio.wrap_future(future)
+
+        try:
+            assert asyncio.run(scenario()) == 3
+        finally:
+            pool.stop()
+
+    def test_drop_oldest(self):
+        pool = ThreadPool(
+            num_workers=1, max_queue_size=2, overload_policy=OverloadPolicy.DROP_OLDEST
+        )
+        # Dropping queued tasks only happens while the pool is running
+        pool.alive = True
+        first = pool.add_task(print, "first")
+        assert not pool.add_task(print, "second").cancelled()
+        assert not pool.add_task(print, "third").cancelled()
+        assert first.cancelled()
+        assert pool.get_dropped_tasks() == 1
+        assert [pool._queue.get_nowait()[1] for _ in range(2)] == [
+            ("second",),
+            ("third",),
+        ]
+
+    def test_completed_tasks(self, threadpool):
+        threadpool.start()
+        for index in range(20):
+            threadpool.add_task(print, index)
+        threadpool._queue.join()
+        assert threadpool.get_completed_tasks() == 20
+        assert threadpool.get_queued_tasks() == 0
+
+
+class TestElasticThreadPool:
+    def test_grows_when_tasks_wait(self):
+        pool = ThreadPool(
+            num_workers=2, max_workers=6, target_queue_wait=0.05, idle_timeout=60
+        )
+        pool.start()
+        release = threading.Event()
+        try:
+            for _ in range(10):
+                pool.add_task(release.wait, 5)
+            time.sleep(1)
+            assert pool.get_num_workers() == 6
+            assert pool.get_busy_workers() == 6
+            assert pool.get_queued_tasks() == 4
+            assert pool.get_queue_wait() > 0.5
+            release.set()
+            pool._queue.join()
+            assert pool.get_completed_tasks() == 10
+        finally:
+            release.set()
+            pool.stop()
+        assert pool.get_num_workers() == 0
+
+    def test_shrinks_when_idle(self):
+        pool = ThreadPool(
+            num_workers=1, max_workers=4, target_queue_wait=0.01, idle_timeout=0.2
+        )
+        pool.start()
+        try:
+            for _ in range(8):
+                pool.add_task(time.sleep, 0.2)
+            time.sleep(0.3)
+            assert pool.get_num_workers() > 1
+            time.sleep(1.5)
+            assert pool.get_num_workers() == 1
+            assert pool.get_completed_tasks() == 8
+        finally:
+            pool.stop()
+
+    def test_fixed_size_by_default(self):
+        pool = ThreadPool(num_workers=2)
+        pool.start()
+        release = threading.Event()
+        try:
+            for _ in range(5):
+                pool.add_task(release.wait, 5)
+            time.sleep(0.3)
+            assert pool.get_num_workers() == 2
+        finally:
+            release.set()
+            pool.stop()
+
+
+class TestTimedTask:
+    def test_stuck_worker_is_replaced(self, caplog):
+        pool = ThreadPool(num_workers=1, target_queue_wait=0.05)
+        pool.start()
+        release = threading.Event()
+        tokens = []
+
+        def hang():
+            tokens.append(current_token())
+            release.wait(5)
+
+        try:
+            pool.add_task(TimedTask(hang, 0.1, name="hang", plugin="TestPlugin"))
+            time.sleep(0.5)
+            assert tokens[0].cancelled
+            assert pool.get_stuck_workers() == 1
+            assert pool.get_timed_out_tasks() == 1
+            # A new worker took over, so other tasks still run.
+            done = threading.Event()
+            pool.add_task(done.set)
+            assert done.wait(1)
+            assert pool.get_num_workers() == 1
+
+            (record,) = [r for r in caplog.records if r.msg.startswith("Listener")]
+            assert record.listener == "hang"
+            assert record.plugin == "TestPlugin"
+            assert record.timeout == 0.1
+        finally:
+            release.set()
+            time.sleep(0.1)
+            pool.stop()
+        assert pool.get_stuck_workers() == 0
+        assert pool.get_completed_tasks() == 2
+
+    def test_cancellation_token(self):
+        pool = ThreadPool(num_workers=1, target_queue_wait=0.05)
+        pool.start()
+        finished = threading.Event()
+
+        def cooperative():
+            token = current_token()
+            while not token.wait(0.05):
+                pass
+            finished.set()
+            token.raise_if_cancelled()
+
+        try:
+            pool.add_task(TimedTask(cooperative, 0.1))
+            assert finished.wait(2)
+            time.sleep(0.1)
+            assert pool.get_stuck_workers() == 0
+            assert pool.get_timed_out_tasks() == 1
+        finally:
+            pool.stop()
+
+    def test_no_timeout_outside_of_pool(self):
+        assert TimedTask(lambda: current_token().cancelled, 0)() is False
+
+
+class TestDrain:
+    def test_stop_waits_for_tasks(self):
+        pool = ThreadPool(num_workers=2)
+        pool.start()
+        for _ in range(6):
+            pool.add_task(time.sleep, 0.1)
+        abandoned = pool.stop(timeout=5)
+        assert abandoned == {"queued_tasks": 0, "running_tasks": 0, "scheduled_jobs": 0}
+        assert pool.get_completed_tasks() == 6
+        assert pool.get_num_workers() == 0
+
+    def test_stop_deadline(self):
+        pool = ThreadPool(num_workers=1)
+        pool.start()
+        release = threading.Event()
+        tokens = []
+
+        def hang():
+            tokens.append(current_token())
+            release.wait(5)
+
+        try:
+            pool.add_task(TimedTask(hang, 60))
+            for _ in range(3):
+                pool.add_task(print, "never")
+            time.sleep(0.1)
+            started = time.monotonic()
+            abandoned = pool.stop(timeout=0.3)
+            assert time.monotonic() - started < 2
+            assert abandoned == {
+                "queued_tasks": 3,
+                "running_tasks": 1,
+                "scheduled_jobs": 0,
+            }
+            assert tokens[0].cancelled
+            assert pool.get_queued_tasks() == 0
+        finally:
+            release.set()
+
+
+class TestTaskFuture:
+    def test_result_and_exception(self, threadpool, caplog):
+        threadpool.start()
+        assert threadpool.add_task(sum, [1, 2]).result(timeout=1) == 3
+        with pytest.raises(ZeroDivisionError):
+            threadpool.add_task(divmod, 1, 0).result(timeout=1)
+        assert threadpool.get_failed_tasks() == 1
+        # Retrieved exceptions aren't logged.
+        assert not [r for r in caplog.records if r.levelname == "ERROR"]
+
+        # Nobody waits for this one, so its exception is logged.
+        threadpool.add_task(divmod, 1, 0)
+        threadpool._queue.join()
+        time.sleep(0.1)
+        (record,) = [r for r in caplog.records if r.levelname == "ERROR"]
+        assert record.msg == "Unhandled exception in task divmod"
+
+    def test_cancel_queued_task(self):
+        pool = ThreadPool(num_workers=1)
+        calls = []
+        future = pool.add_task(calls.append, 1)
+        assert future.cancel()
+        pool.start()
+        pool.add_task(calls.append, 2).result(timeout=1)
+        pool.stop()
+        assert calls == [2]
+
+
+class TestPriorities:
+    def test_run_by_priority(self):
+        pool = ThreadPool(num_workers=1)
+        calls = []
+        for priority in ["bulk", "background", "interactive", "background"]:
+            pool.add_task(calls.append, priority, priority=priority)
+        pool.start()
+        pool.stop()
+        assert calls == ["interactive", "background", "background", "bulk"]
+
+    def test_aging(self):
+        pool = ThreadPool(num_workers=1, priority_aging=0.05)
+        calls = []
+        pool.add_task(calls.append, "bulk", priority=TaskPriority.BULK)
+        time.sleep(0.15)
+        pool.add_task(calls.append, "interactive")
+        pool.start()
+        pool.stop()
+        # The bulk task waited long enough to go first.
+        assert calls == ["bulk", "interactive"]
+
+    def test_drop_least_urgent(self):
+        pool = ThreadPool(
+            num_workers=1, max_queue_size=2, overload_policy=OverloadPolicy.DROP_OLDEST
+        )
+        pool.alive = True
+        pool.add_task(print, "interactive")
+        bulk = pool.add_task(print, "bulk", priority=TaskPriority.BULK)
+        assert not pool.add_task(print, "background", priority="background").cancelled()
+        assert bulk.cancelled()
+        # Everything that's queued is more urgent than this one.
+        assert pool.add_task(print, "bulk", priority=TaskPriority.BULK).cancelled()
+        assert pool.get_dropped_tasks() == 2
+        assert [pool._queue.get_nowait()[1] for _ in range(2)] == [
+            ("interactive",),
+            ("background",),
+        ]
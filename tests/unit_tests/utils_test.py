@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import time
+
+from mmpy_bot.utils import AsyncQueue
+
+
+class TestAsyncQueue:
+    def test_get_async_from_other_thread(self):
+        queue = AsyncQueue()
+
+        def producer():
+            time.sleep(0.05)
+            queue.put("item")
+
+        async def consumer():
+            threading.Thread(target=producer).start()
+            start = time.perf_counter()
+            item = await asyncio.wait_for(queue.get_async(), 1)
+            return item, time.perf_counter() - start
+
+        item, waited = asyncio.run(consumer())
+        assert item == "item"
+        # Woken up right away instead of at the next poll
+        assert waited < 0.5
+        assert queue.empty()
+
+    def test_get_async_queued_items(self):
+        queue = AsyncQueue()
+        for item in range(3):
+            queue.put(item)
+
+        async def consumer():
+            return [await queue.get_async() for _ in range(3)]
+
+        assert asyncio.run(consumer()) == [0, 1, 2]
+
+    def test_blocking_interface(self):
+        queue = AsyncQueue()
+        queue.put("item")
+        assert queue.qsize() == 1
+        assert queue.get_nowait() == "item"
+
+    def test_put_many(self):
+        queue = AsyncQueue()
+
+        async def consumer():
+            waiter = asyncio.create_task(queue.get_async())
+            await asyncio.sleep(0)
+            queue.put_many(range(3))
+            return [await waiter, await queue.get_async(), queue.get_nowait()]
+
+        assert asyncio.run(consumer()) == [0, 1, 2]
+        assert queue.unfinished_tasks == 3
+
+        bounded = AsyncQueue(maxsize=2)
+        bounded.put_many(["a", "b"])
+        assert bounded.full()
@@ -0,0 +1,119 @@
+import asyncio
+import re
+import time
+
+import pytest
+from aiohttp import ClientSession, UnixConnector
+
+from mmpy_bot import Settings
+from mmpy_bot.webhook_cluster import WebHookCluster
+from mmpy_bot.webhook_server import NoResponse
+
+
+async def respond(cluster: WebHookCluster):
+    """Plays the part of the bot's EventHandler."""
+    while True:
+        event = await cluster.event_queue.get_async()
+        if event.webhook_id == "silent":
+            response = NoResponse
+        elif event.webhook_id == "ignored":
+            continue
+        else:
+            response = {"text": event.text, "team": event.route_params.get("team")}
+        cluster.response_queue.put((event.request_id, response))
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    cluster = WebHookCluster(
+        url=Settings().WEBHOOK_HOST_URL,
+        port=0,
+        num_processes=2,
+        socket_path=str(tmp_path / "webhooks.sock"),
+        response_timeout=5,
+    )
+    cluster.add_route("/teams/{team}/hooks/{webhook_id}")
+    cluster.set_response_deadline(re.compile("^ignored$"), 0.1, 200)
+    cluster.start()
+    yield cluster
+    cluster.stop()
+
+
+class TestWebHookCluster:
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            WebHookCluster(url="http://127.0.0.1", port=0, num_processes=0)
+        with pytest.raises(ValueError):
+            WebHookCluster(url="http://127.0.0.1", port=0).add_route("/hooks")
+
+    def test_route_responses(self, cluster):
+        async def scenario():
+            responder = asyncio.create_task(respond(cluster))
+            async with ClientSession(
+                connector=UnixConnector(path=cluster.socket_path)
+            ) as session:
+
+                async def post(path, data):
+                    async with session.post(f"http://localhost{path}", json=data) as r:
+                        return r.status, await r.json() if r.status == 200 else None
+
+                responses = await asyncio.gather(
+                    *(post("/hooks/echo", {"text": str(i)}) for i in range(20))
+                )
+                # Every response reached the process that received its request
+                assert responses == [
+                    (200, {"text": str(i), "team": None}) for i in range(20)
+                ]
+                assert await post("/teams/core/hooks/echo", {"text": "hi"}) == (
+                    200,
+                    {"text": "hi", "team": "core"},
+                )
+                async with session.post(
+                    "http://localhost/hooks/silent", json={}
+                ) as response:
+                    assert response.status == 200
+                # The deadline was passed on to the processes
+                async with session.post(
+                    "http://localhost/hooks/ignored", json={}
+                ) as response:
+                    assert response.status == 200
+            responder.cancel()
+
+        asyncio.run(scenario())
+        metrics = cluster.get_metrics()
+        assert metrics["processes"] == 2
+        assert metrics["received"] == 23
+
+        # The ignored request is forgotten once its deadline passed
+        deadline = time.monotonic() + 5
+        while cluster.get_metrics()["in_flight"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert cluster.get_metrics()["in_flight"] == 0
+
+    def test_draining(self, cluster):
+        cluster.draining = True
+
+        async def scenario():
+            async with ClientSession(
+                connector=UnixConnector(path=cluster.socket_path)
+            ) as session:
+
+                async def post():
+                    async with session.post(
+                        "http://localhost/hooks/silent", json={}
+                    ) as response:
+                        return response.status
+
+                # The processes may take a moment to receive the drain message
+                await asyncio.sleep(0.2)
+                return await asyncio.gather(*(post() for _ in range(8)))
+
+        # Every process turns the requests away, none of them reach the bot
+        assert asyncio.run(scenario()) == [503] * 8
+        assert cluster.event_queue.empty()
+
+    def test_stop(self, cluster):
+        processes = list(cluster._processes)
+        cluster.stop()
+        assert not any(process.is_alive() for process in processes)
+        assert cluster.get_metrics()["processes"] == 0
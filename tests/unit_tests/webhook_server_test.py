@@ -1,9 +1,11 @@
 import asyncio
+import re
 import threading
 import time
 
 import pytest
 from aiohttp import ClientSession
+from aiohttp.test_utils import TestClient, TestServer
 
 from mmpy_bot import Settings
 from mmpy_bot.threadpool import ThreadPool
@@ -102,3 +104,172 @@ class TestWebHookServer:
         thread = threading.Thread(target=provide_response)
         thread.start()
         assert asyncio.run(send_request({"text": "Hello!"})) == response
+
+    def test_response_deadline(self):
+        server = WebHookServer(
+            url=Settings().WEBHOOK_HOST_URL, port=0, response_timeout=0.05
+        )
+        server.set_response_deadline(re.compile("^lenient"), status=200)
+        assert server.get_response_deadline("lenient_hook") == (0.05, 200)
+        assert server.get_response_deadline("other_hook") == (0.05, 504)
+        # Deadlines follow the same unanchored matching as the dispatch of webhooks.
+        server.set_response_deadline(re.compile("build"), timeout=5)
+        assert server.get_response_deadline("ci-build") == (5, 504)
+
+        async def scenario():
+            responses = asyncio.create_task(server._obtain_responses_loop())
+            async with TestClient(TestServer(server.app)) as client:
+                response = await client.post("/hooks/strict_hook", json={})
+                assert response.status == 504
+                response = await client.post("/hooks/lenient_hook", json={})
+                assert response.status == 200
+
+                # The orphaned response handlers were cleaned up
+                assert server.response_handlers == {}
+                # Responses that arrive after the deadline are discarded
+                event = server.event_queue.get_nowait()
+                server.response_queue.put((event.request_id, {"text": "late"}))
+                await asyncio.sleep(0.01)
+            responses.cancel()
+
+        asyncio.run(scenario())
+        assert server.get_metrics() == {
+            "in_flight": 0,
+            "received": 2,
+            "batches": 0,
+            "timed_out": 2,
+            "late_responses": 1,
+        }
+
+    def test_add_route(self):
+        server = WebHookServer(url=Settings().WEBHOOK_HOST_URL, port=0)
+        with pytest.raises(ValueError):
+            server.add_route("/teams/{team}/hooks")
+        server.add_route("/teams/{team}/hooks/{webhook_id}")
+
+        async def scenario():
+            responses = asyncio.create_task(server._obtain_responses_loop())
+            async with TestClient(TestServer(server.app)) as client:
+                request = asyncio.create_task(
+                    client.post("/teams/core/hooks/deploy", json={"text": "Hi"})
+                )
+                event = await server.event_queue.get_async()
+                assert event.webhook_id == "deploy"
+                assert event.route_params == {"team": "core"}
+                server.response_queue.put((event.request_id, {"text": "Hi!"}))
+                response = await request
+                assert await response.json() == {"text": "Hi!"}
+            responses.cancel()
+
+        asyncio.run(scenario())
+
+    def test_process_batch(self):
+        server = WebHookServer(
+            url=Settings().WEBHOOK_HOST_URL,
+            port=0,
+            response_timeout=0.2,
+            batch_max_events=3,
+        )
+
+        async def respond():
+            while True:
+                event = await server.event_queue.get_async()
+                if event.webhook_id == "ping":
+                    response = {"text": event.text.upper()}
+                elif event.webhook_id == "silent":
+                    response = NoResponse
+                else:
+                    continue
+                server.response_queue.put((event.request_id, response))
+
+        async def scenario():
+            tasks = [
+                asyncio.create_task(server._obtain_responses_loop()),
+                asyncio.create_task(respond()),
+            ]
+            async with TestClient(TestServer(server.app)) as client:
+                events = [
+                    {"webhook_id": "ping", "data": {"text": "hi"}},
+                    {"data": {}},
+                    {"webhook_id": "silent"},
+                ]
+                response = await client.post("/hooks/batch", json=events)
+                assert await response.json() == {
+                    "results": [
+                        {"status": 200, "response": {"text": "HI"}},
+                        {"status": 400, "reason": "Missing webhook_id."},
+                        {"status": 200},
+                    ]
+                }
+
+                # Newline-delimited JSON, with events that time out
+                response = await client.post(
+                    "/hooks/batch",
+                    data=b'{"webhook_id": "ping", "data": {"text": "a"}}\n'
+                    b'{"webhook_id": "ignored"}\n',
+                    headers={"Content-Type": "application/x-ndjson"},
+                )
+                assert [r["status"] for r in (await response.json())["results"]] == [
+                    200,
+                    504,
+                ]
+
+                # A single acknowledgment, without waiting for the listeners
+                response = await client.post(
+                    "/hooks/batch?ack=1", json={"events": events[:1]}
+                )
+                assert response.status == 202
+                assert await response.json() == {
+                    "status": "accepted",
+                    "accepted": 1,
+                    "rejected": 0,
+                }
+                await asyncio.sleep(0.01)
+                assert server._detached == set()
+
+                # Unanswered acknowledged events are forgotten after the deadline
+                response = await client.post(
+                    "/hooks/batch?ack=1", json=[{"webhook_id": "ignored"}]
+                )
+                assert response.status == 202
+                assert len(server._detached) == 1
+                await asyncio.sleep(0.3)
+                assert server._detached == set()
+
+                # Items sharing a trigger_id would share their response
+                action = {"webhook_id": "silent", "data": {"trigger_id": "t1"}}
+                response = await client.post("/hooks/batch", json=[action, action])
+                assert await response.json() == {
+                    "results": [
+                        {"status": 200},
+                        {"status": 400, "reason": "Duplicate trigger_id."},
+                    ]
+                }
+
+                response = await client.post("/hooks/batch", json=events * 2)
+                assert response.status == 413
+                response = await client.post("/hooks/batch", json={"text": "hi"})
+                assert response.status == 400
+            for task in tasks:
+                task.cancel()
+
+        asyncio.run(scenario())
+        metrics = server.get_metrics()
+        assert metrics["batches"] == 5
+        assert metrics["received"] == 7
+        assert metrics["timed_out"] == 1
+        assert metrics["late_responses"] == 0
+
+    def test_draining(self):
+        server = WebHookServer(url=Settings().WEBHOOK_HOST_URL, port=0)
+        server.draining = True
+
+        async def scenario():
+            async with TestClient(TestServer(server.app)) as client:
+                response = await client.post("/hooks/ping", json={})
+                assert response.status == 503
+                response = await client.post("/hooks/batch", json=[])
+                assert response.status == 503
+            assert server.event_queue.empty()
+
+        asyncio.run(scenario())
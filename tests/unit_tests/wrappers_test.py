@@ -0,0 +1,99 @@
+import json
+import pickle
+
+from mmpy_bot.wrappers import Message, WebHookEvent
+
+from .event_handler_test import BOT_ID, create_message
+
+
+def raw_message(**kwargs):
+    body = create_message(**kwargs).body
+    body["data"]["post"] = json.dumps(body["data"]["post"])
+    body["data"]["mentions"] = json.dumps(body["data"]["mentions"])
+    return body
+
+
+class TestMessage:
+    def test_lazy_decoding(self):
+        body = raw_message(text="hello")
+        message = Message(body)
+        data = message.body["data"]
+
+        # The post is decoded right away, the mentions only once they are needed
+        assert message.text == "hello"
+        assert isinstance(data["post"], dict)
+        assert isinstance(data["mentions"], str)
+
+        assert message.mentions == [BOT_ID]
+        assert data["mentions"] == [BOT_ID]
+
+    def test_missing_mentions(self):
+        body = create_message().body
+        del body["data"]["mentions"]
+        assert Message(body).mentions == []
+
+        body["data"]["mentions"] = ""
+        message = Message(body, raw_body=json.dumps(body))
+        assert message.mentions == []
+        assert message.body["data"]["mentions"] == []
+
+    def test_slots(self):
+        message = create_message()
+        # The extracted fields live in slots, but other attributes can still be set.
+        message.custom_attribute = True
+        assert message.__dict__ == {"custom_attribute": True}
+
+        restored = pickle.loads(pickle.dumps(message))
+        assert restored.custom_attribute is True
+        assert restored.text == message.text
+
+    def test_missing_message(self):
+        body = create_message().body
+        del body["data"]["post"]["message"]
+        assert Message(body).text == ""
+
+    def test_set_body(self):
+        message = create_message(text="hello")
+        body = create_message(text="goodbye").body
+        body["data"]["post"]["root_id"] = "root_id"
+        message.body = body
+        assert message.text == "goodbye"
+        assert message.reply_id == "root_id"
+        assert message.body is body
+
+    def test_raw_body(self):
+        body = raw_message(text="@my_username hello", mentions=[BOT_ID])
+        post = json.loads(body["data"]["post"])
+        # E.g. the event handler strips off the mention of the bot
+        post["message"] = "hello"
+        body["data"]["post"] = post
+        message = Message(body, raw_body=json.dumps(raw_message()))
+
+        assert message._body is None
+        assert message.text == "hello"
+        assert message.mentions == [BOT_ID]
+        # Commonly read post fields don't require decoding the full body either
+        assert message.file_ids == []
+        assert message.parent_id == ""
+        assert message.team_id == "au64gza3iint3r31e7ewbrrasw"
+        assert message._body is None
+
+        # The full body is only decoded when needed, and keeps the modified text
+        assert message.body["data"]["post"]["message"] == "hello"
+        assert message.body["data"]["mentions"] == [BOT_ID]
+
+
+class TestWebHookEvent:
+    def test_properties(self):
+        event = WebHookEvent(
+            {"text": "hello", "channel": "off-topic"},
+            request_id="request_id",
+            webhook_id="webhook_id",
+        )
+        assert event.text == "hello"
+        assert event.channel_name == "off-topic"
+        assert event.props == {}
+        assert not event.responded
+        # Other attributes can still be set, as before the fields moved to slots
+        event.custom_attribute = True
+        assert event.custom_attribute